@@ -91,6 +91,23 @@ group.add_option('--logo', dest='logo', action='store_true',
 parser.add_option_group(group)
 del group
 
+group = OptionGroup(parser, 'Rendering',
+                    'Use these options to render a slide to an image without '
+                    'opening ExpoSong')
+group.add_option('--render', dest='render', action='store', metavar='FILE',
+                 help='Render a slide of the presentation file.')
+group.add_option('--theme', dest='theme', action='store', metavar='FILE',
+                 help='The theme file to render the slide with.')
+group.add_option('--slide', dest='slide', action='store', type='int',
+                 default=0, help='The number of the slide, starting at 0.')
+group.add_option('--size', dest='size', action='store', default='1024x768',
+                 help='The size of the image, like 1024x768.')
+group.add_option('--output', dest='output', action='store',
+                 default='slide.png', metavar='FILE',
+                 help='The PNG file to write to.')
+parser.add_option_group(group)
+del group
+
 (options, args) = parser.parse_args()
 if not isinstance(options.import_, list):
     options.import_ = []
@@ -177,8 +194,10 @@ gettext.bindtextdomain('exposong', LOCALE_PATH)
 gettext.textdomain('exposong')
 __builtin__._ = gettext.gettext
 
-# Make sure only one instance of ExpoSong is running
-import exposong._instance
+# Make sure only one instance of ExpoSong is running. Rendering a slide does
+# not start the program, so it can run beside it.
+if not options.render:
+    import exposong._instance
 
 # This needs to be after we locate SHARED_FILES, but before DATA_PATH is
 # defined.
@@ -222,4 +241,7 @@ for folder in ('pres', 'pres/res', 'sched', 'theme', 'theme/res'):
         os.mkdir(normpath(join(DATA_PATH, folder)))
 
 # Import this last.
-from exposong.main import run
+if options.render:
+    from exposong.render import run
+else:
+    from exposong.main import run
@@ -0,0 +1,202 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Plays animated backgrounds.
+
+An animation is an animated image, such as a GIF, or a folder of images that
+are shown in alphabetical order. The frames are decoded and scaled on a worker
+thread into a small ring buffer, a few frames ahead of the one being shown, so
+only a bounded number of frames is held in memory.
+"""
+
+import collections
+import gobject
+import gtk.gdk
+import os
+import os.path
+import threading
+from gtk.gdk import pixbuf_new_from_file as pb_new
+
+import exposong
+import exposong.theme
+import exposong.worker
+
+# The number of decoded frames kept ahead of the frame being shown.
+RING_SIZE = 6
+
+# The highest frame rate animations are played at.
+MAX_FRAME_RATE = 25
+
+# The lowest frame rate of a folder of images.
+MIN_FRAME_RATE = 0.1
+
+# Decoding stops after this many frames failed in a row, and the last frame
+# stays on the screen.
+MAX_DECODE_ERRORS = 3
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+_worker = exposong.worker.WorkerPool("animations")
+
+
+def get_first_frame(filename):
+    "Return the file with the first frame of an animation, or None."
+    if os.path.isdir(filename):
+        files = _get_sequence(filename)
+        if files:
+            return files[0]
+        return None
+    if os.path.isfile(filename):
+        return filename
+    return None
+
+def get_frame_rate(frame_rate):
+    "Return `frame_rate` limited to the frame rates animations are played at."
+    return min(max(frame_rate, MIN_FRAME_RATE), MAX_FRAME_RATE)
+
+def _get_sequence(folder):
+    "Return the image files of a folder in the order they are played."
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+            if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]
+
+def _iter_frames(filename, frame_rate):
+    """
+    Yield (pixbuf, delay in seconds) for the frames of an animation, looping
+    forever. This runs on the worker thread.
+    """
+    if os.path.isdir(filename):
+        files = _get_sequence(filename)
+        if not files:
+            return
+        while True:
+            decoded = False
+            for path in files:
+                try:
+                    pb = pb_new(path)
+                except gobject.GError:
+                    # Skip an image that cannot be read.
+                    continue
+                decoded = True
+                yield pb, 1.0 / frame_rate
+            if not decoded:
+                return
+    anim = gtk.gdk.PixbufAnimation(filename)
+    if anim.is_static_image():
+        pb = anim.get_static_image()
+        while True:
+            yield pb, 1.0
+    # Walk through the animation with its own clock, not the real time.
+    clock = 0.0
+    it = anim.get_iter(clock)
+    while True:
+        delay = it.get_delay_time()
+        if delay < 0:
+            # The last frame of an animation that does not loop.
+            delay = 1000
+        # The pixbuf is reused by the iterator, so keep a copy.
+        yield it.get_pixbuf().copy(), max(delay / 1000.0, 1.0 / frame_rate)
+        clock += delay / 1000.0
+        it.advance(clock)
+
+
+class FrameRing(object):
+    """
+    A ring buffer of the decoded frames of an animation, at one size.
+    
+    filename:   An animated image, or a folder of images.
+    size:       The [width, height] the frames are scaled to.
+    aspect:     How the frames are scaled, see exposong.theme.
+    frame_rate: The frames per second of an image folder, and the highest
+                frame rate of an animated image.
+    """
+    def __init__(self, filename, size, aspect, frame_rate):
+        self.filename = filename
+        self.size = tuple(size)
+        self.aspect = aspect
+        self.frame_rate = get_frame_rate(frame_rate)
+        self._frames = collections.deque()
+        self._source_lock = threading.Lock()
+        self._source = _iter_frames(filename, self.frame_rate)
+        self._pending = False
+        self._closed = False
+        # The number of frames that failed to decode in a row.
+        self._errors = 0
+        self._shown = None
+        self._current = None
+        self._fill()
+    
+    def close(self):
+        "Stop decoding, and release the frames."
+        self._closed = True
+        self._frames.clear()
+        self._current = None
+    
+    def get_current(self):
+        "Return the frame to show, or None if none was decoded yet."
+        if self._current is None:
+            return None
+        return self._current[0]
+    
+    def advance(self, now):
+        """
+        Move on to the frame that should be shown at the time `now`.
+        
+        Returns True if the frame changed. If the next frame is not decoded
+        yet, the current one stays on the screen a little longer.
+        """
+        if self._current is not None and \
+                now < self._shown + self._current[1]:
+            return False
+        if not self._frames:
+            return False
+        self._current = self._frames.popleft()
+        self._shown = now
+        self._fill()
+        return True
+    
+    def _fill(self):
+        "Decode the next frame, if the ring is not full."
+        if self._pending or self._closed or len(self._frames) >= RING_SIZE:
+            return
+        self._pending = True
+        _worker.submit(self._decode, (), self._on_decoded,
+                       exposong.worker.PRIORITY_HIGH)
+    
+    def _decode(self):
+        "Decode and scale the next frame. This runs on the worker thread."
+        with self._source_lock:
+            pb, delay = self._source.next()
+        return exposong.theme.scale_image(pb, self.size, self.aspect), delay
+    
+    def _on_decoded(self, result):
+        "Add a decoded frame to the ring, or skip a frame that failed."
+        self._pending = False
+        if self._closed:
+            return
+        if result is None:
+            self._errors += 1
+            if self._errors >= MAX_DECODE_ERRORS:
+                exposong.log.warning('Stopped playing the animation "%s", '
+                                     'its frames could not be decoded.',
+                                     self.filename)
+                return
+        else:
+            self._errors = 0
+            self._frames.append(result)
+        self._fill()
@@ -61,6 +61,7 @@ class Config(ConfigParser.SafeConfigParser):
 
         self.set("general", "data-path", "")
         self.set("general", "converted-old-formats", "False")
+        self.set("general", "slide_thumbnails", "False")
         
         self.set("open-save-dialogs", "songselect-import-dir", os.path.expanduser("~"))
         self.set("open-save-dialogs", "exposong_legacy-import-dir", os.path.expanduser("~"))
@@ -78,6 +79,11 @@ class Config(ConfigParser.SafeConfigParser):
         self.setcolor("screen", "logo_bg", (65535, 43690, 4369))
         self.setcolor("screen", "notify_color", (65535, 65535, 65535))
         self.setcolor("screen", "notify_bg", (65535, 0, 0))
+        self.set("screen", "image_cache_size", "128")
+        self.set("screen", "frame_cache_size", "256")
+        self.set("screen", "transition", "cut")
+        self.set("screen", "transition_duration", "400")
+        self.set("screen", "outputs", "")
         
         self.set("updates", "check_for_updates", "True")
         self.set("updates", "last_check", "")
@@ -85,6 +91,8 @@ class Config(ConfigParser.SafeConfigParser):
         self.set("songs", "ccli", "")
         self.set("songs", "show_in_order", "True")
         self.set("songs", "title_slide", "False")
+        self.set("songs", "uniform_font_size", "True")
+        self.set("songs", "split_verses", "False")
         
         self.configfile = cfile
         self.read(self.configfile)
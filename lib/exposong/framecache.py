@@ -0,0 +1,121 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A cache of composed frames of the presentation screen.
+
+Frames are keyed by the slide, the theme digest (see `Theme.get_digest()`) and
+the screen size. Showing a slide that has a cached frame only copies the frame
+to the screen. The cache is filled while the slides are shown, and for a whole
+schedule before a service with `exposong.prepare`. When the memory budget is
+exceeded, the least recently used frames are released.
+"""
+
+import collections
+
+import exposong
+import exposong.renderstats
+from exposong.config import config
+
+
+def get_key(theme, slide, size):
+    "Return the cache key of a frame."
+    return (slide, theme.get_digest(), tuple(size))
+
+def get_frame_bytes(size):
+    "Return the memory used by a frame of `size`."
+    return size[0] * size[1] * 4
+
+
+class FrameCache(object):
+    """
+    Keeps composed frames with a least recently used memory limit.
+    
+    budget: The maximum number of bytes held by the cache.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        # key: cairo surface
+        self._frames = collections.OrderedDict()
+        self._bytes = 0
+    
+    def get(self, key):
+        "Return the frame of `key`, or None."
+        frame = self._frames.pop(key, None)
+        if frame is not None:
+            self._frames[key] = frame
+        exposong.renderstats.stats.count('frames', frame is not None)
+        return frame
+    
+    def has(self, key):
+        "Return True if the frame of `key` is cached."
+        return key in self._frames
+    
+    def put(self, key, frame):
+        "Keep a frame, releasing older frames if needed."
+        self._remove(key)
+        self._frames[key] = frame
+        self._bytes += get_frame_bytes(key[2])
+        self._evict()
+    
+    def discard(self, slides):
+        "Release the frames of `slides`, after they were changed."
+        slides = set(slides)
+        for key in self._frames.keys():
+            if key[0] in slides:
+                self._remove(key)
+    
+    def clear(self):
+        "Release all frames."
+        self._frames.clear()
+        self._bytes = 0
+    
+    def set_budget(self, budget):
+        "Change the maximum number of bytes, releasing frames if needed."
+        self.budget = budget
+        self._evict()
+    
+    def get_usage(self):
+        "Return a dictionary describing the memory used by the cache."
+        return {'bytes': self._bytes,
+                'budget': self.budget,
+                'frames': len(self._frames),
+                }
+    
+    def _remove(self, key):
+        "Release one frame."
+        if self._frames.pop(key, None) is not None:
+            self._bytes -= get_frame_bytes(key[2])
+    
+    def _evict(self):
+        "Release the least recently used frames until we are under budget."
+        while self._bytes > self.budget and self._frames:
+            key = next(iter(self._frames))
+            self._remove(key)
+            exposong.log.debug('Released the frame of "%s".',
+                               key[0].get_title())
+
+
+def _get_config_budget():
+    "Return the configured cache size in bytes."
+    try:
+        return config.getint("screen", "frame_cache_size") * 1048576
+    except ValueError:
+        return 256 * 1048576
+
+cache = FrameCache(_get_config_budget())
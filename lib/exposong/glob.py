@@ -21,6 +21,7 @@ import os
 import os.path
 import random
 import string
+import sys
 import unicodedata
 
 """
@@ -130,6 +131,36 @@ def find_freefile(filename):
             n = "-1"
     return "".join([root, n, ext])
 
+def decode_filename(filename):
+    """
+    Return `filename` as unicode. File names from the file system are byte
+    strings, while file names and titles read from XML files are unicode.
+    """
+    if isinstance(filename, unicode):
+        return filename
+    for encoding in (sys.getfilesystemencoding(), 'utf-8'):
+        try:
+            return filename.decode(encoding or 'utf-8')
+        except (UnicodeDecodeError, LookupError):
+            pass
+    # Every byte string can be decoded as latin-1.
+    return filename.decode('latin-1')
+
+
+def get_sort_key(title):
+    """
+    Return the key to sort `title` by.
+    
+    Case and accents are removed, so an accented title is sorted with the
+    same title without accents. The keys are stored in a string column, and
+    compared by GTK with the collation of the current locale.
+    """
+    if not isinstance(title, unicode):
+        title = title.decode('utf-8', 'replace')
+    title = unicodedata.normalize('NFKD', title)
+    return u"".join(c for c in title
+                    if not unicodedata.combining(c)).lower()
+
 
 def random_string(length):
     "Return a random string with `lenght` characters"
@@ -0,0 +1,269 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A process-wide pool of decoded and scaled images.
+
+Images are keyed by the file path and a stamp of the file (modification time
+and size), so an image used by several themes or slides is only decoded once,
+and a file that changes on disk is decoded again. The originals and all scaled
+copies share one memory budget. When it is exceeded, the least recently used
+images are released.
+
+Images can be decoded and scaled on a worker thread with `request()`. While
+placeholders are enabled for a thread, `get_scaled()` does not block on a
+missing image. It starts loading it, and returns a quickly scaled copy of
+another size of the image if one is available.
+"""
+
+import collections
+import gobject
+import gtk.gdk
+import os.path
+import threading
+from gtk.gdk import pixbuf_new_from_file as pb_new
+
+import exposong
+import exposong.theme
+import exposong.worker
+from exposong.config import config
+
+class ImagePool(object):
+    """
+    Shares decoded images with a least recently used memory limit.
+    
+    budget: The maximum number of bytes held by the pool.
+    """
+    def __init__(self, budget):
+        "Create the image pool."
+        self.budget = budget
+        self._images = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._pending = set()
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._worker = exposong.worker.WorkerPool("images")
+    
+    def get_original(self, filename):
+        "Return the full size image, or None if it cannot be loaded."
+        key = self._get_key(filename)
+        if key is None:
+            exposong.log.error('Could not find "%s".', filename)
+            return None
+        with self._lock:
+            pb = self._lookup(key)
+        if pb is None:
+            try:
+                pb = pb_new(filename)
+            except gobject.GError:
+                exposong.log.error('Could not load "%s".', filename)
+                return None
+            with self._lock:
+                self._store(key, pb)
+        return pb
+    
+    def get_scaled(self, filename, size, aspect=None):
+        """
+        Return the image scaled to `size`, or None if it cannot be loaded.
+        
+        `size` is the requested [width, height]. The scaled copy is shared with
+        any other user of the same file at the same size.
+        """
+        key = self._get_key(filename, size, aspect)
+        if key is None:
+            exposong.log.error('Could not find "%s".', filename)
+            return None
+        with self._lock:
+            pb = self._lookup(key)
+        if pb is None:
+            if getattr(self._local, 'placeholders', False):
+                self._local.missing += 1
+                self.request(filename, size, aspect)
+                return self._get_placeholder(key, size, aspect)
+            original = self.get_original(filename)
+            if original is None:
+                return None
+            pb = exposong.theme.scale_image(original, size, aspect)
+            with self._lock:
+                self._store(key, pb)
+        return pb
+    
+    def request(self, filename, size, aspect=None,
+                priority=exposong.worker.PRIORITY_NORMAL):
+        "Decode and scale an image on the worker thread, if it is not loaded."
+        key = self._get_key(filename, size, aspect)
+        if key is None:
+            return
+        with self._lock:
+            if key in self._images or key in self._pending:
+                return
+            self._pending.add(key)
+            original = self._images.get(key[:3] + (None,))
+        self._worker.submit(_load_scaled, (filename, original, size, aspect),
+                            lambda result: self._on_loaded(key, result),
+                            priority)
+    
+    def set_placeholders(self, enabled):
+        """
+        Set whether `get_scaled()` returns placeholders for images that are not
+        loaded yet, for the current thread.
+        """
+        self._local.placeholders = enabled
+        if enabled:
+            self._local.missing = 0
+    
+    def get_missing(self):
+        """
+        Return the number of placeholders returned to the current thread since
+        placeholders were enabled.
+        """
+        return getattr(self._local, 'missing', 0)
+    
+    def add_listener(self, func):
+        "Call `func(filename)` when an image finished loading in the background."
+        self._listeners.append(func)
+    
+    def remove_listener(self, func):
+        "Stop calling `func`, see `add_listener()`."
+        if func in self._listeners:
+            self._listeners.remove(func)
+    
+    def forget(self, filename):
+        "Release all images loaded from `filename`."
+        path = os.path.abspath(filename)
+        with self._lock:
+            for key in [k for k in self._images if k[0] == path]:
+                self._bytes -= _get_bytes(self._images.pop(key))
+    
+    def clear(self):
+        "Release all images."
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+    
+    def set_budget(self, budget):
+        "Change the maximum number of bytes, releasing images if needed."
+        with self._lock:
+            self.budget = budget
+            self._evict()
+    
+    def get_usage(self):
+        "Return a dictionary describing the memory used by the pool."
+        return {'bytes': self._bytes,
+                'budget': self.budget,
+                'images': len(self._images),
+                'pending': len(self._pending),
+                'hits': self._hits,
+                'misses': self._misses,
+                }
+    
+    def get_usage_text(self):
+        "Return the memory usage as a string for the log."
+        usage = self.get_usage()
+        return "%d images, %.1f of %.1f MiB (%d hits, %d misses)" % (
+                usage['images'], usage['bytes'] / 1048576.0,
+                usage['budget'] / 1048576.0, usage['hits'], usage['misses'])
+    
+    def _get_key(self, filename, size=None, aspect=None):
+        "Return the pool key for the file, or None if it does not exist."
+        path = os.path.abspath(filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if size is not None:
+            size = (int(size[0]), int(size[1]), aspect)
+        return (path, st.st_mtime, st.st_size, size)
+    
+    def _on_loaded(self, key, result):
+        "Store an image loaded by the worker thread."
+        with self._lock:
+            self._pending.discard(key)
+            if result is None:
+                return
+            original, pb = result
+            okey = key[:3] + (None,)
+            if okey not in self._images:
+                self._store(okey, original)
+            self._store(key, pb)
+        # A listener can remove itself.
+        for func in self._listeners[:]:
+            func(key[0])
+    
+    def _get_placeholder(self, key, size, aspect):
+        "Quickly scale the largest loaded size of the image, or return None."
+        best = None
+        with self._lock:
+            for k, pb in self._images.iteritems():
+                if k[:3] == key[:3] and \
+                        (best is None or pb.get_width() > best.get_width()):
+                    best = pb
+        if best is None:
+            return None
+        return exposong.theme.scale_image(best, size, aspect,
+                                          gtk.gdk.INTERP_NEAREST)
+    
+    def _lookup(self, key):
+        "Return the image for `key` and mark it as recently used."
+        pb = self._images.pop(key, None)
+        if pb is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._images[key] = pb
+        return pb
+    
+    def _store(self, key, pb):
+        "Add an image to the pool."
+        nbytes = _get_bytes(pb)
+        if nbytes > self.budget:
+            # Keep the pool useful for everything else.
+            return
+        self._images[key] = pb
+        self._bytes += nbytes
+        self._evict()
+    
+    def _evict(self):
+        "Release the least recently used images until we are under budget."
+        while self._bytes > self.budget and self._images:
+            key, pb = self._images.popitem(last=False)
+            self._bytes -= _get_bytes(pb)
+            exposong.log.debug('Released "%s" from the image pool.', key[0])
+
+
+def _load_scaled(filename, original, size, aspect):
+    "Decode and scale an image. This runs on the worker thread."
+    if original is None:
+        original = pb_new(filename)
+    return original, exposong.theme.scale_image(original, size, aspect)
+
+def _get_bytes(pb):
+    "Return the memory used by a pixbuf."
+    return pb.get_rowstride() * pb.get_height()
+
+def _get_config_budget():
+    "Return the configured pool size in bytes."
+    try:
+        return config.getint("screen", "image_cache_size") * 1048576
+    except ValueError:
+        return 128 * 1048576
+
+pool = ImagePool(_get_config_budget())
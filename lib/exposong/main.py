@@ -32,6 +32,8 @@ import exposong.plugins._abstract
 import exposong.notify
 import exposong._hook
 import exposong.help
+import exposong.imagepool
+import exposong.schedindex
 from exposong import RESOURCE_PATH, DATA_PATH
 from exposong import config, prefs, screen, schedlist, splash
 from exposong import preslist, presfilter, slidelist, statusbar, themeselect
@@ -185,11 +187,14 @@ class Main (gtk.Window):
         info.append(" * Presentations: %d" % len(self.library))
         for ptype in exposong.plugins.get_plugins_by_capability(
                 exposong.plugins._abstract.Presentation):
-            tlist = [p for p in self.library if p[0].get_type() == ptype.get_type()]
-            info.append("   * %s: %d" % (ptype.get_type().title(), len(tlist)))
+            partition = self.library.get_partition(ptype)
+            if partition is not None:
+                info.append("   * %s: %d" % (ptype.get_type().title(),
+                                             len(partition)))
         slist = [s for s in sch.get_model() if s[0] and not s[0].is_builtin()]
         info.append(" * Custom Schedules: %d" %len(slist))
         info.append(" * Themes: %d" % len(exposong.themeselect.themeselect.liststore))
+        info.append(" * Image Pool: %s" % exposong.imagepool.pool.get_usage_text())
         exposong.log.info("\n".join(info))
         
         exposong.log.info('Ready.')
@@ -428,6 +433,16 @@ class Main (gtk.Window):
                                    os.path.join(directory, filenm))
         return sched
 
+    def list_sched(self, path):
+        'Add a schedule from the schedule index, without reading it.'
+        entry = exposong.schedindex.index.get_entry(path)
+        if entry is None:
+            return None
+        sched = Schedule(entry['title'], filename=path, builtin=False,
+                         lazy=True)
+        schedlist.schedlist.append(None, sched)
+        return sched
+    
     def build_schedule(self):
         'Add items to the schedule list.'
         #Initialize the Library
@@ -444,10 +459,10 @@ class Main (gtk.Window):
         
         splash.splash.incr_total(len(plugins))
         for plugin in plugins:
-            model = self.library.filter_new()
-            model.set_visible_func(plugin.schedule_filter)
-            schedule = Schedule(plugin.schedule_name(), model=model)
-            itr = self.library.get_iter_first()
+            # The library keeps the presentations of each type in its own
+            # schedule, instead of each schedule filtering the library.
+            schedule = Schedule(plugin.schedule_name())
+            self.library.add_partition(plugin, schedule)
             schedlist.schedlist.append(None, schedule, 2)
             splash.splash.incr(1)
             yield True
@@ -456,12 +471,12 @@ class Main (gtk.Window):
             schedlist.schedlist.get_model().get_iter_first())
         schedlist.schedlist.append(None, (None, None, 39, True))
         
-        #Add custom schedules from the data directory        
-        dir_list = os.listdir(directory)
-        for filenm in dir_list:
-            if filenm.endswith(".xml"):
-                self.load_sched(filenm)
-                yield True
+        #Add custom schedules from the data directory. They are read when
+        #they are selected.
+        paths = exposong.schedindex.list_files(directory)
+        for path in paths:
+            self.list_sched(path)
+        exposong.schedindex.index.prune(directory, paths)
         schedlist.schedlist.expand_all()
         
         yield False
@@ -475,11 +490,12 @@ class Main (gtk.Window):
         prefs.PrefsDialog(self)
     
     def _save_schedules(self):
-        'Save all schedules to disk.'
+        'Save the changed schedules to disk.'
         model = schedlist.schedlist.get_model()
         sched = model.iter_children(None)
         while sched:
-            if model.get_value(sched, 0) and not model.get_value(sched, 0).is_builtin():
+            if model.get_value(sched, 0) and not model.get_value(sched, 0).is_builtin()\
+                    and model.get_value(sched, 0).is_dirty():
                 model.get_value(sched, 0).save()
             sched = model.iter_next(sched)
     
@@ -574,5 +590,7 @@ Visit the following URL to download free Songs and Themes:")
 
 
 def run():
+    # Images and thumbnails are loaded on background threads.
+    gobject.threads_init()
     Main()
     gtk.main()
@@ -20,6 +20,8 @@ import gtk
 import pango
 
 import exposong.main
+import exposong.overlay
+import exposong.renderstats
 import exposong.screen
 from exposong.config import config
 
@@ -35,7 +37,8 @@ class Notify(gtk.HBox):
     def __init__(self):
         "Initialize the notification interface."
         gtk.HBox.__init__(self)
-        self._text = ""
+        self.overlay = NotifyOverlay()
+        exposong.screen.screen.add_overlay(self.overlay)
         
         self.notify = gtk.Entry(45)
         self._handler_changed = self.notify.connect_after("changed",
@@ -76,34 +79,6 @@ class Notify(gtk.HBox):
             notify_save.connect("clicked", self._on_save)
             self.pack_start(notify_save, False, True, 0)
     
-    def draw(self, ccontext, bounds):
-        "Draw the notification to the screen if available."
-        if not self._text:
-            return
-        layout = ccontext.create_layout()
-        w,h = bounds
-        layout.set_text(self._text)
-        
-        sz = int(h / 12.0)
-        layout.set_font_description(pango.FontDescription(
-                                    "Sans Bold " + str(sz)))
-        while layout.get_pixel_size()[0] > w * 0.6:
-            sz = int(sz * 0.89)
-            layout.set_font_description(pango.FontDescription(
-                                        "Sans Bold "+str(sz)))
-        nbounds = layout.get_pixel_size()
-        pad = sz/14.0
-        ccontext.rectangle(w-nbounds[0]-pad*2,
-                           h-nbounds[1]-pad*2,
-                           w, h)
-        col = exposong.screen.c2dec(config.getcolor("screen", "notify_bg"))
-        ccontext.set_source_rgb(*col)
-        ccontext.fill()
-        col = exposong.screen.c2dec(config.getcolor("screen", "notify_color"))
-        ccontext.set_source_rgb(*col)
-        ccontext.move_to(w-nbounds[0]-pad, h-nbounds[1]-pad)
-        ccontext.show_layout(layout)
-    
     def _on_icon_pressed(self, widget, icon, mouse_button):
         """
         Emit the terms-changed signal without any time out when the clear
@@ -128,15 +103,13 @@ class Notify(gtk.HBox):
         "Apply the text to the screen."
         exposong.log.info('Setting notification to "%s".',
                           self.notify.get_text())
-        self._text = self.notify.get_text()
-        exposong.screen.screen.draw()
+        self.overlay.set_text(self.notify.get_text())
     
     def _on_clear(self, *args):
         "Remove the text from the screen."
         exposong.log.info('Clearing notification.')
         self.notify.set_text("")
-        self._text = ""
-        exposong.screen.screen.draw()
+        self.overlay.set_text("")
     
     def _check_style(self):
         "Use a different background color if a search is active."
@@ -165,3 +138,68 @@ class Notify(gtk.HBox):
 
 #notify = Notify()
 notify = None
+
+
+class NotifyOverlay(exposong.overlay.Overlay):
+    """
+    Shows the notification text in the bottom right corner of the screen.
+    """
+    stats_category = exposong.renderstats.NOTIFY
+    
+    def __init__(self):
+        exposong.overlay.Overlay.__init__(self)
+        self._text = ""
+        self._layout = None
+        self._layout_key = None
+        self._font_size = 0
+    
+    def set_text(self, text):
+        "Change the notification text."
+        self._text = text
+        self.invalidate()
+    
+    def _get_layout(self, bounds):
+        "Return the layout, sized to fit on the screen."
+        if self._layout_key != (self._text, bounds):
+            self._layout_key = (self._text, bounds)
+            layout = exposong.overlay.create_layout()
+            w,h = bounds
+            layout.set_text(self._text)
+            
+            sz = int(h / 12.0)
+            layout.set_font_description(pango.FontDescription(
+                                        "Sans Bold " + str(sz)))
+            while layout.get_pixel_size()[0] > w * 0.6:
+                sz = int(sz * 0.89)
+                layout.set_font_description(pango.FontDescription(
+                                            "Sans Bold "+str(sz)))
+            self._layout = layout
+            self._font_size = sz
+        return self._layout
+    
+    def get_rect(self, bounds):
+        "Return the area of the notification."
+        if not self._text:
+            return None
+        w,h = bounds
+        nbounds = self._get_layout(bounds).get_pixel_size()
+        pad = self._font_size/14.0
+        x = int(w-nbounds[0]-pad*2)
+        y = int(h-nbounds[1]-pad*2)
+        return (x, y, w-x, h-y)
+    
+    def render(self, ccontext, bounds):
+        "Draw the notification."
+        layout = self._get_layout(bounds)
+        ccontext.update_layout(layout)
+        w,h = bounds
+        nbounds = layout.get_pixel_size()
+        pad = self._font_size/14.0
+        ccontext.rectangle(*self.get_rect(bounds))
+        col = exposong.screen.c2dec(config.getcolor("screen", "notify_bg"))
+        ccontext.set_source_rgb(*col)
+        ccontext.fill()
+        col = exposong.screen.c2dec(config.getcolor("screen", "notify_color"))
+        ccontext.set_source_rgb(*col)
+        ccontext.move_to(w-nbounds[0]-pad, h-nbounds[1]-pad)
+        ccontext.show_layout(layout)
@@ -0,0 +1,166 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Additional output windows, such as a confidence monitor on the stage.
+
+The presentation screen renders each frame once. An output only shows a copy
+of that frame, scaled to the size of its monitor, so adding outputs does not
+render the theme again. Each output can show the overlays of the presentation
+screen, and overlays of its own.
+"""
+
+import gtk
+import time
+
+import exposong
+import exposong.screen
+from exposong.config import config
+
+
+def get_configured_monitors():
+    "Return the monitor numbers (counted from 1) configured for outputs."
+    monitors = []
+    for value in config.get("screen", "outputs").split(","):
+        try:
+            monitors.append(int(value))
+        except ValueError:
+            continue
+    return monitors
+
+
+class Output(object):
+    """
+    A window that shows the presentation screen on another monitor.
+    
+    monitor:        The monitor number, counted from 1.
+    share_overlays: Show the overlays of the presentation screen.
+    """
+    def __init__(self, monitor, share_overlays=True):
+        self.monitor = monitor
+        self.share_overlays = share_overlays
+        self.overlays = []
+        self.stats = OutputStats()
+        
+        self.window = gtk.Window(gtk.WINDOW_POPUP)
+        self.area = gtk.DrawingArea()
+        self.area.connect("expose-event", self._expose)
+        self.window.add(self.area)
+    
+    def reposition(self, parent):
+        "Move the window over its monitor. Returns False if it is missing."
+        screen_ = parent.get_screen()
+        if self.monitor > screen_.get_n_monitors():
+            exposong.log.warning('Monitor %d for an output was not found.',
+                                 self.monitor)
+            return False
+        geom = screen_.get_monitor_geometry(self.monitor - 1)
+        self.window.move(geom.x, geom.y)
+        self.window.resize(geom.width, geom.height)
+        return True
+    
+    def show(self):
+        "Show the output window."
+        self.stats.reset()
+        self.window.show_all()
+    
+    def hide(self):
+        "Hide the output window."
+        self.window.hide()
+    
+    def destroy(self):
+        "Close the output window, after the output was removed."
+        self.window.destroy()
+    
+    def queue_draw(self):
+        "Redraw the output."
+        if self.is_viewable():
+            self.area.queue_draw()
+    
+    def is_viewable(self):
+        "Return True if the output is currently visible."
+        return bool(self.area.window and self.area.window.is_viewable())
+    
+    def add_overlay(self, overlay):
+        "Show `overlay` on this output only."
+        self.overlays.append(overlay)
+        self.queue_draw()
+    
+    def remove_overlay(self, overlay):
+        "Stop showing `overlay`."
+        self.overlays.remove(overlay)
+        self.queue_draw()
+    
+    def damage_overlay(self, overlay):
+        "Redraw the output if it shows `overlay`."
+        if overlay in self.overlays or self.share_overlays:
+            self.queue_draw()
+    
+    def _expose(self, widget, event):
+        "Copy the presentation frame to the output."
+        begin = time.time()
+        area = event.area
+        ccontext = widget.window.cairo_create()
+        ccontext.rectangle(area.x, area.y, area.width, area.height)
+        ccontext.clip()
+        
+        bounds = widget.window.get_size()
+        if not exposong.screen.screen.paint_frame(ccontext, bounds,
+                                                  self.share_overlays):
+            ccontext.set_source_rgb(0, 0, 0)
+            ccontext.paint()
+        for overlay in self.overlays:
+            overlay.composite(ccontext, bounds)
+        self.stats.add_frame(time.time() - begin)
+        return True
+
+
+class OutputStats(object):
+    """
+    Timing of the frames drawn to one output.
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        "Clear the statistics."
+        self.frames = 0
+        self.total_cost = 0.0
+        self.max_cost = 0.0
+    
+    def add_frame(self, cost):
+        "Record a frame that took `cost` seconds to draw."
+        self.frames += 1
+        self.total_cost += cost
+        self.max_cost = max(self.max_cost, cost)
+    
+    def get_statistics(self):
+        "Return the statistics as a dictionary, with times in milliseconds."
+        if self.frames:
+            average = self.total_cost / self.frames * 1000
+        else:
+            average = 0.0
+        return {'frames': self.frames,
+                'average_ms': average,
+                'max_ms': self.max_cost * 1000,
+                }
+    
+    def get_text(self):
+        "Return the statistics as a string for the log."
+        return "%(frames)d frames, %(average_ms).1f ms average, "\
+               "%(max_ms).1f ms maximum" % self.get_statistics()
@@ -0,0 +1,102 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Overlays are drawn on the presentation screen on top of the slide, for example
+notifications or clocks.
+
+Each overlay is rendered into its own cached surface, which is composited over
+the slide frame. When an overlay changes, only the area it covers is redrawn,
+and the slide does not need to be rendered again.
+"""
+
+import cairo
+import gtk
+import gtk.gdk
+
+
+class Overlay(object):
+    """
+    An abstract class for items drawn over the presentation screen.
+    
+    Subclasses define `get_rect()` and `render()`, and call `invalidate()`
+    when their content changes.
+    """
+    # The category of exposong.renderstats the drawing time is added to, or
+    # None to leave it out.
+    stats_category = 'overlays'
+    
+    def __init__(self):
+        self._surface = None
+        self._bounds = None
+        self._rect = None
+    
+    def get_rect(self, bounds):
+        """
+        Return the area covered by the overlay as (x, y, width, height) in
+        whole pixels, on a screen with the size `bounds`. Returns None if there
+        is nothing to draw.
+        """
+        return None
+    
+    def render(self, ccontext, bounds):
+        """
+        Render the overlay to the context, using screen coordinates.
+        Should be defined in subclasses.
+        """
+        raise NotImplementedError
+    
+    def reset(self):
+        "Discard the cached surface."
+        self._surface = None
+        self._bounds = None
+    
+    def invalidate(self):
+        "Discard the cached surface, and redraw the area covered by the overlay."
+        # Imported here, so that the screen can import modules with overlays.
+        import exposong.screen
+        damage = []
+        if self._rect:
+            damage.append(self._rect)
+        self.reset()
+        if exposong.screen.screen:
+            exposong.screen.screen.damage_overlay(self, damage)
+    
+    def composite(self, ccontext, bounds):
+        "Paint the overlay onto a screen with the size `bounds`."
+        bounds = tuple(bounds)
+        if self._bounds != bounds:
+            self._bounds = bounds
+            self._rect = self.get_rect(bounds)
+            self._surface = None
+            if self._rect:
+                x, y, w, h = self._rect
+                self._surface = ccontext.get_target().create_similar(
+                        cairo.CONTENT_COLOR_ALPHA, w, h)
+                rcontext = gtk.gdk.CairoContext(cairo.Context(self._surface))
+                rcontext.translate(-x, -y)
+                self.render(rcontext, bounds)
+        if self._surface:
+            ccontext.set_source_surface(self._surface, *self._rect[:2])
+            ccontext.paint()
+
+
+def create_layout():
+    "Return a pango layout that can be used to measure text at any time."
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+    return gtk.gdk.CairoContext(cairo.Context(surface)).create_layout()
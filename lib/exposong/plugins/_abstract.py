@@ -261,10 +261,9 @@ class Presentation:
     
     def _edit_save(self):
         'Save the fields if the user clicks ok.'
-        ## TODO: When renaming, preslist does not resort. The following doesn't work for me.
-        for schedlistrow in exposong.schedlist.schedlist.get_model():
-            if schedlistrow[0] and schedlistrow[0].builtin:
-                schedlistrow[0].resort()
+        # The schedules are sorted again by the presentation list, see
+        # `Schedule.update_sort_key()`.
+        pass
     
     def _is_editing_complete(self, parent):
         "Test to see if all fields have been filled which are required."
@@ -357,13 +356,6 @@ class Schedule:
     def schedule_name(cls):
         'Return the string schedule name.'
         raise NotImplementedError
-    
-    @classmethod
-    def schedule_filter(cls, model, itr):
-        "Called on each presentation, and return True if it can be added."
-        if model.get_value(itr, 0) != None:
-            return model.get_value(itr, 0).presentation.__class__ is cls
-        return False
 
 
 class Screen:
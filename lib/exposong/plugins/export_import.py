@@ -332,23 +332,22 @@ class ExportImport(Plugin, exposong._hook.Menu):
     
     @classmethod
     def _import_replace_existing_song(cls, widget, existing, new):
+        library = exposong.main.main.library
         os.remove(existing)
         shutil.copy(new, os.path.join(DATA_PATH, "pres", os.path.basename(new)))
-        presrm = exposong.main.main.library.finditer(filename=os.path.basename(existing))
-        if presrm: exposong.main.main.library.remove(presrm)
+        old_pres = library.find(filename=os.path.basename(existing))
+        scheds = []
+        if old_pres:
+            # Read while the old song can still be found in the library.
+            scheds = exposong.schedule.get_schedules(old_pres)
+            library.remove_if(old_pres)
         exposong.main.main.load_pres(os.path.basename(new))
-        #TODO: Remove existing presentation from preslist and schedules
+        new_pres = library.find(filename=os.path.basename(new))
         
-        # Add to Custom Schedules
-        model = exposong.schedlist.schedlist.get_model()
-        itr = model.iter_children(None)
-        while itr:
-            sched = model.get_value(itr, 0)
-            scheditem = exposong.schedule.ScheduleItem(pres, "")
-            presrm = sched.finditer(os.path.basename(existing))
-            sched.insert_before(presrm, scheditem.get_row())
-            if presrm: sched.remove(presrm)
-            itr = model.iter_next(itr)
+        # Replace it in the custom schedules that contain it
+        if new_pres:
+            for sched in scheds:
+                sched.replace(old_pres, new_pres)
         
     
     @classmethod
@@ -142,6 +142,29 @@ class Presentation (_abstract.Presentation, Plugin, exposong._hook.Menu,
             
             return [theme.Text('\n'.join(jn))]
         
+        def get_body(self):
+            'Return a list of renderable theme items.'
+            return [theme.Text(self.get_text(), margin=0.04, group=self.pres)]
+        
+        def split(self):
+            """
+            Return two slides with half of the lines each, or only this slide
+            if it has a single line. The slides are not part of the song.
+            """
+            lines = self.get_text().split('\n')
+            if len(lines) < 2:
+                return [self]
+            half = (len(lines) + 1) // 2
+            parts = []
+            for text in ('\n'.join(lines[:half]), '\n'.join(lines[half:])):
+                verse = openlyrics.Verse()
+                verse.name = self.verse.name
+                verse.lang = self.verse.lang
+                slide = self.__class__(self.pres, verse)
+                slide._set_lines(text)
+                parts.append(slide)
+            return parts
+        
         def _edit_window(self, parent):
             'Open the Slide Editor'
             ret = False
@@ -190,6 +213,12 @@ class Presentation (_abstract.Presentation, Plugin, exposong._hook.Menu,
     def __init__(self, filename=''):
         self.filename = filename
         self.slides = []
+        # The slide index of each verse order entry, and the resolved order,
+        # see `get_order()`.
+        self._order_index = {}
+        self._resolved_order = None
+        # See `get_title_slide()`.
+        self._title_slide = None
         
         if filename:
             fl = open(filename, 'r')
@@ -247,18 +276,25 @@ class Presentation (_abstract.Presentation, Plugin, exposong._hook.Menu,
     
     def get_title_slide(self):
         'Returns a `Slide` with the song title as text'
-        verse = openlyrics.Verse()
-        verse.name = _("Title")
-        slide = self.Slide(self, verse)
-        slide._set_lines(self.get_title())
+        # The same slide is returned while the title does not change, so its
+        # prepared frame is found in the frame cache.
+        slide = self._title_slide
+        if slide is None or slide.get_text() != self.get_title():
+            verse = openlyrics.Verse()
+            verse.name = _("Title")
+            slide = self.Slide(self, verse)
+            slide._set_lines(self.get_title())
+            self._title_slide = slide
         return (slide, slide.get_markup())
 
     def get_order(self, custom_order=True):
         'Returns the order in which the slides should be presented.'
         if len(self.song.props.verse_order) > 0 and custom_order:
-            return tuple(self.get_slide_from_order(n) for n in \
-                         self.song.props.verse_order \
-                         if self.get_slide_from_order(n) >= 0)
+            if self._resolved_order is None:
+                self._resolved_order = tuple(i for i in
+                        (self.get_slide_from_order(n) for n in
+                         self.song.props.verse_order) if i >= 0)
+            return self._resolved_order
         elif not custom_order:
             pass
         else:
@@ -266,6 +302,12 @@ class Presentation (_abstract.Presentation, Plugin, exposong._hook.Menu,
 
     def get_slide_from_order(self, order_value):
         'Gets the slide index.'
+        if order_value not in self._order_index:
+            self._order_index[order_value] = self._find_slide(order_value)
+        return self._order_index[order_value]
+    
+    def _find_slide(self, order_value):
+        'Return the index of the first slide matching a verse order entry.'
         i = 0
         for sl in self.slides:
             if re.match(order_value, sl.title.lower()):
@@ -685,6 +727,12 @@ class Presentation (_abstract.Presentation, Plugin, exposong._hook.Menu,
             self.slides.append(slide)
             self.song.verses.append(slide.verse)
             itr = self._fields['slides'].iter_next(itr)
+        self._invalidate_order()
+    
+    def _invalidate_order(self):
+        'Resolve the verse order again, after the slides or order changed.'
+        self._order_index = {}
+        self._resolved_order = None
     
     def _slide_dlg(self, treeview, path, col, edit=False):
         "Create a dialog for a new slide."
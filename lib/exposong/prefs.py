@@ -22,8 +22,12 @@ import gtk.gdk
 from exposong import gui
 from exposong import DATA_PATH
 from exposong.config import config
+import exposong.framecache
+import exposong.imagepool
 import exposong.screen
+import exposong.theme
 import exposong.main
+import exposong.transition
 
 '''
 Dialog for changing settings in ExpoSong.
@@ -47,7 +51,7 @@ class PrefsDialog(gtk.Dialog):
         self.vbox.pack_start(notebook, True, True, 5)
         
         #General Page
-        table = gui.ESTable(10, auto_inc_y=True)
+        table = gui.ESTable(12, auto_inc_y=True)
         
         if config.has_option("general", "data-path"):
             folder = config.get("general", "data-path")
@@ -67,6 +71,13 @@ themes are stored.")
         g_title = table.attach_checkbutton(_("Insert title slide"))
         if config.get("songs", "title_slide") == "True":
             g_title.set_active(True)
+        g_uniform = table.attach_checkbutton(
+            _("Use the same font size for all verses"))
+        if config.get("songs", "uniform_font_size") == "True":
+            g_uniform.set_active(True)
+        g_split = table.attach_checkbutton(_("Split verses that are too long"))
+        if config.get("songs", "split_verses") == "True":
+            g_split.set_active(True)
 
         g_ccli = table.attach_entry(config.get("songs","ccli"),
                                     label=_("CCLI License #"))
@@ -74,7 +85,7 @@ themes are stored.")
         notebook.append_page(table, gtk.Label( _("General") ))
         
         #Screen Page
-        table = gui.ESTable(9, auto_inc_y=True)
+        table = gui.ESTable(16, auto_inc_y=True)
         
         table.attach_section_title(_("Logo"))
         p_logo = table.attach_filechooser(config.get("screen","logo"),
@@ -116,6 +127,34 @@ themes are stored.")
         
         table.attach_section_title(_("Position"))
         p_monitor = table.attach_combo(monitor_name, sel, label=_("Monitor"))
+        p_outputs = table.attach_entry(config.get('screen', 'outputs'),
+                                       label=_("Mirror to monitors"))
+        p_outputs.set_tooltip_text(
+                _("Numbers of more monitors to show the presentation on, "
+                  "separated by commas, for example a stage monitor."))
+        
+        table.attach_section_title(_("Transition"))
+        transitions = exposong.transition.get_transition_names()
+        sel = [t[1] for t in transitions
+               if t[0] == config.get('screen', 'transition')]
+        p_transition = table.attach_combo([t[1] for t in transitions],
+                                          sel and sel[0], label=_("Type"))
+        adjust = gtk.Adjustment(config.getint('screen', 'transition_duration'),
+                                0, 5000, 100, 500)
+        p_duration = table.attach_spinner(adjust, label=_("Duration (ms)"))
+        
+        table.attach_section_title(_("Memory"))
+        adjust = gtk.Adjustment(exposong.imagepool.pool.budget // 1048576,
+                                16, 4096, 16, 128)
+        p_image_cache = table.attach_spinner(adjust, label=_("Images (MB)"))
+        p_image_cache.set_tooltip_text(
+                _("The memory used to keep decoded and scaled images."))
+        adjust = gtk.Adjustment(exposong.framecache.cache.budget // 1048576,
+                                0, 4096, 16, 128)
+        p_frame_cache = table.attach_spinner(adjust, label=_("Slides (MB)"))
+        p_frame_cache.set_tooltip_text(
+                _("The memory used to keep rendered slides, for example "
+                  "when a schedule is prepared."))
         
         notebook.append_page(table, gtk.Label(_("Screen")))
         
@@ -133,8 +172,17 @@ themes are stored.")
                 dlg.run()
                 dlg.destroy()
             
-            if config.get("songs", "title_slide") != str(g_title.get_active()):
-                config.set("songs", "title_slide", str(g_title.get_active()))
+            songs_changed = False
+            for key, widget in (("title_slide", g_title),
+                                ("uniform_font_size", g_uniform),
+                                ("split_verses", g_split)):
+                if config.get("songs", key) != str(widget.get_active()):
+                    config.set("songs", key, str(widget.get_active()))
+                    songs_changed = True
+            if songs_changed:
+                # The songs are fitted and split differently now.
+                exposong.theme.font_scales.clear()
+                exposong.framecache.cache.clear()
                 exposong.slidelist.slidelist.update()
             config.set("songs", "ccli", g_ccli.get_text())
             config.set("updates", "check_for_updates", str(g_update.get_active()))
@@ -149,10 +197,25 @@ themes are stored.")
             config.setcolor("screen", "notify_bg", (ntfb.red, ntfb.green, ntfb.blue))
             
             config.set('screen','monitor', monitor_value[p_monitor.get_active()])
+            config.set('screen', 'outputs', p_outputs.get_text())
+            if p_transition.get_active() >= 0:
+                config.set('screen', 'transition',
+                           transitions[p_transition.get_active()][0])
+            config.set('screen', 'transition_duration',
+                       str(p_duration.get_value_as_int()))
+            config.set('screen', 'image_cache_size',
+                       str(p_image_cache.get_value_as_int()))
+            exposong.imagepool.pool.set_budget(
+                    p_image_cache.get_value_as_int() * 1048576)
+            config.set('screen', 'frame_cache_size',
+                       str(p_frame_cache.get_value_as_int()))
+            exposong.framecache.cache.set_budget(
+                    p_frame_cache.get_value_as_int() * 1048576)
             exposong.screen.screen.reposition(parent)
             
             if hasattr(exposong.screen.screen,"_logo_pbuf"):
                 del exposong.screen.screen._logo_pbuf
+            exposong.screen.screen.reset_overlays()
             exposong.screen.screen.draw()
         
         self.hide()
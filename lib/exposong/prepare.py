@@ -0,0 +1,146 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Prepares a custom schedule before a service.
+
+Every slide of the schedule is rendered at the size of the presentation screen,
+in the order of the schedule. This reads the schedule file, parses the themes,
+decodes and scales the images into `exposong.imagepool`, fits the song texts,
+and keeps the composed frames in `exposong.framecache`, so the first time a
+slide is shown it does not have to be rendered. Preparing stops when the frame
+cache is full.
+"""
+
+import gobject
+import gtk
+
+import exposong
+import exposong.framecache
+import exposong.render
+import exposong.screen
+import exposong.slidelist
+from exposong.config import config
+
+
+def get_slides(sched):
+    "Return (presentation, slides) for the presentations of `sched`."
+    sched.ensure_loaded()
+    result = []
+    for row in sched.get_model(True):
+        pres = row[0].presentation
+        result.append((pres, exposong.render.get_slides(pres)))
+    return result
+
+
+class PrepareDialog(gtk.Dialog):
+    """
+    Shows the progress of preparing a schedule.
+    
+    parent: The main window.
+    sched:  The `Schedule` to prepare.
+    """
+    def __init__(self, parent, sched):
+        gtk.Dialog.__init__(self, _('Prepare "%s"') % sched.title, parent, 0,
+                            (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL))
+        self.set_border_width(6)
+        self.set_default_size(360, -1)
+        self.sched = sched
+        self._source = None
+        
+        self._label = gtk.Label()
+        self._label.set_alignment(0.0, 0.5)
+        self.vbox.pack_start(self._label, False, False, 4)
+        self._progress = gtk.ProgressBar()
+        self.vbox.pack_start(self._progress, False, False, 4)
+        self._memory = gtk.Label()
+        self._memory.set_alignment(0.0, 0.5)
+        self.vbox.pack_start(self._memory, False, False, 4)
+        
+        self.connect("response", self._on_response)
+        self.show_all()
+        task = self._prepare()
+        self._source = gobject.idle_add(task.next,
+                                        priority=gobject.PRIORITY_LOW)
+    
+    def _prepare(self):
+        "Render the slides, one for each idle call."
+        screen = exposong.screen.screen
+        size = screen.get_size()
+        if not size:
+            self._finish(_("The size of the presentation screen is not known."))
+            yield False
+        self._label.set_text(_("Reading the schedule..."))
+        yield True
+        items = get_slides(self.sched)
+        # Fit and split the songs like the slide list does, so the same
+        # slides are prepared.
+        if config.get('songs', 'uniform_font_size') == "True":
+            for i, (pres, slides) in enumerate(items):
+                if pres.get_type() == "song":
+                    self._label.set_text(pres.get_title())
+                    items[i] = (pres,
+                                exposong.slidelist.fit_slides(pres, slides))
+                    yield True
+        total = sum(len(slides) for pres, slides in items)
+        cache = exposong.framecache.cache
+        frame_bytes = exposong.framecache.get_frame_bytes(size)
+        fitting = min(total, cache.budget // frame_bytes)
+        self._memory.set_text(
+                _("Estimated memory: %(needed)d MB of %(budget)d MB") %
+                {'needed': fitting * frame_bytes // 1048576,
+                 'budget': cache.budget // 1048576})
+        done = 0
+        used = 0
+        for pres, slides in items:
+            self._label.set_text(pres.get_title())
+            for slide in slides:
+                if used + frame_bytes > cache.budget:
+                    self._finish(_("The frame cache is full. %(done)d of "
+                                   "%(total)d slides were prepared.")
+                                 % {'done': done, 'total': total})
+                    yield False
+                used += screen.prepare_frame(slide)
+                done += 1
+                self._progress.set_fraction(float(done) / total)
+                self._progress.set_text(_("Slide %(done)d of %(total)d")
+                                        % {'done': done, 'total': total})
+                yield True
+        exposong.log.info('Prepared %d slides of schedule "%s", using %d MB.',
+                          done, self.sched.title, used // 1048576)
+        self._finish(_("%(total)d slides of %(count)d presentations were "
+                       "prepared.") % {'total': total, 'count': len(items)})
+        yield False
+    
+    def _finish(self, message):
+        "Show the result, and let the dialog be closed."
+        self._source = None
+        self._label.set_text(message)
+        self._progress.set_fraction(1.0)
+        for button in self.action_area.get_children():
+            self.action_area.remove(button)
+        self.add_button(gtk.STOCK_CLOSE, gtk.RESPONSE_CLOSE)
+    
+    def _on_response(self, dialog, response):
+        "Stop preparing, and close the dialog."
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+            exposong.log.info('Preparing schedule "%s" was cancelled.',
+                              self.sched.title)
+        self.destroy()
@@ -21,6 +21,7 @@ Manages the presentations from the current schedule.
 """
 
 import os
+import gettext
 import gtk
 import gtk.gdk
 import gobject
@@ -29,6 +30,7 @@ import pango
 import exposong._hook
 import exposong.slidelist
 import exposong.schedlist
+import exposong.schedule
 import exposong.main
 from exposong import DATA_PATH, RESOURCE_PATH
 
@@ -66,10 +68,33 @@ class PresList(gtk.TreeView, exposong._hook.Menu):
         self.connect("button-release-event", self._on_pres_rt_click)
         self.connect("drag-data-get", self._on_drag_get)
         self.connect("drag-data-received", self._on_pres_drag_received)
+        self.set_has_tooltip(True)
+        self.connect("query-tooltip", self._on_query_tooltip)
         self.enable_model_drag_source(gtk.gdk.BUTTON1_MASK,
                 exposong.schedlist.DRAGDROP_SCHEDULE,
                 gtk.gdk.ACTION_DEFAULT | gtk.gdk.ACTION_MOVE)
         
+    def _on_query_tooltip(self, treeview, x, y, keyboard_mode, tooltip):
+        "Show the custom schedules that contain a presentation."
+        x, y = self.convert_widget_to_bin_window_coords(x, y)
+        pathinfo = self.get_path_at_pos(x, y)
+        if not pathinfo:
+            return False
+        model = self.get_model()
+        item = model.get_value(model.get_iter(pathinfo[0]), 0)
+        if not item:
+            return False
+        scheds = exposong.schedule.get_schedules(item.presentation)
+        if not scheds:
+            return False
+        titles = ", ".join(sorted(s.title for s in scheds))
+        tooltip.set_text(gettext.ngettext("Used in %(count)d schedule: %(titles)s",
+                                          "Used in %(count)d schedules: %(titles)s",
+                                          len(scheds)) %
+                         {"count": len(scheds), "titles": titles})
+        self.set_tooltip_row(tooltip, pathinfo[0])
+        return True
+    
     def _on_pres_added(self, model, path, itr):
         "Select the recently added schedule."
         self.set_cursor(path)
@@ -185,9 +210,18 @@ class PresList(gtk.TreeView, exposong._hook.Menu):
         field = exposong.slidelist.slidelist.pres
         if not field:
             return False
+        filename = field.filename
         if field.edit():
+            if field.filename != filename:
+                self._update_filename(field, filename)
+            exposong.main.main.library.update_sort_key(field)
             exposong.slidelist.slidelist.update()
     
+    def _update_filename(self, pres, old_filename):
+        'Update the schedule indexes after a presentation file was renamed.'
+        exposong.main.main.library.update_filename(old_filename)
+        exposong.schedule.rename_presentation(pres, old_filename)
+    
     def _on_drag_get(self, treeview, context, selection, info, timestamp):
         'A presentation was dragged.'
         model, iter1 = treeview.get_selection().get_selected()
@@ -236,15 +270,10 @@ class PresList(gtk.TreeView, exposong._hook.Menu):
         dialog.destroy()
         if resp == gtk.RESPONSE_YES:
             item.on_delete()
-            schmod = exposong.schedlist.schedlist.get_model()
             
             #Remove from custom schedules
-            itr = schmod.iter_children(None)
-            while itr:
-                sched = schmod.get_value(itr, 0)
-                if schmod.get_value(itr, 0) and not schmod.get_value(itr, 0).is_builtin():
-                    sched.remove_if(presentation=item.presentation)
-                itr = schmod.iter_next(itr)
+            for sched in exposong.schedule.get_schedules(item.presentation):
+                sched.remove_if(presentation=item.presentation)
             
             exposong.main.main.library.remove_if(presentation=item.presentation)
             exposong.log.info('Deleting "%s"', item.filename)
@@ -304,7 +333,8 @@ class PresList(gtk.TreeView, exposong._hook.Menu):
     @staticmethod
     def get_model_args():
         "Get the arguments for the model."
-        return (gobject.TYPE_PYOBJECT,)
+        # Columns: ScheduleItem, sort key (see exposong.glob.get_sort_key)
+        return (gobject.TYPE_PYOBJECT, gobject.TYPE_STRING)
     
     @classmethod
     def merge_menu(cls, uimanager):
@@ -0,0 +1,131 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Renders slides offscreen, without opening the main window or needing a
+display.
+
+Slides are drawn by the same theme code as the presentation screen, into a
+cairo image surface. This can be used to create images of slides, and to test
+or time the rendering of themes from the command line:
+
+    exposong --render song.xml --theme theme.xml --slide 2 --size 1920x1080
+"""
+
+import cairo
+import gtk.gdk
+import os.path
+import sys
+import time
+
+import exposong
+import exposong.plugins
+import exposong.plugins._abstract
+import exposong.theme
+from exposong.config import config
+
+
+def load_presentation(filename):
+    "Load a presentation file, or return None if it is not a presentation."
+    exposong.plugins.load_plugins()
+    plugins = exposong.plugins.get_plugins_by_capability(
+            exposong.plugins._abstract.Presentation)
+    for plugin in plugins:
+        try:
+            return plugin(filename)
+        except exposong.plugins._abstract.WrongPresentationType:
+            continue
+        except Exception, details:
+            exposong.log.error('Could not load presentation "%s":\n  %s',
+                               filename, details)
+            return None
+    exposong.log.warning('"%s" is not a presentation file.', filename)
+    return None
+
+def get_slides(pres):
+    "Return the slides of a presentation, in the order of the slide list."
+    if config.get('songs', 'show_in_order') == "True"\
+            and pres.get_type() == "song":
+        slides = list(pres.get_slides_in_order())
+    else:
+        slides = list(pres.get_slide_list())
+    if pres.get_type() == "song" and config.get('songs', 'title_slide') == "True":
+        slides.insert(0, pres.get_title_slide())
+    return [s[0] for s in slides]
+
+def render_slide(theme, slide, size):
+    """
+    Render a slide with a theme, and return the cairo image surface.
+    
+    `theme` is a `Theme` or the filename of a theme, and `size` is the
+    (width, height) of the image.
+    """
+    if not isinstance(theme, exposong.theme.Theme):
+        theme = exposong.theme.Theme(theme)
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, *size)
+    ccontext = gtk.gdk.CairoContext(cairo.Context(surface))
+    theme.render(ccontext, size, slide)
+    surface.flush()
+    return surface
+
+def render_file(theme_file, pres_file, index, size, output=None):
+    """
+    Render slide number `index` of a presentation file.
+    
+    Returns the cairo image surface, and writes it to `output` as a PNG image
+    if a filename is given.
+    """
+    pres = load_presentation(pres_file)
+    if pres is None:
+        raise Exception('Could not load presentation "%s".' % pres_file)
+    slides = get_slides(pres)
+    if not 0 <= index < len(slides):
+        raise Exception('"%s" does not have a slide %d.' % (pres_file, index))
+    theme = exposong.theme.Theme(theme_file)
+    surface = render_slide(theme, slides[index], size)
+    if output:
+        surface.write_to_png(output)
+    return surface
+
+def parse_size(text):
+    "Return the (width, height) of a size written as WIDTHxHEIGHT."
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise Exception('The size "%s" should look like 1024x768.' % text)
+    if width <= 0 or height <= 0:
+        raise Exception('The size "%s" is too small.' % text)
+    return width, height
+
+def run():
+    "Render the slide given on the command line, and exit."
+    options = exposong.options
+    if not options.theme:
+        exposong.log.error("A theme is needed to render a slide (--theme).")
+        sys.exit(2)
+    try:
+        size = parse_size(options.size)
+        begin = time.time()
+        render_file(os.path.abspath(options.theme),
+                    os.path.abspath(options.render),
+                    options.slide, size, options.output)
+    except Exception, details:
+        exposong.log.error(str(details))
+        sys.exit(1)
+    exposong.log.info('Rendered "%s" in %.1f ms.', options.output,
+                      (time.time() - begin) * 1000)
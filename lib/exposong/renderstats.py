@@ -0,0 +1,228 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Timing statistics for the frames of the presentation screen.
+
+The screen starts a frame with `stats.begin_frame()` and ends it with
+`stats.end_frame()`. In between, the theme and the overlays add the time they
+spent to a category with `stats.add()`. Time that is added outside of a frame,
+or from another thread, is ignored, so the preview and the theme editor do not
+change the statistics.
+
+`StatsOverlay` shows the statistics on the presentation screen.
+"""
+
+import gobject
+import heapq
+import pango
+import threading
+from timeit import default_timer as timer
+
+import exposong.imagepool
+import exposong.overlay
+
+BACKGROUNDS = 'backgrounds'
+TEXT = 'text'
+EFFECTS = 'shadow/outline'
+IMAGES = 'images'
+NOTIFY = 'notification'
+OVERLAYS = 'overlays'
+BLIT = 'blit'
+CATEGORIES = (BACKGROUNDS, TEXT, EFFECTS, IMAGES, NOTIFY, OVERLAYS, BLIT)
+
+# The number of most expensive frames kept for the session.
+WORST_FRAMES = 5
+
+
+class RenderStats(object):
+    """
+    Collects the time spent on each frame, split into categories.
+    """
+    def __init__(self):
+        self._current = None
+        self._thread = None
+        self.reset()
+    
+    def reset(self):
+        "Clear the statistics."
+        self.frames = 0
+        self.rendered = 0
+        self.total_cost = 0.0
+        self.totals = dict.fromkeys(CATEGORIES, 0.0)
+        self.last = None
+        self._worst = []
+        self._caches = {}
+        self._label = None
+    
+    def begin_frame(self):
+        "Start timing a frame on the current thread."
+        self._current = dict.fromkeys(CATEGORIES, 0.0)
+        self._thread = threading.current_thread()
+        self._label = None
+    
+    def set_label(self, label):
+        "Mark the current frame as a rendered slide, described by `label`."
+        if self._thread is threading.current_thread():
+            self._label = label
+    
+    def add(self, category, cost):
+        "Add `cost` seconds to a category of the current frame."
+        if self._current is not None and \
+                self._thread is threading.current_thread():
+            self._current[category] += cost
+    
+    def count(self, cache, hit):
+        "Count a hit or a miss of a named cache."
+        counts = self._caches.setdefault(cache, [0, 0])
+        if hit:
+            counts[0] += 1
+        else:
+            counts[1] += 1
+    
+    def end_frame(self):
+        "Finish the current frame."
+        frame, self._current = self._current, None
+        if frame is None:
+            return
+        cost = sum(frame.values())
+        self.frames += 1
+        self.total_cost += cost
+        for k, v in frame.iteritems():
+            self.totals[k] += v
+        self.last = (cost, self._label, frame)
+        if self._label is not None:
+            self.rendered += 1
+            if len(self._worst) < WORST_FRAMES:
+                heapq.heappush(self._worst, self.last)
+            else:
+                heapq.heappushpop(self._worst, self.last)
+    
+    def get_worst_frames(self):
+        """
+        Return the most expensive rendered frames of the session, starting with
+        the worst, as (seconds, label, {category: seconds}).
+        """
+        return sorted(self._worst, reverse=True)
+    
+    def get_hit_rates(self):
+        "Return the hit rate of each cache, from 0.0 to 1.0."
+        caches = dict(self._caches)
+        usage = exposong.imagepool.pool.get_usage()
+        caches['images'] = (usage['hits'], usage['misses'])
+        rates = {}
+        for name, (hits, misses) in caches.iteritems():
+            if hits + misses:
+                rates[name] = float(hits) / (hits + misses)
+        return rates
+    
+    def get_statistics(self):
+        "Return the statistics as a dictionary, with times in milliseconds."
+        frames = max(self.frames, 1)
+        return {'frames': self.frames,
+                'rendered': self.rendered,
+                'average_ms': self.total_cost / frames * 1000,
+                'categories': dict((k, v / frames * 1000)
+                                   for k, v in self.totals.iteritems()),
+                'hit_rates': self.get_hit_rates(),
+                'worst': [(c * 1000, label) for c, label, f
+                          in self.get_worst_frames()],
+                }
+    
+    def get_lines(self):
+        "Return the statistics as lines of text."
+        lines = []
+        if self.last:
+            cost, label, frame = self.last
+            lines.append("Last frame: %.1f ms" % (cost * 1000))
+            for k in CATEGORIES:
+                if frame[k]:
+                    lines.append("  %s: %.1f ms" % (k, frame[k] * 1000))
+        stat = self.get_statistics()
+        lines.append("%(frames)d frames, %(rendered)d rendered, "
+                     "%(average_ms).1f ms average" % stat)
+        for name, rate in sorted(stat['hit_rates'].iteritems()):
+            lines.append("  %s cache: %d%% hits" % (name, rate * 100))
+        if stat['worst']:
+            lines.append("Worst frames:")
+            for cost, label in stat['worst']:
+                lines.append("  %.1f ms  %s" % (cost, label))
+        return lines
+
+stats = RenderStats()
+
+
+class StatsOverlay(exposong.overlay.Overlay):
+    """
+    Shows the render statistics in the top left corner of the screen.
+    
+    While it is shown, it is updated once a second if a slide was rendered.
+    """
+    stats_category = None
+    
+    def __init__(self):
+        exposong.overlay.Overlay.__init__(self)
+        self._source = None
+        self._seen = None
+        self._layout = None
+        self._layout_key = None
+    
+    def start(self):
+        "Start updating the statistics."
+        if self._source is None:
+            self._source = gobject.timeout_add(1000, self._update)
+    
+    def stop(self):
+        "Stop updating the statistics."
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+    
+    def _update(self):
+        "Redraw if a slide was rendered since the last update."
+        if self._seen != stats.rendered:
+            self._seen = stats.rendered
+            self._layout_key = None
+            self.invalidate()
+        return True
+    
+    def _get_layout(self, bounds):
+        "Return the layout with the current statistics."
+        if self._layout_key != bounds:
+            self._layout_key = bounds
+            self._layout = exposong.overlay.create_layout()
+            self._layout.set_font_description(pango.FontDescription(
+                    "Monospace %d" % max(int(bounds[1] / 60.0), 6)))
+            self._layout.set_text("\n".join(stats.get_lines()))
+        return self._layout
+    
+    def get_rect(self, bounds):
+        "Return the area of the statistics."
+        w, h = self._get_layout(tuple(bounds)).get_pixel_size()
+        return (0, 0, min(w + 20, bounds[0]), min(h + 20, bounds[1]))
+    
+    def render(self, ccontext, bounds):
+        "Draw the statistics."
+        layout = self._get_layout(tuple(bounds))
+        ccontext.update_layout(layout)
+        ccontext.rectangle(*self.get_rect(bounds))
+        ccontext.set_source_rgba(0, 0, 0, 0.7)
+        ccontext.fill()
+        ccontext.set_source_rgb(1, 1, 0)
+        ccontext.move_to(10, 10)
+        ccontext.show_layout(layout)
@@ -0,0 +1,168 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An index of the custom schedule files, so the schedules can be listed at
+startup without reading them.
+
+For each schedule file, the index keeps its title, modification time, size and
+the file names of its presentations. A schedule file is only read, and its
+presentations looked up in the library, when the schedule is first selected,
+or when a presentation it refers to is renamed or deleted. Schedules in the
+archive folder are not listed at startup at all.
+
+The paths are kept as unicode, as they are read back from JSON that way.
+"""
+
+import gobject
+import json
+import os
+import os.path
+import shutil
+from xml.etree import cElementTree as etree
+
+import exposong
+from exposong import DATA_PATH
+from exposong.glob import get_node_text, decode_filename
+
+INDEX_FILE = os.path.join(DATA_PATH, '.cache', 'schedules.json')
+
+# Schedules that are kept, but not listed at startup.
+ARCHIVE_PATH = os.path.join(DATA_PATH, 'sched', 'archive')
+
+
+def list_files(folder):
+    "Return the schedule files in `folder`."
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+            if f.endswith('.xml') and os.path.isfile(os.path.join(folder, f))]
+
+
+class ScheduleIndex(object):
+    """
+    The title, file stamp and presentation files of each schedule file.
+    
+    filename: The file the index is saved in.
+    """
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        # schedule file: {'title', 'mtime', 'size', 'items', 'files'}
+        self._index = {}
+        self._save_source = None
+        self._load_index()
+    
+    def get_entry(self, path):
+        """
+        Return the index entry of a schedule file, reading the file only if it
+        changed. Returns None if it is not a schedule file.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = decode_filename(path)
+        entry = self._index.get(key)
+        # Entries of older versions do not have the presentation files.
+        if entry is not None and entry['mtime'] == st.st_mtime and \
+                entry['size'] == st.st_size and 'files' in entry:
+            return entry
+        try:
+            root = etree.parse(path).getroot()
+        except Exception, details:
+            exposong.log.error('Error reading schedule file "%s":\n  %s',
+                               path, details)
+            return None
+        if root.tag != "schedule":
+            exposong.log.error("%s is not a schedule file.", path)
+            return None
+        try:
+            title = get_node_text(root.findall("title")[0])
+        except IndexError:
+            title = os.path.splitext(os.path.basename(path))[0]
+        files = [decode_filename(os.path.basename(get_node_text(node)))
+                 for node in root.findall("presentation/file")]
+        entry = {'title': title,
+                 'mtime': st.st_mtime,
+                 'size': st.st_size,
+                 'items': len(root.findall("presentation")),
+                 'files': files,
+                 }
+        self._index[key] = entry
+        self._queue_save()
+        return entry
+    
+    def refers_to(self, path, filename):
+        """
+        Return True if the schedule file `path` contains the presentation file
+        `filename`, or if the schedule file cannot be read.
+        """
+        entry = self.get_entry(path)
+        if entry is None:
+            return True
+        return decode_filename(filename) in entry['files']
+    
+    def remove(self, path):
+        "Remove a deleted or moved schedule file from the index."
+        if self._index.pop(decode_filename(path), None) is not None:
+            self._queue_save()
+    
+    def prune(self, folder, paths):
+        "Remove the entries of files in `folder` that are not in `paths`."
+        folder = decode_filename(folder)
+        keep = set(decode_filename(path) for path in paths)
+        for key in self._index.keys():
+            if os.path.dirname(key) == folder and key not in keep:
+                del self._index[key]
+                self._queue_save()
+    
+    def _load_index(self):
+        "Read the index from disk."
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as fl:
+                self._index = dict(json.load(fl))
+        except (IOError, ValueError, TypeError):
+            exposong.log.warning('The schedule index "%s" could not be read. '
+                                 'The schedules will be read again.',
+                                 self.filename)
+            self._index = {}
+    
+    def _queue_save(self):
+        "Write the index when the program is idle."
+        if self._save_source is None:
+            self._save_source = gobject.idle_add(self._save_index,
+                                                 priority=gobject.PRIORITY_LOW)
+    
+    def _save_index(self):
+        "Write the index to disk."
+        self._save_source = None
+        folder = os.path.dirname(self.filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        try:
+            with open(self.filename + '.new', 'w') as fl:
+                json.dump(self._index, fl)
+            shutil.move(self.filename + '.new', self.filename)
+        except IOError:
+            exposong.log.warning('Could not save the schedule index "%s".',
+                                 self.filename)
+        return False
+
+index = ScheduleIndex()
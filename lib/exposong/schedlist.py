@@ -25,12 +25,16 @@ import gtk
 import gtk.gdk
 import gobject
 import os
+import shutil
 
 import exposong.main
 import exposong._hook
+import exposong.prepare
 import exposong.preslist
+import exposong.schedindex
 import exposong.schedule
 from exposong import DATA_PATH
+from exposong.glob import find_freefile
 from exposong import statusbar
 
 schedlist = None
@@ -121,6 +125,7 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
         if self.has_selection():
             sched = self.get_active_item()
             if isinstance(sched, exposong.schedule.Schedule):
+                sched.ensure_loaded()
                 preslist.set_model(sched.get_model())
                 preslist.columns_autosize()
                 if sched.is_reorderable():
@@ -137,6 +142,11 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
 
         self._actions.get_action("sched-rename").set_sensitive(enable)
         self._actions.get_action("sched-delete").set_sensitive(enable)
+        archived = enable and _is_archived(sched)
+        self._actions.get_action("sched-archive").set_sensitive(
+                enable and not archived)
+        self._actions.get_action("sched-restore").set_sensitive(archived)
+        self._actions.get_action("sched-prepare").set_sensitive(enable)
         
         preslist.get_model().connect("row-changed", preslist._on_pres_added)
     
@@ -161,8 +171,69 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
             if item.filename and os.path.isfile(item.filename):
                 os.remove(os.path.join(DATA_PATH, "sched",item.filename))
             self.remove(item)
+            item.release()
             self.set_cursor((0,))
     
+    def _on_sched_prepare(self, action):
+        'Render the slides of the selected schedule before the service.'
+        item = self.get_active_item()
+        if not item or item.is_builtin():
+            return False
+        exposong.prepare.PrepareDialog(self.get_toplevel(), item)
+    
+    def _on_sched_archive(self, action):
+        'Move the selected schedule to the archive folder.'
+        self._move_schedule(exposong.schedindex.ARCHIVE_PATH)
+    
+    def _on_sched_restore(self, action):
+        'Move the selected schedule from the archive folder.'
+        self._move_schedule(os.path.join(DATA_PATH, "sched"))
+    
+    def _move_schedule(self, folder):
+        'Move the file of the selected schedule to `folder`.'
+        item = self.get_active_item()
+        if not item or item.is_builtin():
+            return False
+        item.save()
+        if not os.path.isfile(item.filename):
+            return False
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        dest = find_freefile(os.path.join(folder,
+                                          os.path.basename(item.filename)))
+        exposong.log.info('Moving custom schedule "%s" to "%s".', item.title,
+                          folder)
+        shutil.move(item.filename, dest)
+        exposong.schedindex.index.remove(item.filename)
+        item.filename = dest
+        if _is_archived(item) and \
+                not self._actions.get_action('sched-show-archive').get_active():
+            self.remove(item)
+            item.release()
+            self.set_cursor((0,))
+        else:
+            self._on_schedule_activate()
+    
+    def _on_show_archive(self, action):
+        'Show or hide the archived schedules.'
+        if action.get_active():
+            for path in exposong.schedindex.list_files(
+                    exposong.schedindex.ARCHIVE_PATH):
+                exposong.main.main.list_sched(path)
+            return
+        itr = self.model.iter_children(None)
+        while itr:
+            sched = self.model.get_value(itr, 0)
+            itr2 = self.model.iter_next(itr)
+            if sched and not sched.is_builtin() and _is_archived(sched):
+                if sched is self.get_active_item():
+                    self.set_cursor((0,))
+                sched.save()
+                self.model.remove(itr)
+                sched.release()
+            itr = itr2
+        self._add_to_schedule_menu()
+    
     def _on_pres_drop(self, treeview, context, x, y, timestamp):
         'Makes sure that the schedule was dropped on a custom schedule.'
         drop_info = treeview.get_dest_row_at_pos(x, y)
@@ -237,9 +308,10 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
         if len(new_text.strip()) == 0:
             return
         iter1 = self.model.get_iter(path)
+        self.model.get_value(iter1, 0).ensure_loaded()
         exposong.log.info('Renaming custom schedule "%s" to "%s".',
                           self.model.get_value(iter1, 0).title, new_text)
-        self.model.get_value(iter1, 0).title = new_text
+        self.model.get_value(iter1, 0).set_title(new_text)
         self.model.set_value(iter1, 1, new_text)
         self.model.set_value(iter1, 2, new_text)
         self._add_to_schedule_menu()
@@ -251,6 +323,9 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
                 menu = gtk.Menu()
                 menu.append(self._actions.get_action('sched-rename').create_menu_item())
                 menu.append(self._actions.get_action('sched-delete').create_menu_item())
+                menu.append(self._actions.get_action('sched-prepare').create_menu_item())
+                menu.append(self._actions.get_action('sched-archive').create_menu_item())
+                menu.append(self._actions.get_action('sched-restore').create_menu_item())
                 menu.show_all()
                 menu.popup(None, None, None, event.button, event.get_time())
     
@@ -311,6 +386,21 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
                 ('sched-delete', gtk.STOCK_DELETE, _("Delete Schedule"), None,
                         _("Delete the currently selected schedule"),
                         schedlist._on_sched_delete ),
+                ('sched-prepare', gtk.STOCK_EXECUTE, _("_Prepare Schedule"),
+                        None, _("Render all slides of the selected schedule "
+                                "before the service"),
+                        schedlist._on_sched_prepare),
+                ('sched-archive', None, _("_Archive Schedule"), None,
+                        _("Move the selected schedule to the archive, which is "
+                          "not loaded at startup"), schedlist._on_sched_archive),
+                ('sched-restore', None, _("Restore Schedule"), None,
+                        _("Move the selected schedule out of the archive"),
+                        schedlist._on_sched_restore),
+                ])
+        cls._actions.add_toggle_actions([
+                ('sched-show-archive', None, _("Show Archived Schedules"), None,
+                        _("List the schedules in the archive"),
+                        schedlist._on_show_archive),
                 ])
         
         uimanager.insert_action_group(cls._actions, -1)
@@ -327,6 +417,11 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
                         <menu action="edit-schedule">
                             <menuitem action='sched-rename' />
                             <menuitem action='sched-delete' />
+                            <menuitem action='sched-prepare' />
+                            <separator />
+                            <menuitem action='sched-archive' />
+                            <menuitem action='sched-restore' />
+                            <menuitem action='sched-show-archive' />
                         </menu>
                     </menu>
                 </menubar>
@@ -344,3 +439,8 @@ class ScheduleList(gtk.TreeView, exposong._hook.Menu, exposong._hook.Toolbar):
                 </placeholder>
             </toolbar>
             """)
+
+
+def _is_archived(sched):
+    'Return True if the file of `sched` is in the archive folder.'
+    return os.path.dirname(sched.filename) == exposong.schedindex.ARCHIVE_PATH
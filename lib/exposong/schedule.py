@@ -16,15 +16,115 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import gobject
 import gtk
 import gtk.gdk
+import os
 import os.path
+import re
+import shutil
 from xml.etree import cElementTree as etree
 
 from exposong import DATA_PATH
 from exposong import preslist
-from exposong.glob import get_node_text, check_filename
+from exposong.glob import get_node_text, title_to_filename, find_freefile
+from exposong.glob import get_sort_key, decode_filename
+import exposong.main
 import exposong.plugins._abstract
+import exposong.schedindex
+
+# Changed schedules are saved when they were not changed for this long, in
+# milliseconds.
+SAVE_DELAY = 2000
+
+# The custom schedules that contain each presentation, see `get_schedules()`.
+# Entries are added when rows are indexed, and are checked when they are read.
+_pres_schedules = {}
+
+# The custom schedules whose file was not read yet, see `_load_unread()`.
+_unread_schedules = []
+
+
+def _load_unread(filename, renamed=None):
+    """
+    Read the custom schedules that were not read yet and contain the
+    presentation file `filename`, so their presentations can be found. The
+    schedule index tells which schedules contain the file.
+    
+    renamed: Old presentation file name as unicode: presentation, for files
+             that were renamed since the schedules were listed.
+    """
+    for sched in _unread_schedules[:]:
+        if exposong.schedindex.index.refers_to(sched._unread, filename):
+            sched.ensure_loaded(renamed)
+
+def get_schedules(presentation):
+    'Return the custom schedules that contain `presentation`.'
+    _load_unread(os.path.basename(presentation.filename))
+    scheds = [s for s in _pres_schedules.get(presentation, ())
+              if s.contains(presentation)]
+    if scheds:
+        _pres_schedules[presentation] = scheds
+    else:
+        _pres_schedules.pop(presentation, None)
+    return scheds
+
+def rename_presentation(presentation, old_filename):
+    """
+    Update the schedules of `presentation` after its file was renamed.
+    
+    The archived schedules that are not listed are changed on disk. A
+    presentation that was deleted is not removed from them, it is reported
+    missing when the schedule is restored.
+    """
+    old = os.path.basename(old_filename)
+    # The unread schedules still have the old file name.
+    _load_unread(old, {decode_filename(old): presentation})
+    for sched in _pres_schedules.get(presentation, ()):
+        sched.update_filename(old_filename)
+    _rename_in_archive(old, os.path.basename(presentation.filename))
+
+def _rename_in_archive(old, new):
+    'Change the presentation file `old` to `new` in the archived schedules.'
+    index = exposong.schedindex.index
+    for path in exposong.schedindex.list_files(exposong.schedindex.ARCHIVE_PATH):
+        if not index.refers_to(path, old):
+            continue
+        try:
+            tree = etree.parse(path)
+        except Exception, details:
+            exposong.log.error('Error reading schedule file "%s":\n  %s',
+                               path, details)
+            continue
+        for node in tree.getroot().findall("presentation/file"):
+            name = os.path.basename(get_node_text(node))
+            if decode_filename(name) == decode_filename(old):
+                node.text = new
+        try:
+            tree.write(path + '.new', encoding=u'UTF-8')
+            shutil.move(path + '.new', path)
+        except (IOError, OSError), details:
+            exposong.log.error('Could not save schedule file "%s":\n  %s',
+                               path, details)
+            if os.path.exists(path + '.new'):
+                os.remove(path + '.new')
+            continue
+        index.get_entry(path)
+
+def _forget_unread(sched):
+    'Remove `sched` from the unread schedules.'
+    for i, s in enumerate(_unread_schedules):
+        if s is sched:
+            del _unread_schedules[i]
+            break
+
+def _add_schedule(presentation, sched):
+    'Record that `sched` contains `presentation`.'
+    scheds = _pres_schedules.setdefault(presentation, [])
+    for s in scheds:
+        if s is sched:
+            return
+    scheds.append(sched)
 
 
 class Schedule:
@@ -32,9 +132,22 @@ class Schedule:
     Schedule of presentations.
     Can be built-in or user-defined.
     '''
-    def __init__(self, title="", filename = None, builtin = True, model = None):
-        'Initialize the Schedule.'
+    def __init__(self, title="", filename = None, builtin = True, model = None,
+                 lazy = False):
+        """
+        Initialize the Schedule.
+        
+        If `lazy` is True, the schedule file is not read until
+        `ensure_loaded()` is called. See exposong.schedindex.
+        """
         self.title = title
+        self._unread = None
+        if lazy:
+            self._unread = filename
+            _unread_schedules.append(self)
+        # True if the schedule changed since it was loaded or saved.
+        self._dirty = False
+        self._save_source = None
         if model == None:
             self._model = gtk.ListStore(*preslist.PresList.get_model_args())
         else:
@@ -44,12 +157,28 @@ class Schedule:
             self.filename = os.path.join(DATA_PATH, "sched")
         else:
             self.filename = filename
+        
+        # The (item, iter) of each presentation file name, see
+        # `_get_entries()`. Only schedules with their own list store are
+        # indexed, as its iters stay valid while the row exists. The index is
+        # None when it has to be built again.
+        self._indexed = isinstance(self._model, gtk.ListStore)
+        self._index = None
+        # The number of rows that are removed by this class, and were already
+        # dropped from the index.
+        self._removing = 0
+        # Presentation class: the builtin schedule with its presentations,
+        # see `add_partition()`.
+        self._partitions = {}
+        if self._indexed:
+            self._model.connect('row-inserted', self._on_row_changed)
+            self._model.connect('row-changed', self._on_row_changed)
+            self._model.connect('row-deleted', self._on_row_deleted)
+            self._model.connect('rows-reordered', self._on_rows_reordered)
 
         self._model.builtin = builtin
         if builtin:
-            mod = self.get_model(True)
-            mod.set_sort_func(0, self._column_sort)
-            mod.set_sort_column_id(0, gtk.SORT_ASCENDING)
+            self.get_model(True).set_sort_column_id(1, gtk.SORT_ASCENDING)
         else:
             if filename:
                 exposong.log.info('Adding custom schedule "%s".',
@@ -57,10 +186,18 @@ class Schedule:
             else:
                 exposong.log.info('Adding custom schedule "%s".',
                                   title)
+                # A new schedule does not have a file yet.
+                self._set_dirty()
     
-    def load(self, dom, library):
-        'Loads from an xml file.'
+    def load(self, dom, library, renamed=None):
+        """
+        Loads from an xml file.
+        
+        renamed: Old presentation file name as unicode: presentation, for
+                 files that were renamed since the schedule was saved.
+        """
         self.clear()
+        changed = False
         self._model.builtin = False
         self.title = get_node_text(dom.findall("title")[0])
         for presNode in dom.findall("presentation"):
@@ -81,6 +218,9 @@ class Schedule:
             
             if filenm:
                 pres = library.find(filename=filenm)
+                if not pres and renamed and decode_filename(filenm) in renamed:
+                    pres = renamed[decode_filename(filenm)]
+                    changed = True
                 if pres:
                     self.get_model(True).append(ScheduleItem(pres, comment).get_row())
                     exposong.log.info('Adding %s presentation "%s" to schedule "%s".',
@@ -88,10 +228,94 @@ class Schedule:
                 else:
                     exposong.log.warning('Missing presentation file "%s" in schedule "%s".',
                                          filenm, self.title)
-            
+        self._set_clean()
+        if changed:
+            # Save the new file names.
+            self._set_dirty()
+    
+    def ensure_loaded(self, renamed=None):
+        """
+        Read the schedule file, the first time the schedule is used.
+        
+        renamed: See `load()`.
+        """
+        if self._unread is None:
+            return
+        filenm, self._unread = self._unread, None
+        _forget_unread(self)
+        try:
+            dom = etree.parse(filenm)
+        except Exception, details:
+            exposong.log.error('Error reading schedule file "%s":\n  %s',
+                               filenm, details)
+            return
+        self.load(dom.getroot(), exposong.main.main.library, renamed)
+    
+    def is_loaded(self):
+        'Return False if the schedule file was not read yet.'
+        return self._unread is None
+    
+    def set_title(self, title):
+        'Rename the schedule.'
+        self.title = title
+        self._set_dirty()
+    
+    def is_dirty(self):
+        'Return True if the schedule changed since it was saved.'
+        return self._dirty
+    
+    def _set_dirty(self):
+        'Mark a custom schedule as changed, and save it soon.'
+        if self.is_builtin():
+            return
+        self._dirty = True
+        # Wait until the changes stop before saving.
+        if self._save_source is not None:
+            gobject.source_remove(self._save_source)
+        self._save_source = gobject.timeout_add(SAVE_DELAY, self._save_later)
+    
+    def _set_clean(self):
+        'Mark the schedule as saved.'
+        self._dirty = False
+        if self._save_source is not None:
+            gobject.source_remove(self._save_source)
+            self._save_source = None
+    
+    def _save_later(self):
+        'Save the schedule after it was changed.'
+        self._save_source = None
+        if self._dirty:
+            self.save()
+        return False
+    
+    def _get_save_filename(self):
+        'Return the file to save the schedule to, named after the title.'
+        if os.path.isdir(self.filename):
+            folder = self.filename
+        else:
+            folder = os.path.dirname(self.filename)
+        name = title_to_filename(self.title)
+        # Keep a file that find_freefile() numbered, like "name-1.xml". The
+        # title is unicode, and the file name is bytes from the file system.
+        if re.match(re.escape(decode_filename(name)) + r'(-\d+)?\.xml$',
+                    decode_filename(os.path.basename(self.filename)),
+                    re.UNICODE):
+            return self.filename
+        return find_freefile(os.path.join(folder, name + ".xml"))
+    
     def save(self):
-        'Write schedule to disk.'
-        self.filename = check_filename(self.title, self.filename)
+        """
+        Write schedule to disk.
+        
+        The schedule is written to a temporary file first, which then replaces
+        the schedule file, so the file is never left half written. Changed
+        schedules are saved by a timeout on the main loop, see `_set_dirty()`.
+        """
+        if not self.is_loaded():
+            # The file did not change.
+            return
+        old_filename = self.filename
+        self.filename = self._get_save_filename()
         root = etree.Element("schedule")
         root.attrib["created"] = "0"
         root.attrib["modified"] = "0"
@@ -113,10 +337,33 @@ class Schedule:
             root.append(node)
             itr = self.iter_next(itr)
         dom = etree.ElementTree(root)
-        dom.write(self.filename, encoding=u'UTF-8')
+        try:
+            dom.write(self.filename + '.new', encoding=u'UTF-8')
+            shutil.move(self.filename + '.new', self.filename)
+        except (IOError, OSError), details:
+            exposong.log.error('Could not save schedule "%s":\n  %s',
+                               self.title, details)
+            try:
+                if os.path.isfile(self.filename + '.new'):
+                    os.remove(self.filename + '.new')
+            except OSError:
+                pass
+            self.filename = old_filename
+            return
+        self._set_clean()
+        if old_filename != self.filename:
+            exposong.schedindex.index.remove(old_filename)
+            try:
+                if os.path.isfile(old_filename):
+                    os.remove(old_filename)
+            except OSError, details:
+                exposong.log.warning('Could not remove the old schedule file '
+                                     '"%s":\n  %s', old_filename, details)
+        exposong.schedindex.index.get_entry(self.filename)
     
     def append(self, pres, comment = ""):
         'Add a presentation to the schedule.'
+        self.ensure_loaded()
         if not self.is_builtin():
             exposong.log.info('Adding %s presentation "%s" to schedule "%s".',
                               pres.get_type(), pres.get_title(), self.title)
@@ -125,6 +372,42 @@ class Schedule:
         else:
             sched = ScheduleItem(pres, comment)
         self.get_model(True).append(sched.get_row())
+        partition = self._partitions.get(sched.presentation.__class__)
+        if partition is not None:
+            partition.append(sched)
+    
+    def add_partition(self, cls, schedule):
+        """
+        Keep the presentations of the class `cls` in `schedule` as well.
+        
+        Presentations added to or removed from this schedule are added to or
+        removed from the partition, so the partition does not have to filter
+        all rows of this schedule. The presentations that are here already
+        are copied.
+        """
+        self._partitions[cls] = schedule
+        model = self.get_model(True)
+        itr = model.get_iter_first()
+        while itr:
+            item = model.get_value(itr, 0)
+            if item.presentation.__class__ is cls:
+                schedule.append(item)
+            itr = model.iter_next(itr)
+    
+    def update_sort_key(self, presentation):
+        'Sort the rows of `presentation` again, after its title was changed.'
+        partition = self._partitions.get(presentation.__class__)
+        if partition is not None:
+            partition.update_sort_key(presentation)
+        model = self.get_model(True)
+        key = get_sort_key(presentation.get_title())
+        # Setting the key can move the rows of a sorted model.
+        for itr in [model.get_iter(path) for path in self.get_rows(presentation)]:
+            model.set_value(itr, 1, key)
+    
+    def get_partition(self, cls):
+        'Return the schedule with the presentations of the class `cls`.'
+        return self._partitions.get(cls)
     
     def append_action(self, action):
         'Add the selected presentation to the schedule (from a Menu button).'
@@ -134,10 +417,21 @@ class Schedule:
     
     def remove(self, itr):
         'Remove a presentation from a schedule.'
-        self.get_model(True).remove(itr)
+        model = self.get_model(True)
+        if self._indexed:
+            self._forget_item(model.get_value(itr, 0), itr)
+        model.remove(itr)
     
     def remove_if(self, presentation):
         'Searches and removes a presentation if it matches.'
+        partition = self._partitions.get(presentation.__class__)
+        if partition is not None:
+            partition.remove_if(presentation)
+        if self._indexed:
+            entries = self._find_entries(presentation)
+            for item, itr in entries:
+                self.remove(itr)
+            return bool(entries)
         itr = self.get_iter_first()
         ret = False
         while itr:
@@ -151,6 +445,49 @@ class Schedule:
                 itr = self.iter_next(itr)
         return ret
     
+    def replace(self, old, new):
+        'Replace the presentation `old` with `new`, keeping the comments.'
+        model = self.get_model(True)
+        if self._indexed:
+            for item, itr in self._find_entries(old):
+                self._forget_item(item)
+                model[itr] = ScheduleItem(new, item.comment).get_row()
+            return
+        for path in self.get_rows(old):
+            item = model.get_value(model.get_iter(path), 0)
+            model[path] = ScheduleItem(new, item.comment).get_row()
+    
+    def contains(self, presentation):
+        'Return True if `presentation` is in the schedule.'
+        if not self._indexed:
+            return bool(self.get_rows(presentation))
+        return bool(self._find_entries(presentation))
+    
+    def get_rows(self, presentation):
+        'Return the paths of the rows of `presentation`.'
+        model = self.get_model(True)
+        if self._indexed:
+            return sorted(model.get_path(itr) for item, itr
+                          in self._find_entries(presentation))
+        rows = []
+        itr = model.get_iter_first()
+        while itr:
+            if model.get_value(itr, 0).presentation is presentation:
+                rows.append(model.get_path(itr))
+            itr = model.iter_next(itr)
+        return rows
+    
+    def release(self):
+        'Forget this schedule in `get_schedules()`, after it was deleted.'
+        self._set_clean()
+        self._unread = None
+        _forget_unread(self)
+        for scheds in _pres_schedules.itervalues():
+            for i, sched in enumerate(scheds):
+                if sched is self:
+                    del scheds[i]
+                    break
+    
     def get_model(self, getliststore=False):
         'Return the filtered ListModel'
         mod = self._model
@@ -167,15 +504,24 @@ class Schedule:
     
     def find(self, filename):
         'Searches the schedule for the matching filename.'
-        itr = self.get_iter_first()
-        while itr:
-            item = self.get_value(itr, 0)
-            if os.path.basename(item.filename) == filename:
-                return item.presentation
-            itr = self.iter_next(itr)
+        if self._indexed:
+            entries = self._get_entries(filename)
+            if entries:
+                return entries[0][0].presentation
+            return None
+        itr = self.finditer(filename)
+        if itr:
+            return self.get_value(itr, 0).presentation
     
     def finditer(self, filename):
         'Searches the schedule for the matching filename.'
+        if self._indexed:
+            entries = self._get_entries(filename)
+            if not entries:
+                return None
+            # The first row of the file.
+            model = self.get_model(True)
+            return min(entries, key=lambda e: model.get_path(e[1]))[1]
         itr = self.get_iter_first()
         while itr:
             item = self.get_value(itr, 0)
@@ -183,20 +529,85 @@ class Schedule:
                 return itr
             itr = self.iter_next(itr)
     
-    def resort(self):
-        'Force the model to resort'
-        if self.is_builtin():
-            self.get_model(True).set_sort_func(0, self._column_sort)
-    
-    @staticmethod
-    def _column_sort(treemodel, iter1, iter2):
-        c1 = treemodel.get_value(iter1,0).get_title()
-        c2 = treemodel.get_value(iter2,0).get_title()
-        if c1 < c2:
-            return -1
-        if c1 > c2:
-            return 1
-        return 0
+    def update_filename(self, old_filename):
+        'Index the rows of a presentation again, after its file was renamed.'
+        for partition in self._partitions.itervalues():
+            partition.update_filename(old_filename)
+        if self._index is not None:
+            for item, itr in self._index.pop(os.path.basename(old_filename), ()):
+                self._index_item(item, itr)
+        # Save the new file name.
+        self._set_dirty()
+    
+    def _get_entries(self, filename):
+        """
+        Return the (schedule item, list store iter) of the rows with the
+        presentation file `filename`.
+        """
+        if self._index is None:
+            self._index = {}
+            model = self.get_model(True)
+            itr = model.get_iter_first()
+            while itr:
+                self._index_item(model.get_value(itr, 0), itr)
+                itr = model.iter_next(itr)
+        return self._index.get(filename, ())
+    
+    def _find_entries(self, presentation):
+        'Return the (schedule item, list store iter) of `presentation`.'
+        return [e for e in
+                self._get_entries(os.path.basename(presentation.filename))
+                if e[0].presentation is presentation]
+    
+    def _index_item(self, item, itr):
+        'Add a row to the file name index.'
+        if item is None:
+            # Rows are inserted empty when they are dragged.
+            return
+        if not self.is_builtin():
+            _add_schedule(item.presentation, self)
+        if self._index is None:
+            # Built from the model when it is used.
+            return
+        entries = self._index.setdefault(os.path.basename(item.filename), [])
+        for e in entries:
+            if e[0] is item:
+                return
+        entries.append((item, itr.copy()))
+    
+    def _forget_item(self, item, itr=None):
+        """
+        Drop a row from the file name index. If `itr` is given, the row is
+        removed next.
+        """
+        if itr is not None:
+            self._removing += 1
+        if self._index is None or item is None:
+            return
+        filename = os.path.basename(item.filename)
+        entries = [e for e in self._index.get(filename, ()) if e[0] is not item]
+        if entries:
+            self._index[filename] = entries
+        else:
+            self._index.pop(filename, None)
+    
+    def _on_row_changed(self, model, path, itr):
+        'Index a new or changed row.'
+        self._index_item(model.get_value(itr, 0), itr)
+        self._set_dirty()
+    
+    def _on_rows_reordered(self, model, path, itr, new_order):
+        'Save the new order.'
+        self._set_dirty()
+    
+    def _on_row_deleted(self, model, path):
+        'Build the index again if a row was removed by someone else.'
+        self._set_dirty()
+        if self._removing:
+            self._removing -= 1
+        else:
+            # Its iter may still be in the index.
+            self._index = None
     
     #Call model functions
     def __getattr__(self, name):
@@ -224,4 +635,4 @@ class ScheduleItem:
     
     def get_row(self):
         'Get a row to put into the presentation list.'
-        return (self,)
+        return (self, get_sort_key(self.presentation.get_title()))
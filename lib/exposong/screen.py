@@ -22,15 +22,21 @@ initialize the window and set up a few things, but most of the rendering is
 done by the theme.
 """
 
+import cairo
 import gobject
 import gtk
 import os
+import time
 
+import exposong.framecache
+import exposong.imagepool
 import exposong.main
+import exposong.output
 import exposong.prefs
+import exposong.renderstats
 import exposong.slidelist
 import exposong.theme
-import exposong.notify
+import exposong.transition
 
 from exposong.config import config
 from exposong import RESOURCE_PATH
@@ -61,6 +67,34 @@ class Screen(exposong._hook.Menu):
         "Create the screen's GUI."
         self.aspect = 4 / 3
         self._size = None
+        # The composed presentation screen, and its copy scaled for the preview.
+        self._frame = None
+        self._frame_size = None
+        self._preview_frame = None
+        # The frame shown before the last change, while a transition runs.
+        self._prev_frame = None
+        self._transition = None
+        # The render plan with an animated background that is playing, and the
+        # layers below and above the animation.
+        self._anim_plan = None
+        self._anim_under = None
+        self._anim_over = None
+        self._anim_source = None
+        # Drawn over the slide, see exposong.overlay.
+        self._overlays = []
+        # More windows showing the same frame, see exposong.output.
+        self._outputs = []
+        # Copies of the frame scaled to the sizes of the outputs, and the frame
+        # they were scaled from, see `paint_frame()`.
+        self._scaled_frames = {}
+        self._scaled_src = None
+        self.stats = exposong.output.OutputStats()
+        # Shows exposong.renderstats on the screen.
+        self._hud = exposong.renderstats.StatsOverlay()
+        # True if images were missing when the frame or preview was rendered.
+        self._frame_incomplete = False
+        self._preview_incomplete = False
+        exposong.imagepool.pool.add_listener(self._on_image_loaded)
         
         self.window = gtk.Window(gtk.WINDOW_POPUP)
         
@@ -140,6 +174,15 @@ class Screen(exposong._hook.Menu):
         self.aspect = float(geometry[2])/geometry[3]
         self.preview.set_size_request(int(PREV_HEIGHT*self.aspect), PREV_HEIGHT)
         self._size = geometry[2:4]
+        
+        for output in self._outputs:
+            output.destroy()
+        self._outputs = []
+        self._scaled_frames = {}
+        for monitor in exposong.output.get_configured_monitors():
+            output = exposong.output.Output(monitor)
+            if output.reposition(parent):
+                self.add_output(output)
     
     def get_size(self):
         "Get the current screen size."
@@ -157,13 +200,164 @@ class Screen(exposong._hook.Menu):
         if self._actions.get_action('Freeze').get_active() or not self.is_viewable():
             self.preview.queue_draw()
         else:
-            self.pres.queue_draw()
+            if self._transition:
+                self._transition.stop()
+            if self._frame is not None:
+                self._prev_frame = self._frame
+            self._frame = None
+            self._queue_frame()
+    
+    def reset_overlays(self):
+        """
+        Render the overlays again, after their settings changed. The overlays
+        are not rendered again when the slide changes.
+        """
+        for overlay in self._overlays:
+            overlay.invalidate()
+    
+    def fit_slides(self, group, slides):
+        """
+        Use one font size for the texts of `group` on all `slides`, at the size
+        of the screen. Returns the font scale each slide would need on its
+        own, or None if the screen size is not known yet.
+        """
+        if not self._size or not slides:
+            return None
+        plan = self._get_theme(slides[0]).get_plan(self._size)
+        return plan.fit_slides(group, slides)
+    
+    def measure_slides(self, group, slides):
+        """
+        Return the font scale each slide would need for the texts of `group`,
+        without changing the font size of the group. Returns None if the
+        screen size is not known yet.
+        """
+        if not self._size or not slides:
+            return None
+        plan = self._get_theme(slides[0]).get_plan(self._size)
+        return plan.measure_slides(group, slides)
+    
+    def render_thumbnail(self, slide, size):
+        """
+        Render `slide` scaled down to `size`, with the render plan of the
+        screen. Images that are not loaded yet are drawn with placeholders.
+        
+        Returns (cairo image surface, True if no placeholders were used), or
+        None if the screen size is not known yet.
+        """
+        if not self._size:
+            return None
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, *size)
+        ccontext = gtk.gdk.CairoContext(cairo.Context(surface))
+        ccontext.scale(float(size[0]) / self._size[0],
+                       float(size[1]) / self._size[1])
+        exposong.imagepool.pool.set_placeholders(True)
+        try:
+            self._get_theme(slide).get_plan(self._size).render(ccontext, slide)
+            complete = exposong.imagepool.pool.get_missing() == 0
+        finally:
+            exposong.imagepool.pool.set_placeholders(False)
+        return surface, complete
+    
+    def prepare_frame(self, slide):
+        """
+        Render the frame of `slide` at the screen size into the frame cache,
+        waiting for its images. Returns the number of bytes added to the
+        cache, which is 0 if the frame was cached already, has an animated
+        background, or the screen size is not known yet.
+        """
+        if not self._size:
+            return 0
+        theme = self._get_theme(slide)
+        plan = theme.get_plan(self._size)
+        key = exposong.framecache.get_key(theme, slide, self._size)
+        if plan.animations or exposong.framecache.cache.has(key):
+            return 0
+        surface = self._create_frame_surface(self.pres, self._size)
+        plan.render(gtk.gdk.CairoContext(cairo.Context(surface)), slide)
+        exposong.framecache.cache.put(key, surface)
+        return exposong.framecache.get_frame_bytes(self._size)
+    
+    def prefetch(self, slide):
+        'Start loading the images of `slide` at the size of the screen.'
+        if self._size:
+            self._get_theme(slide).get_plan(self._size).prefetch(slide)
+    
+    def _on_image_loaded(self, filename):
+        'Render again with the full quality image instead of a placeholder.'
+        if self._frame_incomplete and self._frame is not None and \
+                not self._actions.get_action('Freeze').get_active():
+            self._frame = self._preview_frame = None
+            self._queue_frame()
+        if self._preview_incomplete:
+            self.preview.queue_draw()
+    
+    def _queue_frame(self):
+        'Redraw the presentation screen and all outputs.'
+        self.pres.queue_draw()
+        for output in self._outputs:
+            output.queue_draw()
+    
+    def add_output(self, output):
+        'Show the presentation on another `exposong.output.Output`.'
+        self._outputs.append(output)
+        if self.is_viewable():
+            output.show()
+    
+    def remove_output(self, output):
+        'Stop showing the presentation on `output`.'
+        self._outputs.remove(output)
+        output.hide()
+    
+    def get_outputs(self):
+        'Return the additional outputs.'
+        return tuple(self._outputs)
+    
+    def add_overlay(self, overlay):
+        'Show `overlay` on top of the slide.'
+        self._overlays.append(overlay)
+        self.damage_overlay(overlay)
+    
+    def remove_overlay(self, overlay):
+        'Stop showing `overlay`.'
+        damage = []
+        if overlay._rect:
+            damage.append(overlay._rect)
+        self._overlays.remove(overlay)
+        self.damage_overlay(overlay, damage)
+    
+    def damage_overlay(self, overlay, damage=()):
+        """
+        Redraw the area of an overlay that changed.
+        
+        `damage` lists additional (x, y, width, height) areas to redraw, such as
+        where the overlay was drawn before it changed.
+        """
+        if self.is_viewable():
+            rects = list(damage)
+            rect = overlay.get_rect(self.pres.window.get_size())
+            if rect:
+                rects.append(rect)
+            for rect in rects:
+                self.pres.queue_draw_area(*rect)
+            for output in self._outputs:
+                output.damage_overlay(overlay)
+        self.preview.queue_draw()
     
     def hide(self, action=None):
         'Remove the presentation screen from view.'
         self._actions.get_action("Present").set_visible(True)
         self._actions.get_action("Hide").set_visible(False)
         self.window.hide()
+        for output in self._outputs:
+            output.hide()
+        self._stop_animation()
+        if self._transition:
+            self._transition.stop()
+        self._frame = self._preview_frame = self._prev_frame = None
+        self._scaled_frames = {}
+        self._scaled_src = None
+        self._log_statistics()
         self._set_menu_items_disabled()
         for nm in ('Freeze', 'Background', 'Logo', 'Black Screen'):
             nmaction = self._actions.get_action(nm)
@@ -177,6 +371,9 @@ class Screen(exposong._hook.Menu):
         self._actions.get_action("Hide").set_visible(True)
         self._actions.get_action("Present").set_visible(False)
         self.window.show_all()
+        self.stats.reset()
+        for output in self._outputs:
+            output.show()
         self._set_menu_items_disabled()
         self._secondary_button_toggle()
         self.draw()
@@ -185,7 +382,7 @@ class Screen(exposong._hook.Menu):
     
     def _expose_screen(self, widget, event):
         'Redraw the presentation screen.'
-        self._draw(widget)
+        self._draw(widget, event.area)
     
     def is_viewable(self):
         "Return true if the screen is currently visible."
@@ -202,8 +399,8 @@ class Screen(exposong._hook.Menu):
                self._actions.get_action('Background').get_active() or
                self._actions.get_action('Freeze').get_active())
     
-    def _draw(self, widget):
-        'Render `widget`.'
+    def _draw(self, widget, area=None):
+        'Render `widget`, limited to `area` if it is given.'
         if not widget.window or not widget.window.is_viewable():
             return False
         
@@ -214,62 +411,370 @@ class Screen(exposong._hook.Menu):
             self._size = self.pres.window.get_size()
         
         ccontext = widget.window.cairo_create()
-        bounds = widget.window.get_size()
-        if widget is self.preview:
-            if self.pres.window:
-                #Scale if the presentation window size is available
-                bounds = self.pres.window.get_size()
-            elif self._size:
-                bounds = self._size
-            if bounds:
-                width = int(float(PREV_HEIGHT)*bounds[0]/bounds[1])
-                ccontext.scale(float(width)/bounds[0],
-                               float(PREV_HEIGHT)/bounds[1])
-        elif widget is self.pres:
-            self.preview.queue_draw()
-        
-        slide = exposong.slidelist.slidelist.get_active_item()
+        if area:
+            ccontext.rectangle(area.x, area.y, area.width, area.height)
+            ccontext.clip()
+        if widget is self.pres:
+            begin = time.time()
+            rstats = exposong.renderstats.stats
+            rstats.begin_frame()
+            frame = self._get_frame(ccontext)
+            blit = exposong.renderstats.timer()
+            if self._transition:
+                self._transition.paint(ccontext)
+            else:
+                ccontext.set_source_surface(frame, 0, 0)
+                ccontext.paint()
+            rstats.add(exposong.renderstats.BLIT,
+                       exposong.renderstats.timer() - blit)
+            self._composite_overlays(ccontext, self._frame_size)
+            rstats.end_frame()
+            self.stats.add_frame(time.time() - begin)
+            if self._preview_frame is None:
+                self.preview.queue_draw()
+        elif widget is self.preview:
+            self._draw_preview(ccontext)
+        return True
+    
+    def get_theme(self, slide):
+        """
+        Return the theme `slide` is shown with: its own theme, or the selected
+        theme. Returns None if no theme is selected yet.
+        """
         theme = None
-        
         if slide:
             theme = slide.get_theme()
         if theme is None:
             theme = exposong.themeselect.themeselect.get_active()
+        return theme
+    
+    def _get_theme(self, slide):
+        'Return the theme for `slide`, selecting the first theme if needed.'
+        theme = self.get_theme(slide)
         if theme is None:
             # Select the first theme if nothing is set as the default.
             exposong.themeselect.themeselect.set_active(0)
             theme = exposong.themeselect.themeselect.get_active()
+        return theme
+    
+    def _get_frame(self, ccontext):
+        """
+        Return the composed presentation screen.
         
-        if widget is self.pres:
-            if self._actions.get_action('Black Screen').get_active():
-                exposong.theme.Theme.render_color(ccontext, bounds, '#000')
-            elif self._actions.get_action('Logo').get_active():
-                logoclr = gtk.gdk.Color(*config.getcolor('screen', 'logo_bg'))
-                exposong.theme.Theme.render_color(ccontext, bounds, logoclr.to_string())
-                self.__logo_img.draw(ccontext, bounds, None)
-            elif self._actions.get_action('Background').get_active():
-                theme.render(ccontext, bounds, None)
+        The frame is only rendered again after `draw()` was called, or when
+        the screen was resized.
+        """
+        bounds = self.pres.window.get_size()
+        if self._frame is None or self._frame_size != bounds:
+            if self._frame_size != bounds:
+                self._prev_frame = None
+            self._frame_size = bounds
+            self._preview_frame = None
+            key = self._get_frame_key(bounds)
+            if key is not None:
+                self._frame = exposong.framecache.cache.get(key)
             else:
-                theme.render(ccontext, bounds, slide)
-        
-        # In Preview show the themes defined in __init__ when
-        # one of the secondary buttons is active.
-        if widget is self.preview:
-            if self._actions.get_action('Black Screen').get_active():
-                self._theme_black.render(ccontext, bounds, None)
-            elif self._actions.get_action('Background').get_active():
-                self._theme_bg.render(ccontext, bounds, None)
-            elif self._actions.get_action('Logo').get_active():
-                self._theme_logo.render(ccontext, bounds, None)
-            elif self._actions.get_action('Freeze').get_active():
-                self._theme_freeze.render(ccontext, bounds, None)
+                self._frame = None
+            if self._frame is not None:
+                self._stop_animation()
+                self._frame_incomplete = False
+                self._set_stats_label(key[0], self._get_theme(key[0]))
             else:
-                theme.render(ccontext, bounds, slide)
+                self._frame = ccontext.get_target().create_similar(
+                        cairo.CONTENT_COLOR, *bounds)
+                exposong.imagepool.pool.set_placeholders(True)
+                try:
+                    self._render_frame(gtk.gdk.CairoContext(
+                            cairo.Context(self._frame)), bounds)
+                    self._frame_incomplete = \
+                            exposong.imagepool.pool.get_missing() > 0
+                finally:
+                    exposong.imagepool.pool.set_placeholders(False)
+                if key is not None and not self._frame_incomplete:
+                    exposong.framecache.cache.put(key, self._frame)
+            self._start_transition()
+        return self._frame
+    
+    def _get_frame_key(self, bounds):
+        """
+        Return the frame cache key of the active slide, or None if the frame
+        should not be cached, because the slide is hidden or the background
+        is animated.
+        """
+        for name in ('Black Screen', 'Logo', 'Background'):
+            if self._actions.get_action(name).get_active():
+                return None
+        slide = exposong.slidelist.slidelist.get_active_item()
+        if not slide:
+            return None
+        theme = self._get_theme(slide)
+        if theme.get_plan(bounds).animations:
+            return None
+        return exposong.framecache.get_key(theme, slide, bounds)
+    
+    def _create_frame_surface(self, widget, size):
+        'Return a surface for a frame, like the surface of `widget`.'
+        if widget.window:
+            return widget.window.cairo_create().get_target().create_similar(
+                    cairo.CONTENT_COLOR, *size)
+        return cairo.ImageSurface(cairo.FORMAT_RGB24, *size)
+    
+    def paint_frame(self, ccontext, bounds, overlays=True):
+        """
+        Paint the presentation frame scaled to `bounds`, for example on an
+        output window. The overlays of the screen are painted as well if
+        `overlays` is True. Returns False if there is no frame to show.
+        """
+        if not self.is_viewable():
+            return False
+        frame = self._get_frame(ccontext)
+        if frame is None:
+            return False
+        bounds = tuple(bounds)
+        fbounds = tuple(self._frame_size)
+        scale = (float(bounds[0]) / fbounds[0],
+                 float(bounds[1]) / fbounds[1])
+        if self._transition:
+            ccontext.save()
+            ccontext.scale(*scale)
+            self._transition.paint(ccontext)
+            ccontext.restore()
+        else:
+            ccontext.set_source_surface(
+                    self._get_scaled_frame(ccontext, frame, bounds), 0, 0)
+            ccontext.paint()
+        if overlays:
+            ccontext.save()
+            ccontext.scale(*scale)
+            self._composite_overlays(ccontext, fbounds)
+            ccontext.restore()
+        return True
+    
+    def _get_scaled_frame(self, ccontext, frame, bounds):
+        'Return the frame scaled to `bounds`, scaling it once for each size.'
+        fbounds = tuple(self._frame_size)
+        if fbounds == bounds:
+            return frame
+        if self._scaled_src is not frame:
+            self._scaled_frames = {}
+            self._scaled_src = frame
+        if bounds not in self._scaled_frames:
+            scaled = ccontext.get_target().create_similar(cairo.CONTENT_COLOR,
+                                                          *bounds)
+            scontext = cairo.Context(scaled)
+            scontext.scale(float(bounds[0]) / fbounds[0],
+                           float(bounds[1]) / fbounds[1])
+            scontext.set_source_surface(frame, 0, 0)
+            scontext.get_source().set_filter(cairo.FILTER_GOOD)
+            scontext.paint()
+            self._scaled_frames[bounds] = scaled
+        return self._scaled_frames[bounds]
+    
+    def _start_transition(self):
+        'Start the configured transition from the previous frame.'
+        old = self._prev_frame
+        self._prev_frame = None
+        kind, duration = exposong.transition.get_configured()
+        if old is None or kind == exposong.transition.CUT or duration <= 0:
+            return
+        self._transition = exposong.transition.Transition(kind, duration, old,
+                self._frame, self._queue_frame, self._on_transition_done)
+        self._transition.start()
+    
+    def _on_transition_done(self, transition):
+        'Show the new frame after the transition finished.'
+        if self._transition is transition:
+            self._transition = None
+            self._queue_frame()
+    
+    def _log_statistics(self):
+        'Log the frame timing of the presentation screen and the outputs.'
+        if not self.stats.frames:
+            return
+        lines = ["Presentation screen: %s" % self.stats.get_text()]
+        for output in self._outputs:
+            lines.append("Output on monitor %d: %s" % (output.monitor,
+                                                     output.stats.get_text()))
+        exposong.log.info("\n".join(lines))
+    
+    def _render_frame(self, ccontext, bounds):
+        'Render the presentation screen to `ccontext`.'
+        slide = exposong.slidelist.slidelist.get_active_item()
+        theme = self._get_theme(slide)
+        self._set_stats_label(slide, theme)
+        if self._actions.get_action('Black Screen').get_active():
+            self._stop_animation()
+            exposong.theme.Theme.render_color(ccontext, bounds, '#000')
+        elif self._actions.get_action('Logo').get_active():
+            self._stop_animation()
+            logoclr = gtk.gdk.Color(*config.getcolor('screen', 'logo_bg'))
+            exposong.theme.Theme.render_color(ccontext, bounds, logoclr.to_string())
+            self.__logo_img.draw(ccontext, bounds, None)
+        elif self._actions.get_action('Background').get_active():
+            self._render_plan(ccontext, theme.get_plan(bounds), None)
+        else:
+            self._render_plan(ccontext, theme.get_plan(bounds), slide)
+    
+    def _set_stats_label(self, slide, theme):
+        'Show the theme and slide of the frame in the render statistics.'
+        if slide:
+            exposong.renderstats.stats.set_label('%s: %s' % (
+                    theme.get_title(), slide.get_title()))
+        else:
+            exposong.renderstats.stats.set_label(theme.get_title())
+    
+    def _render_plan(self, ccontext, plan, slide):
+        """
+        Render a theme plan and a slide.
         
-        exposong.notify.notify.draw(ccontext, bounds)
-            
+        If the theme has an animated background, the layers below and above
+        the animation are rendered once, and the animation is started. If the
+        animation of the plan is playing already, it keeps playing, and only
+        the layer above it is rendered again.
+        """
+        if not plan.animations:
+            self._stop_animation()
+            plan.render(ccontext, slide)
+            return
+        target = ccontext.get_target()
+        if self._anim_plan is not plan:
+            self._stop_animation()
+            self._anim_under = target.create_similar(cairo.CONTENT_COLOR,
+                                                     *plan.bounds)
+            plan.render_static(gtk.gdk.CairoContext(
+                    cairo.Context(self._anim_under)))
+            for op in plan.animations:
+                op.start()
+            rate = max(op.get_frame_rate() for op in plan.animations)
+            self._anim_source = gobject.timeout_add(int(1000 / rate),
+                                                    self._tick_animation)
+        self._anim_over = target.create_similar(cairo.CONTENT_COLOR_ALPHA,
+                                                *plan.bounds)
+        plan.render_slide(gtk.gdk.CairoContext(
+                cairo.Context(self._anim_over)), slide)
+        self._anim_plan = plan
+        self._compose_animation(ccontext)
+    
+    def _compose_animation(self, ccontext):
+        'Draw the current frame of the animation with the cached layers.'
+        ccontext.set_source_surface(self._anim_under, 0, 0)
+        ccontext.paint()
+        self._anim_plan.render_animated(ccontext)
+        ccontext.set_source_surface(self._anim_over, 0, 0)
+        ccontext.paint()
+    
+    def _tick_animation(self):
+        'Show the next frame of the animated background.'
+        if self._frame is None or \
+                self._actions.get_action('Freeze').get_active():
+            return True
+        now = time.time()
+        changed = False
+        for op in self._anim_plan.animations:
+            if op.advance(now):
+                changed = True
+        if changed:
+            self._compose_animation(gtk.gdk.CairoContext(
+                    cairo.Context(self._frame)))
+            self._preview_frame = None
+            # The frame changed in place.
+            self._scaled_frames = {}
+            self._queue_frame()
         return True
     
+    def _stop_animation(self):
+        'Stop the animated background, and release its frames.'
+        if self._anim_source:
+            gobject.source_remove(self._anim_source)
+            self._anim_source = None
+        if self._anim_plan:
+            for op in self._anim_plan.animations:
+                op.stop()
+        self._anim_plan = self._anim_under = self._anim_over = None
+    
+    def _composite_overlays(self, ccontext, bounds):
+        'Paint the overlays over the slide.'
+        for overlay in self._overlays:
+            begin = exposong.renderstats.timer()
+            overlay.composite(ccontext, bounds)
+            if overlay.stats_category:
+                exposong.renderstats.stats.add(overlay.stats_category,
+                        exposong.renderstats.timer() - begin)
+    
+    def _get_preview_frame(self, ccontext):
+        'Return the presentation frame, downsampled to the preview size.'
+        frame = self._get_frame(ccontext)
+        if self._preview_frame is None:
+            bounds = self._frame_size
+            width = int(float(PREV_HEIGHT)*bounds[0]/bounds[1])
+            self._preview_frame = ccontext.get_target().create_similar(
+                    cairo.CONTENT_COLOR, width, PREV_HEIGHT)
+            pcontext = cairo.Context(self._preview_frame)
+            pcontext.scale(float(width)/bounds[0], float(PREV_HEIGHT)/bounds[1])
+            pcontext.set_source_surface(frame, 0, 0)
+            pcontext.get_source().set_filter(cairo.FILTER_GOOD)
+            pcontext.paint()
+        return self._preview_frame
+    
+    def _draw_preview(self, ccontext):
+        """
+        Render the preview.
+        
+        While the presentation is running, the preview shows a scaled copy of
+        the presentation frame. The slide is only rendered for the preview
+        when the screen is hidden.
+        """
+        if self.is_running():
+            ccontext.set_source_surface(self._get_preview_frame(ccontext), 0, 0)
+            ccontext.paint()
+            bounds = self._frame_size
+            width = int(float(PREV_HEIGHT)*bounds[0]/bounds[1])
+            ccontext.scale(float(width)/bounds[0],
+                           float(PREV_HEIGHT)/bounds[1])
+            self._composite_overlays(ccontext, bounds)
+            return
+        
+        bounds = self.preview.window.get_size()
+        if self.pres.window:
+            #Scale if the presentation window size is available
+            bounds = self.pres.window.get_size()
+        elif self._size:
+            bounds = self._size
+        if bounds:
+            width = int(float(PREV_HEIGHT)*bounds[0]/bounds[1])
+            ccontext.scale(float(width)/bounds[0],
+                           float(PREV_HEIGHT)/bounds[1])
+        
+        # In Preview show the themes defined in __init__ when
+        # one of the secondary buttons is active.
+        if self._actions.get_action('Black Screen').get_active():
+            self._theme_black.render(ccontext, bounds, None)
+        elif self._actions.get_action('Background').get_active():
+            self._theme_bg.render(ccontext, bounds, None)
+        elif self._actions.get_action('Logo').get_active():
+            self._theme_logo.render(ccontext, bounds, None)
+        elif self._actions.get_action('Freeze').get_active():
+            self._theme_freeze.render(ccontext, bounds, None)
+        else:
+            slide = exposong.slidelist.slidelist.get_active_item()
+            exposong.imagepool.pool.set_placeholders(True)
+            try:
+                self._get_theme(slide).render(ccontext, bounds, slide)
+                self._preview_incomplete = \
+                        exposong.imagepool.pool.get_missing() > 0
+            finally:
+                exposong.imagepool.pool.set_placeholders(False)
+        self._composite_overlays(ccontext, bounds)
+    
+    def _toggle_render_stats(self, action):
+        'Show or hide the render statistics on the screen.'
+        if action.get_active():
+            self.add_overlay(self._hud)
+            self._hud.start()
+        else:
+            self._hud.stop()
+            self.remove_overlay(self._hud)
+    
     def _set_menu_items_disabled(self):
         'Disable buttons if the presentation is not shown.'
         enabled = self.is_viewable()
@@ -310,6 +815,9 @@ class Screen(exposong._hook.Menu):
                 ('Freeze', 'screen-freeze', _('_Freeze'), None ,
                         _("Freeze the screen."),
                         screen._secondary_button_toggle),
+                ('render-stats', None, _('Render _Statistics'), None,
+                        _("Show how long the screen takes to draw."),
+                        screen._toggle_render_stats),
                 ])
         
         uimanager.insert_action_group(cls._actions, -1)
@@ -324,6 +832,7 @@ class Screen(exposong._hook.Menu):
                         <menuitem action="Logo" position="bot" />
                         <menuitem action="Freeze" position="bot" />
                     </menu>
+                    <menuitem action="render-stats" position="bot" />
                 </menu>
             </menubar>
             """)
@@ -20,9 +20,13 @@
 The SlideList class displays the slides for the currently select presentation.
 """
 
+import collections
 import gtk
 import gobject
+import weakref
 
+import exposong.framecache
+import exposong.imagepool
 import exposong.screen
 import exposong.statusbar
 from exposong import config
@@ -30,6 +34,54 @@ from exposong import config
 slidelist = None #will hold instance of SlideList
 slide_scroll = None
 
+# Verses that need a smaller font scale than this are split, if it is enabled.
+SPLIT_SCALE = 0.7
+
+# The width of the slide thumbnails. The height follows the screen aspect.
+THUMB_WIDTH = 96
+# The largest number of slide thumbnails that are kept.
+MAX_THUMBNAILS = 300
+
+# Slide: (text, parts) of the verses that were split, so the same parts are
+# shown each time, and their prepared frames are found in the frame cache.
+_split_parts = weakref.WeakKeyDictionary()
+
+def fit_slides(pres, slides):
+    """
+    Draw the `slides` of the song `pres` with one font size, and return the
+    slides. If it is enabled, verses that need a too small font are split
+    into parts.
+    """
+    fits = exposong.screen.screen.fit_slides(pres, slides)
+    if fits is None:
+        return slides
+    if config.config.get('songs', 'split_verses') == "True" and \
+            min(fits) < SPLIT_SCALE:
+        result = []
+        for slide, fit in zip(slides, fits):
+            result.extend(_split_slide(pres, slide, fit))
+        exposong.screen.screen.fit_slides(pres, result)
+        return result
+    return slides
+
+def _split_slide(pres, slide, fit):
+    'Return the parts of `slide`, split until each one fits.'
+    if fit >= SPLIT_SCALE or not hasattr(slide, 'split'):
+        return [slide]
+    text = slide.get_text()
+    if slide in _split_parts and _split_parts[slide][0] == text:
+        parts = _split_parts[slide][1]
+    else:
+        parts = slide.split()
+        _split_parts[slide] = (text, parts)
+    if len(parts) < 2:
+        return parts
+    result = []
+    for part in parts:
+        part_fit = exposong.screen.screen.measure_slides(pres, [part])[0]
+        result.extend(_split_slide(pres, part, part_fit))
+    return result
+
 class SlideList(gtk.TreeView, exposong._hook.Menu):
     '''
     The slides of a presentation.
@@ -49,6 +101,17 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
         self.set_size_request(250, -1)
         self.set_enable_search(False)
         
+        self.thumbnails = SlideThumbnails()
+        self.thumbnails.connect_widget(self)
+        self.thumb_column = gtk.TreeViewColumn()
+        self.thumb_column.set_resizable(False)
+        thumbrend = CellRendererSlideThumb(self.thumbnails)
+        self.thumb_column.pack_start(thumbrend, False)
+        self.thumb_column.add_attribute(thumbrend, 'slide', 0)
+        self.thumb_column.set_visible(
+                config.config.get('general', 'slide_thumbnails') == "True")
+        self.append_column(self.thumb_column)
+        
         self.column1 = gtk.TreeViewColumn(_("Slides"))
         self.column1.set_resizable(False)
         self.append_column(self.column1)
@@ -85,11 +148,28 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
         if pres.get_type() == "song" and config.config.get('songs', 'title_slide') == "True":
             slist.insert(0,pres.get_title_slide())
         
+        if pres.get_type() == "song" and \
+                config.config.get('songs', 'uniform_font_size') == "True":
+            self._fit_slides(pres)
+        
         self.__timer += 1
         men = slist.get_iter_first() is not None
         self._actions.get_action("pres-slide-next").set_sensitive(men)
         self._actions.get_action("pres-slide-prev").set_sensitive(men)
     
+    def _fit_slides(self, pres):
+        'Measure all slides, and draw them with one font size.'
+        slist = self.get_model()
+        rows = [tuple(row) for row in slist]
+        slides = fit_slides(pres, [row[0] for row in rows])
+        if [id(s) for s in slides] == [id(row[0]) for row in rows]:
+            return
+        # Verses were split.
+        kept = dict((id(row[0]), row) for row in rows)
+        slist.clear()
+        for slide in slides:
+            slist.append(kept.get(id(slide), (slide, slide.get_markup())))
+    
     def update(self):
         '''When something in the presentation has changed, reset the slidelist and
         activate the slide that was active before'''
@@ -99,6 +179,9 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
             slide = model.get_value(itr,0)
             p = model.get_path(itr)
         
+        # The slides may have changed without becoming new objects.
+        self.thumbnails.discard(row[0] for row in model)
+        exposong.framecache.cache.discard(row[0] for row in model)
         self.set_presentation(self.pres)
         
         if slide:
@@ -180,9 +263,19 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
     
     def _on_slide_activate(self, *args):
         'Present the selected slide to the screen.'
+        self._prefetch()
         exposong.screen.screen.draw()
         self.reset_timer()
     
+    def _prefetch(self):
+        'Start loading the images of the active and the next slide.'
+        (model, itr) = self.get_selection().get_selected()
+        if itr:
+            exposong.screen.screen.prefetch(model.get_value(itr, 0))
+            itr = model.iter_next(itr)
+            if itr:
+                exposong.screen.screen.prefetch(model.get_value(itr, 0))
+    
     def reset_timer(self):
         'Restart the timer.'
         self.__timer += 1
@@ -217,6 +310,11 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
         config.config.set("songs", "show_in_order", str(widget.get_active()))
         self.update()
     
+    def toggle_thumbnails(self, widget):
+        'Called when the "pres-slide-thumbnails" action was toggled'
+        config.config.set("general", "slide_thumbnails", str(widget.get_active()))
+        self.thumb_column.set_visible(widget.get_active())
+    
     @classmethod
     def merge_menu(cls, uimanager):
         'Merge new values with the uimanager.'
@@ -231,6 +329,8 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
         cls._actions.add_toggle_actions([
             ('pres-show-in-order', None, _("Show Slides in Order"), None, None,
                         slidelist.toggle_show_order),
+            ('pres-slide-thumbnails', None, _("Show Slide Thumbnails"), None,
+                        None, slidelist.toggle_thumbnails),
         ])
         
         uimanager.insert_action_group(cls._actions, -1)
@@ -243,11 +343,14 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
                     </placeholder>
                     <separator />
                     <menuitem action="pres-show-in-order" position="bot" />
+                    <menuitem action="pres-slide-thumbnails" position="bot" />
                 </menu>
             </menubar>
             """)
         cls._actions.get_action("pres-slide-next").set_sensitive(False)
         cls._actions.get_action("pres-slide-prev").set_sensitive(False)
+        if config.config.get('general', 'slide_thumbnails') == "True":
+            cls._actions.get_action('pres-slide-thumbnails').set_active(True)
         action = cls._actions.get_action('pres-show-in-order')
         if config.config.get('songs', 'show_in_order') == "True":
             action.set_active(True)
@@ -273,3 +376,155 @@ class SlideList(gtk.TreeView, exposong._hook.Menu):
                 action.set_sensitive(True)
                 return
         action.set_sensitive(False)
+
+
+class SlideThumbnails(object):
+    """
+    Small images of the slides, as they are shown on the screen.
+    
+    Missing thumbnails are rendered one at a time when the program is idle,
+    with the render plans and images of the presentation screen. Rendered
+    thumbnails are kept until `MAX_THUMBNAILS` is reached, least recently used
+    first, so they are reused when a presentation is shown again and are
+    never rendered again while the list is scrolled.
+    """
+    def __init__(self, max_count=MAX_THUMBNAILS):
+        self.max_count = max_count
+        # (slide, theme digest, size): cairo surface
+        self._thumbs = collections.OrderedDict()
+        self._queue = collections.OrderedDict()
+        self._source = None
+        self._widgets = []
+        # Thumbnails drawn with placeholder images, rendered again when an
+        # image finished loading.
+        self._incomplete = set()
+        exposong.imagepool.pool.add_listener(self._on_image_loaded)
+    
+    def connect_widget(self, widget):
+        "Redraw `widget` when a thumbnail was rendered."
+        self._widgets.append(widget)
+    
+    def get_size(self):
+        "Return the size of the thumbnails, or None if it is not known yet."
+        screen = exposong.screen.screen
+        if not screen.get_size():
+            return None
+        width, height = screen.get_size()
+        return (THUMB_WIDTH, max(int(round(float(THUMB_WIDTH) * height / width)),
+                                 1))
+    
+    def _get_key(self, slide, size):
+        "Return the key of a thumbnail."
+        theme = exposong.screen.screen.get_theme(slide)
+        if theme is None:
+            return None
+        return (slide, theme.get_digest(), size)
+    
+    def get(self, slide):
+        """
+        Return the thumbnail of `slide`, or None if it was not rendered yet.
+        Missing thumbnails are queued to be rendered.
+        """
+        size = self.get_size()
+        if size is None:
+            return None
+        key = self._get_key(slide, size)
+        if key is None:
+            return None
+        surface = self._thumbs.pop(key, None)
+        if surface is not None:
+            # Move it to the end, as the most recently used one.
+            self._thumbs[key] = surface
+            return surface
+        self._queue_render(key, slide)
+        return None
+    
+    def _queue_render(self, key, slide):
+        "Render a thumbnail when the program is idle."
+        if key not in self._queue:
+            self._queue[key] = slide
+            if self._source is None:
+                self._source = gobject.idle_add(self._render_next,
+                                                priority=gobject.PRIORITY_LOW)
+    
+    def _on_image_loaded(self, filename):
+        "Render the thumbnails with placeholders again."
+        incomplete, self._incomplete = self._incomplete, set()
+        for key in incomplete:
+            if key in self._thumbs:
+                self._queue_render(key, key[0])
+    
+    def discard(self, slides):
+        "Forget the thumbnails of `slides`, after they were changed."
+        slides = set(slides)
+        for key in self._thumbs.keys():
+            if key[0] in slides:
+                del self._thumbs[key]
+                self._incomplete.discard(key)
+    
+    def _render_next(self):
+        "Render the next queued thumbnail."
+        if not self._queue:
+            self._source = None
+            return False
+        key, slide = self._queue.popitem(last=False)
+        result = exposong.screen.screen.render_thumbnail(slide, key[2])
+        if result is not None:
+            surface, complete = result
+            self._thumbs.pop(key, None)
+            self._thumbs[key] = surface
+            if complete:
+                self._incomplete.discard(key)
+            else:
+                self._incomplete.add(key)
+            while len(self._thumbs) > self.max_count:
+                old = self._thumbs.popitem(last=False)[0]
+                self._incomplete.discard(old)
+            for widget in self._widgets:
+                widget.queue_draw()
+        return True
+
+
+class CellRendererSlideThumb(gtk.GenericCellRenderer):
+    "Shows the thumbnail of a slide."
+    __gproperties__ = {
+                "slide": (gobject.TYPE_PYOBJECT, "Slide",
+                "Slide", gobject.PARAM_READWRITE),
+        }
+    def __init__(self, thumbnails):
+        self.__gobject_init__()
+        self.thumbnails = thumbnails
+        self.slide = None
+        self.xpad = 2
+        self.ypad = 2
+    
+    def on_render(self, window, widget, background_area, cell_area, expose_area,
+                  flags):
+        "Draw the thumbnail, or a dark box until it is rendered."
+        size = self.thumbnails.get_size()
+        if self.slide is None or size is None:
+            return
+        ccontext = window.cairo_create()
+        ccontext.translate(cell_area.x + self.xpad,
+                           cell_area.y + (cell_area.height - size[1]) / 2)
+        surface = self.thumbnails.get(self.slide)
+        if surface is None:
+            ccontext.rectangle(0, 0, *size)
+            ccontext.set_source_rgb(0.2, 0.2, 0.2)
+            ccontext.fill()
+        else:
+            ccontext.set_source_surface(surface, 0, 0)
+            ccontext.paint()
+    
+    def on_get_size(self, widget, cell_area):
+        "Return the size of the thumbnail."
+        size = self.thumbnails.get_size() or (THUMB_WIDTH, THUMB_WIDTH * 3 / 4)
+        return 0, 0, size[0] + self.xpad * 2, size[1] + self.ypad * 2
+    
+    # GObject Functions
+    def do_set_property(self, pspec, value):
+        setattr(self, pspec.name, value)
+    
+    def do_get_property(self, pspec):
+        return getattr(self, pspec.name)
+gobject.type_register(CellRendererSlideThumb)
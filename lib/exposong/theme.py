@@ -40,14 +40,20 @@ import cairo
 import gobject
 import gtk
 import gtk.gdk
+import hashlib
 import math
 import operator
 import os.path
 import pango
-from gtk.gdk import pixbuf_new_from_file as pb_new
+import threading
+import weakref
 from xml.etree import cElementTree as etree
 
+import exposong.animation
+import exposong.imagepool
 import exposong.main
+import exposong.overlay
+import exposong.renderstats
 from exposong import DATA_PATH
 
 LEFT = pango.ALIGN_LEFT
@@ -64,28 +70,88 @@ POS_MAP = {'x1': 0, 'y1': 1, 'x2': 2, 'y2': 3,
             0: 'x1', 1: 'y1', 2: 'x2', 3: 'y2',
             }
 
+# The number of screen sizes a theme keeps compiled render plans for.
+MAX_PLANS = 8
+
 
 class Theme(object):
     """
     A theme item.
     """
-    def __init__(self, filename=None, builtin=False):
-        "Create a theme."
+    def __init__(self, filename=None, builtin=False, lazy=False):
+        """
+        Create a theme.
+        
+        If `lazy` is True, the file is not parsed until the backgrounds or
+        sections are used. See exposong.themeindex.
+        """
         self._builtin = builtin
+        self._plans = {}
+        self._digest = None
+        self._path = None
+        self._load_lock = threading.Lock()
         self.meta = {}
         self.backgrounds = []
         self._init_sections()
         
         if filename:
             self.filename = os.path.split(filename)[1]
-            try:
-                tree = etree.parse(filename)
-                self.load(tree)
-            except Exception as e:
-                exposong.log.error("Could not load theme %s.\n%s",filename,e)
+            if lazy:
+                self._path = filename
+            else:
+                self._load_file(filename)
         else:
             self.filename = filename
     
+    def _load_file(self, filename):
+        "Parse the theme file."
+        try:
+            tree = etree.parse(filename)
+            self.load(tree)
+        except Exception as e:
+            exposong.log.error("Could not load theme %s.\n%s",filename,e)
+    
+    def _ensure_loaded(self):
+        "Parse the file of a lazy theme, the first time it is needed."
+        if self._path is None:
+            return
+        with self._load_lock:
+            if self._path is not None:
+                exposong.log.debug('Parsing theme "%s".', self.filename)
+                self._load_file(self._path)
+                self._path = None
+    
+    def is_loaded(self):
+        "Return False if this is a lazy theme that was not parsed yet."
+        return self._path is None
+    
+    def _get_backgrounds(self):
+        self._ensure_loaded()
+        return self._backgrounds
+    
+    def _set_backgrounds(self, backgrounds):
+        self._backgrounds = backgrounds
+    
+    backgrounds = property(_get_backgrounds, _set_backgrounds)
+    
+    def _get_body(self):
+        self._ensure_loaded()
+        return self._body
+    
+    def _set_body(self, body):
+        self._body = body
+    
+    body = property(_get_body, _set_body)
+    
+    def _get_footer(self):
+        self._ensure_loaded()
+        return self._footer
+    
+    def _set_footer(self, footer):
+        self._footer = footer
+    
+    footer = property(_get_footer, _set_footer)
+    
     def _init_sections(self):
         "Create the Section variables for body and footer"
         self.body = Section(type_='body', font="Sans 48",
@@ -126,14 +192,34 @@ class Theme(object):
         Revert all changes and reload the theme from the file
         when the theme was saved before
         """
+        self._clear()
+        if self.filename:
+            self.load(etree.parse(os.path.join(DATA_PATH, 'theme', self.filename)))
+    
+    def _clear(self):
+        "Remove the backgrounds, sections and metadata."
         self._init_sections()
         self.meta = {}
         self.backgrounds = []
-        if self.filename:
-            self.load(etree.parse(os.path.join(DATA_PATH, 'theme', self.filename)))
+        self._path = None
+        self.invalidate()
+    
+    def copy(self):
+        "Return a copy of the theme, which can be changed separately."
+        theme = Theme(builtin=self._builtin)
+        theme.filename = self.filename
+        theme.load(self.to_xml())
+        return theme
+    
+    def update(self, theme):
+        "Replace the contents of this theme with the contents of `theme`."
+        self._clear()
+        self.filename = theme.filename
+        self.load(theme.to_xml())
     
     def load(self, tree):
         "Load the theme from an XML file."
+        self.invalidate()
         if isinstance(tree, etree.ElementTree):
             root = tree.getroot()
         else:
@@ -146,13 +232,13 @@ class Theme(object):
         for bg in backgrounds.getchildren():
             bgobj = _Background.create_element(bg)
             if bgobj:
-                self.backgrounds.append(bgobj)
+                self._backgrounds.append(bgobj)
         body = root.find(u'sections/body')
         if body:
-            self.body = Section.from_xml(body)
+            self._body = Section.from_xml(body)
         foot = root.find(u'sections/footer')
         if foot:
-            self.footer = Section.from_xml(foot)
+            self._footer = Section.from_xml(foot)
     
     def save(self):
         "Save theme to disk."
@@ -184,41 +270,55 @@ class Theme(object):
         root.append(sections)
         return root
     
+    def invalidate(self):
+        "Discard the compiled render plans. Call this after changing the theme."
+        self._plans = {}
+        self._digest = None
+    
+    def get_digest(self):
+        """
+        Return a hash of the theme and its background files, which changes
+        when the theme or a background file is changed.
+        """
+        if self._digest is None:
+            digest = hashlib.sha1(etree.tostring(self.to_xml()))
+            for stamp in self.get_resource_stamps():
+                digest.update("%s:%s:%s" % tuple(stamp))
+            self._digest = digest.hexdigest()
+        return self._digest
+    
+    def get_resource_stamps(self):
+        "Return (filename, mtime, size) of each background file that exists."
+        stamps = []
+        for bg in self.backgrounds:
+            if hasattr(bg, 'get_filename') and bg.src:
+                try:
+                    st = os.stat(bg.get_filename())
+                except OSError:
+                    continue
+                stamps.append((bg.get_filename(), st.st_mtime, st.st_size))
+        return stamps
+    
+    def get_plan(self, bounds):
+        "Return the compiled render plan for a screen size."
+        key = tuple(bounds)
+        plan = self._plans.get(key)
+        exposong.renderstats.stats.count('render plans', plan is not None)
+        if plan is None:
+            if len(self._plans) >= MAX_PLANS:
+                self._plans = {}
+            plan = RenderPlan(self, key)
+            self._plans[key] = plan
+        return plan
+    
     def render(self, ccontext, bounds, slide):
         "Render the theme to the screen."
-        self.render_color(ccontext, bounds, '#000')
-        for bg in self.backgrounds:
-            bg.draw(ccontext, bounds)
-        if slide:
-            cont = slide.get_slide()
-            if cont != NotImplemented:
-                for t in cont:
-                    try:
-                        t.draw(ccontext, bounds, self.slide)
-                    except AttributeError:
-                        self.slide = self.body
-                        self.slide.pos = [0.0, 0.0, 1.0, 1.0]
-                        t.draw(ccontext, bounds, self.slide)
-            else:
-                expand = {}
-                foots = slide.get_footer()
-                for t in foots:
-                    t.draw(ccontext, bounds, self.footer)
-                if not foots:
-                    for k in self.body.expand:
-                        k2 = k.split(".")
-                        if k2[0] == 'footer':
-                            # Expand over the footer if it doesn't exist.
-                            expand[k2[1]] = self.footer.pos[POS_MAP[k2[1]]]
-                for t in slide.get_body():
-                    t.draw(ccontext, bounds, self.body, expand)
+        self.get_plan(bounds).render(ccontext, slide)
     
     @classmethod
     def render_color(cls, ccontext, bounds, color):
         "Render a solid color on the screen."
-        clr = gtk.gdk.color_parse(color)
-        solid = cairo.SolidPattern(clr.red / 65535.0, clr.green / 65535.0,
-                                   clr.blue / 65535.0)
+        solid = cairo.SolidPattern(*_parse_color(color))
         if len(bounds) == 2:
             ccontext.rectangle(0, 0, *bounds)
         elif len(bounds) == 4:
@@ -229,6 +329,379 @@ class Theme(object):
         ccontext.fill()
 
 
+class FontScales(object):
+    """
+    The font scales of text groups, such as the verses of a song.
+    
+    A group is fitted once by `RenderPlan.fit_slides()`, and the scale is used
+    every time one of its texts is drawn. The scales are kept here instead of
+    in the render plans, so they are not lost when the plans are compiled
+    again. They are kept by the theme digest, the screen size and the name of
+    the section. The groups are weak keys, so a group that is not used
+    anymore is released.
+    """
+    def __init__(self):
+        # group: (slides as weak references, {scale key: scale})
+        self._groups = weakref.WeakKeyDictionary()
+    
+    def set_slides(self, group, slides):
+        """
+        Set the slides the texts of `group` are fitted on. The scales are
+        dropped if the slides changed.
+        """
+        old = self.get_slides(group)
+        if old is not None and len(old) == len(slides):
+            for a, b in zip(old, slides):
+                if a is not b:
+                    break
+            else:
+                return
+        self._groups[group] = ([weakref.ref(s) for s in slides], {})
+    
+    def get_slides(self, group):
+        "Return the slides `group` was fitted on, or None."
+        entry = self._groups.get(group)
+        if entry is None:
+            return None
+        slides = [ref() for ref in entry[0]]
+        return [s for s in slides if s is not None]
+    
+    def get_scale(self, group, key):
+        "Return the font scale of `group` in a section, or None."
+        entry = self._groups.get(group)
+        if entry is None:
+            return None
+        return entry[1].get(key)
+    
+    def has_scales(self, group, keys):
+        "Return True if `group` was fitted for all the sections of `keys`."
+        entry = self._groups.get(group)
+        if entry is None:
+            return False
+        for key in keys:
+            if key not in entry[1]:
+                return False
+        return True
+    
+    def set_scales(self, group, scales):
+        "Keep the {scale key: scale} of `group`."
+        entry = self._groups.get(group)
+        if entry is None:
+            return
+        if len(entry[1]) > MAX_PLANS * 4:
+            entry[1].clear()
+        entry[1].update(scales)
+    
+    def clear(self):
+        "Forget all groups, after the way they are fitted was changed."
+        self._groups.clear()
+
+font_scales = FontScales()
+
+
+class RenderPlan(object):
+    """
+    The drawing instructions of a theme, compiled for one screen size.
+    
+    Colors and gradients are parsed into cairo patterns, fonts into pango font
+    descriptions, and positions into absolute rectangles when the plan is
+    created, so drawing a slide only executes the plan. Plans are created by
+    `Theme.get_plan()`, and should not be modified.
+    """
+    def __init__(self, theme, bounds):
+        "Compile `theme` for `bounds`."
+        self.bounds = tuple(bounds)
+        # The sections are found in `font_scales` by this key and their name.
+        key = (theme.get_digest(), self.bounds)
+        self.backgrounds = [_FillOp(_get_rect([0.0, 0.0, 1.0, 1.0], bounds),
+                                    cairo.SolidPattern(*_parse_color('#000')))]
+        for bg in theme.backgrounds:
+            self.backgrounds.append(bg.compile(bounds))
+        self.backgrounds = tuple(self.backgrounds)
+        self.animations = tuple(op for op in self.backgrounds
+                                if isinstance(op, _AnimationOp))
+        
+        self.footer = CompiledSection(theme.footer, bounds,
+                                      scale_key=key + ('footer',))
+        self.body = CompiledSection(theme.body, bounds,
+                                    scale_key=key + ('body',))
+        expand = {}
+        for k in theme.body.expand:
+            k2 = k.split(".")
+            if k2[0] == 'footer':
+                # Expand over the footer if it doesn't exist.
+                expand[k2[1]] = theme.footer.pos[POS_MAP[k2[1]]]
+        self.body_expanded = CompiledSection(
+                theme.body, bounds, expand,
+                scale_key=key + ('body_expanded',))
+        # Used for slides that place their own content on the whole screen.
+        self.full = CompiledSection(theme.body, bounds,
+                                    pos=[0.0, 0.0, 1.0, 1.0],
+                                    scale_key=key + ('full',))
+    
+    def render(self, ccontext, slide):
+        "Render the backgrounds and the slide."
+        self.render_background(ccontext)
+        self.render_slide(ccontext, slide)
+    
+    def render_background(self, ccontext):
+        "Render the backgrounds."
+        self._draw_ops(ccontext, self.backgrounds)
+    
+    def render_static(self, ccontext):
+        "Render the backgrounds below the first animated background."
+        self._draw_ops(ccontext, self.backgrounds[:self._get_first_animated()])
+    
+    def render_animated(self, ccontext):
+        "Render the animated backgrounds, and those above them."
+        self._draw_ops(ccontext, self.backgrounds[self._get_first_animated():])
+    
+    def _get_first_animated(self):
+        "Return the index of the first animated background."
+        if not self.animations:
+            return len(self.backgrounds)
+        return self.backgrounds.index(self.animations[0])
+    
+    def _draw_ops(self, ccontext, ops):
+        "Draw background operations."
+        begin = exposong.renderstats.timer()
+        for op in ops:
+            op.draw(ccontext)
+        exposong.renderstats.stats.add(exposong.renderstats.BACKGROUNDS,
+                                       exposong.renderstats.timer() - begin)
+    
+    def render_slide(self, ccontext, slide):
+        "Render the text and images of the slide."
+        items = self._get_items(slide)
+        for t, section in items:
+            if isinstance(t, Text) and t.group is not None:
+                self._refit(t.group, items)
+        for t, section in items:
+            t.draw(ccontext, self.bounds, section)
+    
+    def _refit(self, group, items):
+        """
+        Fit `group` with this plan, if it was fitted with another plan, such
+        as one for another size or an older version of the theme.
+        """
+        keys = [section.scale_key for t, section in items
+                if isinstance(t, Text) and t.group is group]
+        if font_scales.has_scales(group, keys):
+            return
+        slides = font_scales.get_slides(group)
+        if slides:
+            self.fit_slides(group, slides)
+    
+    def measure_slides(self, group, slides):
+        "Return the font scale each slide would need for the texts of `group`."
+        return self._measure(group, slides)[0]
+    
+    def fit_slides(self, group, slides):
+        """
+        Find one font scale for the texts of `group` that fits on all `slides`.
+        
+        The scale is kept in `font_scales`, and used when a `Text` of the
+        group is drawn, instead of fitting each text on its own. Plans of
+        other sizes fit the same slides when they draw the group. Returns the
+        scale each slide would need on its own.
+        """
+        fits, scales = self._measure(group, slides)
+        font_scales.set_slides(group, slides)
+        # A section without texts of the group gets a scale as well, so
+        # `_refit()` knows the group was fitted.
+        for section in (self.footer, self.body, self.body_expanded, self.full):
+            scales.setdefault(section.scale_key, None)
+        font_scales.set_scales(group, scales)
+        return fits
+    
+    def _measure(self, group, slides):
+        "Return the fit of each slide, and {scale key: scale} of the sections."
+        fits = []
+        scales = {}
+        for slide in slides:
+            fit = 1.0
+            for t, section in self._get_items(slide):
+                if isinstance(t, Text) and t.group is group:
+                    scale = t.get_fit_scale(self.bounds, section)
+                    scales[section.scale_key] = min(
+                            scales.get(section.scale_key, 1.0), scale)
+                    fit = min(fit, scale)
+            fits.append(fit)
+        return fits, scales
+    
+    def prefetch(self, slide):
+        "Start loading the images of the backgrounds and the slide."
+        for op in self.backgrounds:
+            if isinstance(op, (_ImageOp, _AnimationOp)):
+                op.prefetch()
+        for t, section in self._get_items(slide):
+            if isinstance(t, Image):
+                t.prefetch(self.bounds, section)
+    
+    def _get_items(self, slide):
+        "Return the items of the slide with the section to draw them in."
+        if not slide:
+            return []
+        cont = slide.get_slide()
+        if cont != NotImplemented:
+            return [(t, self.full) for t in cont]
+        foots = slide.get_footer()
+        items = [(t, self.footer) for t in foots]
+        if foots:
+            body = self.body
+        else:
+            body = self.body_expanded
+        items.extend((t, body) for t in slide.get_body())
+        return items
+
+
+class CompiledSection(object):
+    """
+    A theme section compiled for one screen size.
+    
+    It has the same attributes as the `Section` it was compiled from, with any
+    `expand` values applied to `pos`. Colors are (red, green, blue) tuples for
+    cairo, `font_descr` is the parsed font, and `rect` is the absolute position
+    [x1, y1, x2, y2]. `scale_key` finds the font scales of text groups in
+    `font_scales`, or is None for a section that is not part of a plan.
+    """
+    def __init__(self, section, bounds, expand=None, pos=None, scale_key=None):
+        "Compile `section` for `bounds`."
+        self.type_ = section.type_
+        if pos is None:
+            pos = section.pos[:]
+            if expand:
+                for k, v in expand.iteritems():
+                    pos[POS_MAP[k]] = v
+        self.pos = tuple(pos)
+        self.rect = tuple(_get_rect(pos, bounds))
+        self.scale_key = scale_key
+        
+        if section.font:
+            self.font_descr = pango.FontDescription(section.font)
+        else:
+            self.font_descr = pango.FontDescription("Sans 48")
+        self.color = _parse_color(section.color)
+        self.spacing = section.spacing
+        self.align = section.align
+        self.valign = section.valign
+        
+        if section.outline_color:
+            self.outline_color = _parse_color(section.outline_color)
+        else:
+            self.outline_color = None
+        self.outline_size = section.outline_size
+        
+        if section.shadow_color:
+            self.shadow_color = _parse_color(section.shadow_color)
+        else:
+            self.shadow_color = None
+        self.shadow_opacity = section.shadow_opacity
+        self.shadow_offset = tuple(section.shadow_offset)
+
+
+class _FillOp(object):
+    """
+    Fills a rectangle with a cairo pattern.
+    """
+    def __init__(self, rpos, pattern):
+        self.rect = rpos[:2] + map(_subtract, rpos[2:4], rpos[:2])
+        self.pattern = pattern
+    
+    def draw(self, ccontext):
+        "Render to a Cairo Context."
+        ccontext.rectangle(*self.rect)
+        ccontext.set_source(self.pattern)
+        ccontext.fill()
+
+
+class _ImageOp(object):
+    """
+    Paints an image background, loaded from the image pool when drawn.
+    """
+    def __init__(self, background, rpos):
+        self.background = background
+        self.rpos = tuple(rpos)
+    
+    def prefetch(self):
+        "Start loading the image in the background."
+        self.background.prefetch(map(_subtract, self.rpos[2:4], self.rpos[:2]))
+    
+    def draw(self, ccontext):
+        "Render to a Cairo Context."
+        size = map(_subtract, self.rpos[2:4], self.rpos[:2])
+        img = self.background.load(size)
+        if img:
+            ccontext.set_source_pixbuf(img,
+                                       (self.rpos[0] + self.rpos[2] - size[0])/2,
+                                       (self.rpos[1] + self.rpos[3] - size[1])/2)
+            ccontext.paint()
+
+
+class _AnimationOp(object):
+    """
+    Paints the current frame of an animated background.
+    
+    Until `start()` is called, the first frame is painted as a still image.
+    """
+    def __init__(self, background, rpos):
+        self.background = background
+        self.rpos = tuple(rpos)
+        self.ring = None
+    
+    def _get_size(self):
+        "Return the size of the box of the animation."
+        return map(_subtract, self.rpos[2:4], self.rpos[:2])
+    
+    def start(self):
+        "Start decoding the frames."
+        if self.ring is None:
+            self.ring = exposong.animation.FrameRing(
+                    self.background.get_filename(), self._get_size(),
+                    self.background.aspect, self.background.fps)
+    
+    def stop(self):
+        "Stop playing, and release the frames."
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+    
+    def get_frame_rate(self):
+        "Return the frames per second the animation is played at."
+        return exposong.animation.get_frame_rate(self.background.fps)
+    
+    def advance(self, now):
+        "Move to the frame for the time `now`. Returns True if it changed."
+        if self.ring is None:
+            return False
+        return self.ring.advance(now)
+    
+    def prefetch(self):
+        "Start loading the first frame in the background."
+        first = exposong.animation.get_first_frame(
+                self.background.get_filename())
+        if first:
+            exposong.imagepool.pool.request(first, self._get_size(),
+                                            self.background.aspect)
+    
+    def draw(self, ccontext):
+        "Render to a Cairo Context."
+        img = None
+        if self.ring is not None:
+            img = self.ring.get_current()
+        if img is None:
+            first = exposong.animation.get_first_frame(
+                    self.background.get_filename())
+            if first:
+                img = exposong.imagepool.pool.get_scaled(
+                        first, self._get_size(), self.background.aspect)
+        if img:
+            ccontext.set_source_pixbuf(img,
+                    (self.rpos[0] + self.rpos[2] - img.get_width())/2,
+                    (self.rpos[1] + self.rpos[3] - img.get_height())/2)
+            ccontext.paint()
+
+
 class _Renderable(object):
     """
     An abstract class for a drawing element.
@@ -263,16 +736,7 @@ class _Renderable(object):
     
     def draw(self, ccontext, bounds):
         "Render the background to the context."
-        if len(bounds) == 2:
-            self.rpos = map(_product, bounds*2, self.get_pos())
-        elif len(bounds) == 4:
-            self.rpos = map(_product, bounds[-2:]*2, self.get_pos())
-            self.rpos[0] += bounds[0]
-            self.rpos[1] += bounds[1]
-            self.rpos[2] += bounds[0]
-            self.rpos[3] += bounds[1]
-        else:
-            raise Exception("`bounds` must have 2 or 4 elements")
+        self.rpos = _get_rect(self.get_pos(), bounds)
 
 
 class _Element(object):
@@ -349,17 +813,14 @@ class ColorBackground(_Background, _Renderable):
         el.attrib['opacity'] = str(self.alpha)
         return el
     
+    def compile(self, bounds):
+        "Return the drawing operation for `bounds`."
+        solid = cairo.SolidPattern(*_parse_color(self.color) + (self.alpha,))
+        return _FillOp(_get_rect(self.pos, bounds), solid)
+    
     def draw(self, ccontext, bounds):
         "Render the background to the context."
-        _Renderable.draw(self, ccontext, bounds)
-        
-        color = gtk.gdk.color_parse(self.color)
-        solid = cairo.SolidPattern(color.red / 65535.0, color.green / 65535.0,
-                                   color.blue / 65535.0, self.alpha)
-        ccontext.rectangle(*self.rpos[:2] +
-                           map(_subtract, self.rpos[2:4], self.rpos[:2]))
-        ccontext.set_source(solid)
-        ccontext.fill()
+        self.compile(bounds).draw(ccontext)
     
     @staticmethod
     def get_tag():
@@ -411,28 +872,27 @@ class RadialGradientBackground(_Background, _Renderable):
             el.append(s.to_xml())
         return el
     
-    def draw(self, ccontext, bounds):
-        "Render the background to the context."
-        _Renderable.draw(self, ccontext, bounds)
-        
+    def compile(self, bounds):
+        "Return the drawing operation for `bounds`."
+        rpos = _get_rect(self.pos, bounds)
         rcpos = [0, 0]
-        h = self.rpos[3] - self.rpos[1]
-        w = self.rpos[2] - self.rpos[0]
-        rcpos[0] = self.rpos[0] + w * self.cpos[0]
-        rcpos[1] = self.rpos[1] + h * self.cpos[1]
-        length = math.sqrt(math.pow(self.rpos[2] - self.rpos[0], 2) +
-                           math.pow(self.rpos[3] - self.rpos[1], 2)) * self.length
+        h = rpos[3] - rpos[1]
+        w = rpos[2] - rpos[0]
+        rcpos[0] = rpos[0] + w * self.cpos[0]
+        rcpos[1] = rpos[1] + h * self.cpos[1]
+        length = math.sqrt(math.pow(rpos[2] - rpos[0], 2) +
+                           math.pow(rpos[3] - rpos[1], 2)) * self.length
         gradient = cairo.RadialGradient(rcpos[0], rcpos[1], 0.0,
                                         rcpos[0], rcpos[1], length)
         for stop in self.stops:
-            clr = gtk.gdk.color_parse(stop.color)
-            gradient.add_color_stop_rgba(stop.location, clr.red / 65535.0,
-                                        clr.green / 65535.0, clr.blue / 65535.0,
-                                        stop.alpha)
-        ccontext.rectangle(*self.rpos[:2] +
-                           map(_subtract, self.rpos[2:4], self.rpos[:2]))
-        ccontext.set_source(gradient)
-        ccontext.fill()
+            gradient.add_color_stop_rgba(stop.location,
+                                         *_parse_color(stop.color) +
+                                         (stop.alpha,))
+        return _FillOp(rpos, gradient)
+    
+    def draw(self, ccontext, bounds):
+        "Render the background to the context."
+        self.compile(bounds).draw(ccontext)
     
     @staticmethod
     def get_tag():
@@ -473,15 +933,15 @@ class GradientBackground(_Background, _Renderable):
             el.append(s.to_xml())
         return el
     
-    def draw(self, ccontext, bounds):
-        "Render the background to the context."
-        _Renderable.draw(self, ccontext, bounds)
+    def compile(self, bounds):
+        "Return the drawing operation for `bounds`."
+        rpos = _get_rect(self.pos, bounds)
         
         # Compute the offset of the angle
-        cent = [self.rpos[0] / 2 + self.rpos[2] / 2,
-                self.rpos[3] / 2 + self.rpos[1] / 2]
-        diff = [abs(self.rpos[0] - self.rpos[2])/2,
-                abs(self.rpos[1] - self.rpos[3])/2]
+        cent = [rpos[0] / 2 + rpos[2] / 2,
+                rpos[3] / 2 + rpos[1] / 2]
+        diff = [abs(rpos[0] - rpos[2])/2,
+                abs(rpos[1] - rpos[3])/2]
         offset = [0, 0]
         angle = self.angle * 2 * math.pi / 360
         if (self.angle + 90) % 360 < 180:
@@ -499,14 +959,14 @@ class GradientBackground(_Background, _Renderable):
         gradient = cairo.LinearGradient(*map(_subtract, cent, offset) +
                                         map(_add, cent, offset))
         for stop in self.stops:
-            clr = gtk.gdk.color_parse(stop.color)
-            gradient.add_color_stop_rgba(stop.location, clr.red / 65535.0,
-                                        clr.green / 65535.0, clr.blue / 65535.0,
-                                        stop.alpha)
-        ccontext.rectangle(*self.rpos[:2] +
-                           map(_subtract, self.rpos[2:4], self.rpos[:2]))
-        ccontext.set_source(gradient)
-        ccontext.fill()
+            gradient.add_color_stop_rgba(stop.location,
+                                         *_parse_color(stop.color) +
+                                         (stop.alpha,))
+        return _FillOp(rpos, gradient)
+    
+    def draw(self, ccontext, bounds):
+        "Render the background to the context."
+        self.compile(bounds).draw(ccontext)
     
     @staticmethod
     def get_tag():
@@ -557,8 +1017,6 @@ class ImageBackground(_Background, _Renderable):
         _Background.__init__(self, name)
         self.src = src
         self.aspect = aspect
-        self._original = None
-        self._cache = {}
     
     def parse_xml(self, el):
         "Defines variables based on XML values."
@@ -580,38 +1038,33 @@ class ImageBackground(_Background, _Renderable):
         return os.path.join(DATA_PATH, 'theme', 'res', self.src)
     
     def reset_cache(self):
-        self._original = None
-        self._cache = {}
+        "Release the decoded image, so it is read from disk again."
+        exposong.imagepool.pool.forget(self.get_filename())
     
     def load(self, size):
-        ""
-        if not self._original:
-            try:
-                self._original = pb_new(self.get_filename())
-            except gobject.GError:
-                exposong.log.error('Could not find "%s".', self.src)
-                return False
+        """
+        Loads the image from the shared pool at the requested size.
         
-        size[:] = get_size(self._original, size, self.aspect)
-        skey = 'x'.join(map(str, size))
-        if skey not in self._cache:
-            self._cache[skey] = scale_image(self._original, size, self.aspect)
-        return self._cache[skey]
+        `size` is changed to the size of the scaled image.
+        """
+        img = exposong.imagepool.pool.get_scaled(self.get_filename(), size,
+                                                 self.aspect)
+        if not img:
+            return False
+        size[:] = [img.get_width(), img.get_height()]
+        return img
+    
+    def prefetch(self, size):
+        "Start loading the image at `size` in the background."
+        exposong.imagepool.pool.request(self.get_filename(), size, self.aspect)
+    
+    def compile(self, bounds):
+        "Return the drawing operation for `bounds`."
+        return _ImageOp(self, _get_rect(self.pos, bounds))
     
     def draw(self, ccontext, bounds):
         "Render the background to the context."
-        _Renderable.draw(self, ccontext, bounds)
-        
-        #ccontext.rectangle(*self.rpos[:2] +
-        #                   map(_subtract, self.rpos[2:4], self.rpos[:2]))
-        size = map(_subtract, self.rpos[2:4], self.rpos[:2])
-        
-        img = self.load(size)
-        pos = [(self.rpos[0] + self.rpos[2] - size[0])/2,
-               (self.rpos[1] + self.rpos[3] - size[1])/2]
-        if img:
-            ccontext.set_source_pixbuf(img, *pos)
-            ccontext.paint()
+        self.compile(bounds).draw(ccontext)
     
     @staticmethod
     def get_tag():
@@ -619,6 +1072,64 @@ class ImageBackground(_Background, _Renderable):
         return "image"
 
 
+class AnimatedBackground(_Background, _Renderable):
+    """
+    A looping animated background.
+    
+    src:    An animated image such as a GIF, or a folder of images that are
+            shown in alphabetical order, relative to "DATA_PATH/theme/res/".
+    fps:    The frames per second of a folder of images. Animated images use
+            their own timing, but are not played faster than this.
+    aspect: See `ImageBackground`.
+    """
+    def __init__(self, src=None, fps=15.0, pos=None, aspect=ASPECT_FILL,
+                 name=_("Animation")):
+        ""
+        _Renderable.__init__(self, pos)
+        _Background.__init__(self, name)
+        self.src = src
+        self.fps = fps
+        self.aspect = aspect
+    
+    def parse_xml(self, el):
+        "Defines variables based on XML values."
+        _Renderable.parse_xml(self, el)
+        _Background.parse_xml(self, el)
+        self.src = el.get('src')
+        try:
+            fps = float(el.get('fps', 15.0))
+        except ValueError:
+            fps = 15.0
+        self.fps = exposong.animation.get_frame_rate(fps)
+        self.aspect = get_aspect_const(el.get('aspect'), ASPECT_FILL)
+    
+    def to_xml(self):
+        "Output to an XML Element."
+        el = etree.Element(self.get_tag())
+        _Renderable.to_xml(self, el)
+        _Background.to_xml(self, el)
+        el.attrib['src'] = self.src
+        el.attrib['fps'] = str(self.fps)
+        el.attrib['aspect'] = get_aspect_key(self.aspect)
+        return el
+    
+    def get_filename(self):
+        return os.path.join(DATA_PATH, 'theme', 'res', self.src)
+    
+    def compile(self, bounds):
+        "Return the drawing operation for `bounds`."
+        return _AnimationOp(self, _get_rect(self.pos, bounds))
+    
+    def draw(self, ccontext, bounds):
+        "Render the first frame to the context."
+        self.compile(bounds).draw(ccontext)
+    
+    @staticmethod
+    def get_tag():
+        "Return the XML tag name."
+        return "animation"
+
+
 class Section(_Element):
     """
     A part of the screen with text.
@@ -732,31 +1243,33 @@ class _RenderableSection(_Renderable):
         self.valign = valign
         self.margin = margin
     
-    def get_pos(self):
-        'Returns the position.'
-        if self._section is None:
-            return self.pos
-        pos = self._section.pos[:]
-        for k,v in self._expand.iteritems():
-            pos[POS_MAP[k]] = v
-        h = pos[3] - pos[1]
-        w = pos[2] - pos[0]
-        pos[0] += w * self.pos[0]
-        pos[1] += h * self.pos[1]
-        pos[2] -= w * (1.0 - self.pos[2])
-        pos[3] -= h * (1.0 - self.pos[3])
-        return pos
-    
     def draw(self, ccontext, bounds, section, expand={}):
-        "Render to a Cairo Context."
-        self._section = section
-        self._expand = expand
-        _Renderable.draw(self, ccontext, bounds)
-        self._section = self._expand = None
+        """
+        Render to a Cairo Context.
+        
+        `section` is normally a `CompiledSection` from a render plan. A
+        `Section` is compiled here. Returns the compiled section.
+        """
+        if isinstance(section, Section):
+            section = CompiledSection(section, bounds, expand)
+        self._set_rpos(bounds, section, ccontext.clip_extents())
+        return section
+    
+    def _set_rpos(self, bounds, section, extents):
+        "Set the real position in `section`, less the margin of `extents`."
+        if section is None:
+            self.rpos = _get_rect(self.pos, bounds)
+        else:
+            x1, y1, x2, y2 = section.rect
+            w = x2 - x1
+            h = y2 - y1
+            self.rpos = [x1 + w * self.pos[0], y1 + h * self.pos[1],
+                         x2 - w * (1.0 - self.pos[2]),
+                         y2 - h * (1.0 - self.pos[3])]
         
         if self.margin > 1.0:
             self.margin = 0.02
-        sx1, sy1, sx2, sy2 = ccontext.clip_extents()
+        sx1, sy1, sx2, sy2 = extents
         mx = (sx2 - sx1) * self.margin * 0.5
         my = (sy2 - sy1) * self.margin * 0.5
         self.rpos[0] += mx
@@ -776,22 +1289,42 @@ class Text(_RenderableSection):
     (http://www.pygtk.org/docs/pygtk/pango-markup-language.html).
     """
     def __init__(self, markup, align=None, valign=None, margin=0,
-                 pos=None):
+                 pos=None, group=None):
         _RenderableSection.__init__(self, align, valign, margin, pos)
         self.markup = markup
+        # Texts of a group, such as the verses of a song, can share one font
+        # size. See `RenderPlan.fit_slides()`.
+        self.group = group
     
-    def draw(self, ccontext, bounds, section, expand={}):
-        "Render to a Cairo Context."
-        _RenderableSection.draw(self, ccontext, bounds, section, expand)
+    def get_fit_scale(self, bounds, section):
+        """
+        Return the scale of the font size that makes the text fit into
+        `section` on a screen with the size `bounds`.
+        """
+        self._set_rpos(bounds, section, _get_rect([0.0, 0.0, 1.0, 1.0], bounds))
+        layout = exposong.overlay.create_layout()
+        base = self._get_base_size(section)
+        font_descr = self._fit_layout(layout, section)
+        return float(font_descr.get_size()) / max(base, 1)
+    
+    def _get_base_size(self, section):
+        "Return the font size of the section, adjusted to the screen height."
         screen_height = (self.rpos[3] + self.margin) / self.pos[3]
+        return int(section.font_descr.get_size() * screen_height / 768)
+    
+    def _fit_layout(self, layout, section, scale=None):
+        """
+        Set the text of `layout`, and shrink the font until it fits.
         
-        layout = ccontext.create_layout()
+        The font starts out at the section font size, times `scale` if it is
+        given. A `scale` from `RenderPlan.fit_slides()` fits already, so the
+        font is not shrunk then. Returns the font description that was used.
+        """
         layout.set_width(int(self.rpos[2] - self.rpos[0])*pango.SCALE)
-        if section.font:
-            font_descr = pango.FontDescription(section.font)
-        else:
-            font_descr = pango.FontDescription("Sans 48")
-        font_descr.set_size(int(font_descr.get_size() * screen_height / 768))
+        font_descr = section.font_descr.copy()
+        font_descr.set_size(self._get_base_size(section))
+        if scale is not None:
+            font_descr.set_size(int(font_descr.get_size() * scale))
         layout.set_font_description(font_descr)
         layout.set_spacing(int((section.spacing - 1.0) * font_descr.get_size()))
         
@@ -803,11 +1336,26 @@ class Text(_RenderableSection):
             layout.set_alignment(CENTER)
         
         layout.set_markup(self.markup)
+        if scale is not None:
+            return font_descr
         
         while layout.get_pixel_size()[1] > self.rpos[3] - self.rpos[1]:
             font_descr.set_size(int(font_descr.get_size()*0.95))
             layout.set_spacing(int((section.spacing - 1.0) * font_descr.get_size()))
             layout.set_font_description(font_descr)
+        return font_descr
+    
+    def draw(self, ccontext, bounds, section, expand={}):
+        "Render to a Cairo Context."
+        stats = exposong.renderstats.stats
+        begin = exposong.renderstats.timer()
+        section = _RenderableSection.draw(self, ccontext, bounds, section,
+                                          expand)
+        layout = ccontext.create_layout()
+        scale = None
+        if self.group is not None and section.scale_key is not None:
+            scale = font_scales.get_scale(self.group, section.scale_key)
+        font_descr = self._fit_layout(layout, section, scale)
         
         if self.valign != None:
             valign = self.valign
@@ -824,11 +1372,11 @@ class Text(_RenderableSection):
             top = self.rpos[1] + (self.rpos[3] - self.rpos[1]) / 2 - \
                   layout.get_pixel_size()[1] / 2
         
+        effects = exposong.renderstats.timer()
+        stats.add(exposong.renderstats.TEXT, effects - begin)
         if section.shadow_color:
-            clr = gtk.gdk.color_parse(section.shadow_color)
-            ccontext.set_source_rgba(clr.red / 65535.0, clr.green / 65535.0,
-                                     clr.blue / 65535.0,
-                                     section.shadow_opacity * 0.05)
+            ccontext.set_source_rgba(*section.shadow_color +
+                                     (section.shadow_opacity * 0.05,))
             sz = font_descr.get_size() / pango.SCALE
             center = [self.rpos[0] + sz * section.shadow_offset[0],
                              top + sz * section.shadow_offset[1]]
@@ -837,20 +1385,20 @@ class Text(_RenderableSection):
                     ccontext.move_to(center[0]+x, center[1]+y)
                     ccontext.show_layout(layout)
         if section.outline_color:
-            clr = gtk.gdk.color_parse(section.outline_color)
-            ccontext.set_source_rgb(clr.red / 65535.0, clr.green / 65535.0,
-                                    clr.blue / 65535.0)
+            ccontext.set_source_rgb(*section.outline_color)
             offset = int(section.outline_size)
             for x in range(-offset, offset + 1, 1):
                 for y in range(-offset, offset + 1, 1):
                     ccontext.move_to(self.rpos[0]+x, top+y)
                     ccontext.show_layout(layout)
+        begin = exposong.renderstats.timer()
+        stats.add(exposong.renderstats.EFFECTS, begin - effects)
         
-        clr = gtk.gdk.color_parse(section.color)
-        ccontext.set_source_rgba(clr.red / 65535.0, clr.green / 65535.0,
-                                 clr.blue / 65535.0, 1.0)
+        ccontext.set_source_rgba(*section.color + (1.0,))
         ccontext.move_to(self.rpos[0], top)
         ccontext.show_layout(layout)
+        stats.add(exposong.renderstats.TEXT,
+                  exposong.renderstats.timer() - begin)
 
 
 class Image(_RenderableSection):
@@ -862,28 +1410,34 @@ class Image(_RenderableSection):
         _RenderableSection.__init__(self, align, valign, margin, pos)
         self.src = src
         self.aspect = aspect
-        self._original = None
-        self._cache = {'x': None}
     
     def load(self, size):
         "Loads an image based on a requested size [width, height]."
         if not self.src or not os.path.isfile(self.src):
             return False
-        if not self._original:
-            try:
-                self._original = pb_new(self.src)
-            except gobject.GError:
-                exposong.log.error('Could not find "%s".', self.src)
-                return False
-        
-        skey = 'x'.join(map(str, get_size(self._original, size, self.aspect)))
-        if skey not in self._cache:
-            self._cache[skey] = scale_image(self._original, size, self.aspect)
-        return self._cache[skey]
+        return exposong.imagepool.pool.get_scaled(self.src, size, self.aspect)
+    
+    def prefetch(self, bounds, section):
+        "Start loading the image in the background."
+        if not self.src or not os.path.isfile(self.src):
+            return
+        self._set_rpos(bounds, section, _get_rect([0.0, 0.0, 1.0, 1.0], bounds))
+        exposong.imagepool.pool.request(self.src,
+                map(_subtract, self.rpos[2:4], self.rpos[:2]), self.aspect)
     
     def draw(self, ccontext, bounds, section, expand={}):
         "Render to a Cairo Context."
-        _RenderableSection.draw(self, ccontext, bounds, section, expand)
+        begin = exposong.renderstats.timer()
+        try:
+            return self._draw(ccontext, bounds, section, expand)
+        finally:
+            exposong.renderstats.stats.add(exposong.renderstats.IMAGES,
+                    exposong.renderstats.timer() - begin)
+    
+    def _draw(self, ccontext, bounds, section, expand):
+        "Draw the image."
+        section = _RenderableSection.draw(self, ccontext, bounds, section,
+                                          expand)
         
         size = map(_subtract, self.rpos[2:4], self.rpos[:2])
         valign = align = None
@@ -1041,7 +1595,7 @@ def get_size(pb, size, aspect=None):
     else:
         return size
 
-def scale_image(pb, size, aspect=None):
+def scale_image(pb, size, aspect=None, interp=gtk.gdk.INTERP_BILINEAR):
     """Scales the pixbuf (pb) to size.
     
     size:   [width, height]
@@ -1049,6 +1603,7 @@ def scale_image(pb, size, aspect=None):
              * None - scales width and height individually
              * ASPECT_FIT - size will be smaller
              * ASPECT_FILL - image will scale up
+    interp: The gtk.gdk interpolation type.
     """
     npb = None
     if aspect == ASPECT_FIT:
@@ -1066,7 +1621,7 @@ def scale_image(pb, size, aspect=None):
                              int(w), int(h))
 
         pb.scale(npb, 0, 0, w, h, 0, 0, scale, scale,
-                 gtk.gdk.INTERP_BILINEAR)
+                 interp)
     elif aspect == ASPECT_FILL:
         npb = gtk.gdk.Pixbuf(pb.get_colorspace(), pb.get_has_alpha(),
                              pb.get_bits_per_sample(),
@@ -1082,12 +1637,31 @@ def scale_image(pb, size, aspect=None):
         h = int(pb.get_height() * scale)
         
         pb.scale(npb, 0, 0, int(size[0]), int(size[1]), int(size[0] - w) / 2,
-                 int(size[1] - h) / 2, scale, scale, gtk.gdk.INTERP_BILINEAR)
+                 int(size[1] - h) / 2, scale, scale, interp)
     else:
         npb = pb.scale_simple(int(size[0]), int(size[1]),
-                              gtk.gdk.INTERP_BILINEAR)
+                              interp)
     return npb
 
+def _get_rect(pos, bounds):
+    "Return the absolute [x1, y1, x2, y2] of a position within `bounds`."
+    if len(bounds) == 2:
+        return map(_product, list(bounds)*2, pos)
+    elif len(bounds) == 4:
+        rpos = map(_product, list(bounds[-2:])*2, pos)
+        rpos[0] += bounds[0]
+        rpos[1] += bounds[1]
+        rpos[2] += bounds[0]
+        rpos[3] += bounds[1]
+        return rpos
+    else:
+        raise Exception("`bounds` must have 2 or 4 elements")
+
+def _parse_color(color):
+    "Return a color as a (red, green, blue) tuple for cairo."
+    clr = gtk.gdk.color_parse(color)
+    return (clr.red / 65535.0, clr.green / 65535.0, clr.blue / 65535.0)
+
 def _product(*args):
     "Multiply all arguments."
     return reduce(operator.mul, args)
@@ -16,13 +16,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import cairo
 import gtk
 import sys
 import os
 import shutil
 import random
 import gobject
+from xml.sax.saxutils import escape
 
+import exposong.screen
 import exposong.theme
 import exposong.exampleslide
 from exposong import gui
@@ -32,6 +35,20 @@ from exposong.glob import title_to_filename, find_freefile, check_filename
 
 BACKGROUND_TYPES = [_("Image"),  _("Color"), _("Gradient"), _("Radial Gradient")]
 
+# The shortest time between two updates of the preview, in milliseconds.
+PREVIEW_INTERVAL = 40
+
+# The output sizes the theme is previewed at, besides the screen size.
+PREVIEW_TARGETS = ((_("4:3 (1024x768)"), (1024, 768)),
+                   (_("16:9 (1920x1080)"), (1920, 1080)))
+# The width of each preview.
+PREVIEW_WIDTH = 200
+
+# The layers of the preview, from the bottom to the top.
+BACKGROUND = 'background'
+TEXT = 'text'
+LAYERS = (BACKGROUND, TEXT)
+
 class ThemeEditor(gtk.Window):
     """
     Provides a simple interface for creating and editing themes
@@ -46,6 +63,9 @@ class ThemeEditor(gtk.Window):
         self.__ready = False
         # Used when updating position spinners
         self.__updating = False
+        self._preview_source = None
+        self._render_source = None
+        self.connect('destroy', self._stop_previews)
         self._do_layout()
         self._load_theme(theme_)
         self.show_all()
@@ -175,10 +195,19 @@ the first element in this list moving to the last one."), 0)
         ############  Preview  ########################
         table_right = gui.ESTable(3, auto_inc_y=True)
         table_right.attach_section_title(_("Preview"))
-        self._preview = gtk.DrawingArea()
-        self._preview.set_size_request(300, int(300*0.75))
-        self._preview.connect('expose-event', self._expose)
-        table_right.attach_widget(self._preview)
+        self._previews = []
+        for title, target in self._get_preview_targets():
+            preview = ThemePreview(title, target, PREVIEW_WIDTH)
+            preview.area.connect('button-press-event',
+                                 self._on_preview_clicked, preview)
+            self._previews.append(preview)
+        # The preview that was clicked last is rendered first.
+        self._active_preview = self._previews[-1]
+        self._active_preview.set_active(True)
+        preview_box = gtk.HBox(False, gui.WIDGET_SPACING)
+        for preview in self._previews:
+            preview_box.pack_start(preview, False, False)
+        table_right.attach_widget(preview_box)
         self._pos_expander = table_right.attach_widget(self._get_position())
         self._pos_expander.set_sensitive(False)
         h = gtk.HBox()
@@ -196,19 +225,59 @@ the first element in this list moving to the last one."), 0)
         self.show_all()
         self._set_changed(False)
     
-    def draw(self, *args):
-        'Called to update the preview widget'
-        self._preview.queue_draw()
+    def draw(self, *layers):
+        """
+        Called to update the previews. Only the given layers are rendered
+        again, or all of them if none are given. Changes are collected and
+        shown at most once every `PREVIEW_INTERVAL`.
+        """
+        for preview in self._previews:
+            preview.mark_changed(layers or LAYERS)
+        if self._preview_source is None:
+            self._preview_source = gobject.timeout_add(PREVIEW_INTERVAL,
+                                                       self._update_previews)
     
-    def _expose(self, widget, event):
-        'Renders the preview widget the first time'
-        ccontext = widget.window.cairo_create()
-        bounds = widget.get_size_request()
-        #ccontext.scale(float(400)/bounds[0],
-        #                float(300)/bounds[1])
-        self._example_slide = exposong.exampleslide._ExampleTextSlide()
-        self.theme.render(ccontext, bounds, self._example_slide)
-        return True
+    def _get_preview_targets(self):
+        "Return the (title, size) of each preview."
+        targets = list(PREVIEW_TARGETS)
+        size = exposong.screen.screen.get_size()
+        if size and tuple(size) not in [t[1] for t in targets]:
+            targets.append((_("Screen (%dx%d)") % tuple(size), tuple(size)))
+        return targets
+    
+    def _on_preview_clicked(self, widget, event, preview):
+        "Render `preview` first from now on."
+        self._active_preview.set_active(False)
+        self._active_preview = preview
+        preview.set_active(True)
+    
+    def _update_previews(self):
+        "Start rendering the changed previews, one at a time when idle."
+        self._preview_source = None
+        self.theme.invalidate()
+        if self._render_source is not None:
+            gobject.source_remove(self._render_source)
+        task = self._render_previews()
+        self._render_source = gobject.idle_add(task.next)
+        return False
+    
+    def _render_previews(self):
+        "Render the active preview, then the others."
+        order = [self._active_preview]
+        order.extend(p for p in self._previews if p is not self._active_preview)
+        for preview in order:
+            if preview.is_changed():
+                preview.render()
+                yield True
+        self._render_source = None
+        yield False
+    
+    def _stop_previews(self, *args):
+        "Stop pending preview updates."
+        for source in (self._preview_source, self._render_source):
+            if source is not None:
+                gobject.source_remove(source)
+        self._preview_source = self._render_source = None
     
     def _get_section_left(self, cb, widgets={}):
         "Returns a table with the left part of the section edit controls"
@@ -293,7 +362,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         body.outline_size = self.body_widgets['outline_size'].get_value()
         body.outline_color = self.body_widgets['outline_color'].get_color().to_string()
         
-        self.draw()
+        self.draw(TEXT)
     
     def _on_footer_changed(self, *args):
         """
@@ -327,7 +396,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         footer.outline_color = self.footer_widgets['outline_color'].\
                 get_color().to_string()
         
-        self.draw()
+        self.draw(TEXT)
     
     def _on_shadow_widgets_set_sensitive(self, widget_list, sensitive=True):
         'Helper method to enable/disable shadow widget after clicking the shadow checkbox'
@@ -367,7 +436,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             self._activate_bg(itr)
             config.set("open-save-dialogs", "themeeditor-add-bg-image", os.path.dirname(img))
         fchooser.destroy()
-        self.draw()
+        self.draw(BACKGROUND)
 
     def _on_bg_image(self, widget=None):
         'Create the widgets for editing image backgrounds'
@@ -397,7 +466,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             self._bg_image_radio_mode_fill.set_active(True)
         else:
             self._bg_image_radio_mode_fit.set_active(True)
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _on_bg_image_changed(self, widget):
         """
@@ -417,7 +486,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             bg.aspect = exposong.theme.ASPECT_FILL
         else:
             bg.aspect = exposong.theme.ASPECT_FIT
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _on_bg_solid_new(self, widget=None):
         'Add a new solid color background'
@@ -449,7 +518,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         self._set_changed()
         self._get_active_bg().color = self._bg_solid_color_button.get_color().to_string()
         self._get_active_bg().alpha = self._bg_solid_color_button.get_alpha()/65535.0
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _load_bg_solid(self):
         'Loads solid background settings from the theme'
@@ -556,7 +625,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             bg.stops[i].alpha = self._bg_gradient_colors[i].get_alpha()/65535.0
             bg.stops[i].location = self._bg_gradient_lengths[i].get_value()/100.0
         bg.angle = self._bg_gradient_angle.get_value()
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _load_bg_gradient(self, widget=None):
         'Loads the gradient background settings from the theme'
@@ -567,7 +636,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         for i in range(len(bg.stops)):
             self._bg_gradient_lengths[i].set_value(bg.stops[i].location*100)
         self._bg_gradient_angle.set_value(bg.angle)
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _on_bg_radial_new(self, widget=None):
         'Adds a new radial background'
@@ -654,7 +723,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         bg.length = self._bg_radial_length.get_value()/100.0
         bg.cpos[0] = self._bg_radial_pos_h.get_value()/100.0
         bg.cpos[1] = self._bg_radial_pos_v.get_value()/100.0
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _load_bg_radial(self):
         'Loads the radial background settings from the theme'
@@ -667,7 +736,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         self._bg_radial_length.set_value(bg.length*100)
         self._bg_radial_pos_h.set_value(bg.cpos[0]*100)
         self._bg_radial_pos_v.set_value(bg.cpos[1]*100)
-        self.draw()
+        self.draw(BACKGROUND)
     
     def _get_active_bg(self):
         'Returns the background of the currently selected item'
@@ -680,7 +749,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         'Called when a background in the list is being dragged to another position'
         gobject.idle_add(self._update_bg_list_from_model)
         self._set_changed()
-        gobject.idle_add(self.draw)
+        gobject.idle_add(self.draw, BACKGROUND)
     
     def _update_bg_list_from_model(self):
         'Updates the theme background list according to the model'
@@ -704,6 +773,9 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             self._on_bg_gradient()
         elif isinstance(bg, exposong.theme.RadialGradientBackground):
             self._on_bg_radial()
+        else:
+            table = self._bg_edit_table
+            table.foreach(lambda w: table.remove(w))
         self._load_bg_position()
     
     def _on_delete_bg(self, *args):
@@ -722,13 +794,14 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         if resp == gtk.RESPONSE_YES:
             model.remove(itr)
             self._update_bg_list_from_model()
-            self.draw()
+            self.draw(BACKGROUND)
             self._set_changed(True)
     
     def _bg_get_row_text(self, column, cell, model, titer):
         'Get the background name for the cell'
         bg = model.get_value(titer, 0)
-        if isinstance(bg, exposong.theme.ImageBackground):
+        if isinstance(bg, (exposong.theme.ImageBackground,
+                           exposong.theme.AnimatedBackground)):
             cell.set_property('text', "%s: %s"%(bg.get_name(), bg.src))
         else:
             cell.set_property('text', bg.get_name())
@@ -826,7 +899,10 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
         el.pos[3] = bt
         self.__updating = False
         self._set_changed()
-        self.draw()
+        if self._notebook.get_current_page() == 0:
+            self.draw(BACKGROUND)
+        else:
+            self.draw(TEXT)
     
     def _nb_page_changed(self, notebook, page, page_num):
         """
@@ -903,9 +979,15 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
     def _load_theme(self, theme):
         'Loads a theme into the Theme Editor'
         if isinstance(theme, exposong.theme.Theme):
-            self.theme = theme
+            self._live_theme = theme
         else:
-            self.theme = exposong.theme.Theme(theme)
+            self._live_theme = exposong.theme.Theme(theme)
+        # The theme is shared with the screen and the theme list, so the
+        # changes are made to a copy until they are saved.
+        self.theme = self._live_theme.copy()
+        for preview in self._previews:
+            preview.theme = self.theme
+        self.draw()
         
         self._title_entry.set_text(self.theme.get_title())
         
@@ -978,8 +1060,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
     def _revert_changes(self, *args):
         'Reverts all unsaved changes'
         self._bg_model.clear()
-        self.theme.revert()
-        self._load_theme(self.theme)
+        self._load_theme(self._live_theme)
         self.draw()
         
     def _save_changes(self, *args):
@@ -1000,6 +1081,7 @@ in percentage of font height. So an offset of 0.5 for point 12 font is 6 points.
             self.theme.filename = check_filename(name, os.path.join(
                     DATA_PATH, 'theme', self.theme.filename))
         self.theme.save()
+        self._live_theme.update(self.theme)
         self._set_changed(False)
     
     def _close(self, widget, *args):
@@ -1016,9 +1098,7 @@ Do you want to save?")
             dialog.add_button(gtk.STOCK_SAVE, gtk.RESPONSE_OK)
             dialog.show_all()
             resp = dialog.run()
-            if resp == gtk.RESPONSE_NO:
-                self.theme.revert()
-            elif resp == gtk.RESPONSE_CANCEL:
+            if resp == gtk.RESPONSE_CANCEL:
                 dialog.destroy()
                 return True
             elif resp == gtk.RESPONSE_OK:
@@ -1029,3 +1109,84 @@ Do you want to save?")
         if __name__ == "__main__":
             gtk.main_quit()
 
+
+class ThemePreview(gtk.Frame):
+    """
+    Shows a theme with the example slide, as it looks at a target size.
+    
+    The theme is rendered with the render plan of the target size, scaled down
+    to the preview. The backgrounds and the text are rendered to separate
+    layers, so changing the backgrounds does not render the text again, and
+    the other way round. The layers are rendered by `ThemeEditor`, the preview
+    only shows them.
+    """
+    def __init__(self, title, target, width):
+        gtk.Frame.__init__(self)
+        self.title = title
+        self.target = tuple(target)
+        self.size = (width, int(round(float(width) * target[1] / target[0])))
+        self.theme = None
+        self._slide = exposong.exampleslide._ExampleTextSlide()
+        self._layers = {}
+        self._changed = set(LAYERS)
+        self._label = gtk.Label()
+        self.set_label_widget(self._label)
+        self.set_active(False)
+        self.area = gtk.DrawingArea()
+        self.area.set_size_request(*self.size)
+        self.area.add_events(gtk.gdk.BUTTON_PRESS_MASK)
+        self.area.connect('expose-event', self._expose)
+        self.add(self.area)
+    
+    def set_active(self, active):
+        "Show if this is the preview that is rendered first."
+        text = escape(self.title)
+        if active:
+            text = "<b>%s</b>" % text
+        self._label.set_markup(text)
+    
+    def mark_changed(self, layers):
+        "Mark layers that have to be rendered again."
+        self._changed.update(layers)
+    
+    def is_changed(self):
+        "Return True if a layer has to be rendered again."
+        return bool(self._changed)
+    
+    def render(self):
+        "Render the changed layers, and show them."
+        if self.theme is None:
+            return
+        plan = self.theme.get_plan(self.target)
+        for layer in LAYERS:
+            if layer in self._changed or layer not in self._layers:
+                self._layers[layer] = self._render_layer(plan, layer)
+        self._changed.clear()
+        self.area.queue_draw()
+    
+    def _render_layer(self, plan, layer):
+        "Render one layer of the preview to a new surface."
+        if layer == BACKGROUND:
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, *self.size)
+        else:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *self.size)
+        ccontext = gtk.gdk.CairoContext(cairo.Context(surface))
+        ccontext.scale(float(self.size[0]) / self.target[0],
+                       float(self.size[1]) / self.target[1])
+        if layer == BACKGROUND:
+            plan.render_background(ccontext)
+        else:
+            plan.render_slide(ccontext, self._slide)
+        return surface
+    
+    def _expose(self, widget, event):
+        "Draw the rendered layers."
+        ccontext = widget.window.cairo_create()
+        if BACKGROUND not in self._layers:
+            ccontext.set_source_rgb(0, 0, 0)
+            ccontext.paint()
+        for layer in LAYERS:
+            if layer in self._layers:
+                ccontext.set_source_surface(self._layers[layer], 0, 0)
+                ccontext.paint()
+        return True
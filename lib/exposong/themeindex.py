@@ -0,0 +1,152 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An index of the theme files, so the themes can be listed without parsing them.
+
+For each theme file, the index keeps its title, modification time and size,
+and the digest used for its thumbnail keys (see `Theme.get_digest()`). A theme
+with an up to date entry is created as a lazy theme, which is only parsed when
+it is selected, previewed or used by a slide. A theme that was changed since
+it was indexed is parsed, and its entry is updated.
+"""
+
+import gobject
+import json
+import os
+import os.path
+import shutil
+
+import exposong
+import exposong.theme
+from exposong import DATA_PATH
+
+INDEX_FILE = os.path.join(DATA_PATH, '.cache', 'themes.json')
+
+
+class ThemeIndex(object):
+    """
+    The title, file stamp and thumbnail digest of each theme file.
+    
+    filename: The file the index is saved in.
+    """
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        # theme filename: {'title', 'mtime', 'size', 'digest', 'resources'}
+        self._index = {}
+        self._save_source = None
+        self._load_index()
+    
+    def get_theme(self, path):
+        "Return the theme for a file, parsing it only if it changed."
+        filenm = os.path.basename(path)
+        entry = self._index.get(filenm)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is not None and entry is not None and self._is_fresh(entry, st):
+            theme = exposong.theme.Theme(path, lazy=True)
+            if entry['title'] is not None:
+                theme.meta['title'] = entry['title']
+            theme._digest = entry['digest']
+            return theme
+        theme = exposong.theme.Theme(path)
+        self.update(theme, path)
+        return theme
+    
+    def update(self, theme, path=None):
+        "Index a theme after it was loaded or saved."
+        if theme.is_builtin() or not theme.filename:
+            return
+        if path is None:
+            path = os.path.join(DATA_PATH, 'theme', theme.filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._index[theme.filename] = {
+                'title': theme.meta.get('title'),
+                'mtime': st.st_mtime,
+                'size': st.st_size,
+                'digest': theme.get_digest(),
+                'resources': theme.get_resource_stamps(),
+                }
+        self._queue_save()
+    
+    def remove(self, filenm):
+        "Remove a deleted theme from the index."
+        if self._index.pop(os.path.basename(filenm), None) is not None:
+            self._queue_save()
+    
+    def prune(self, filenames):
+        "Remove the entries of theme files that are not in `filenames`."
+        keep = set(os.path.basename(f) for f in filenames)
+        for filenm in self._index.keys():
+            if filenm not in keep:
+                del self._index[filenm]
+                self._queue_save()
+    
+    def _is_fresh(self, entry, st):
+        "Return True if neither the theme file nor its backgrounds changed."
+        if entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            return False
+        for filenm, mtime, size in entry['resources']:
+            try:
+                rst = os.stat(filenm)
+            except OSError:
+                return False
+            if rst.st_mtime != mtime or rst.st_size != size:
+                return False
+        return True
+    
+    def _load_index(self):
+        "Read the index from disk."
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as fl:
+                self._index = dict(json.load(fl))
+        except (IOError, ValueError, TypeError):
+            exposong.log.warning('The theme index "%s" could not be read. '
+                                 'The themes will be parsed again.',
+                                 self.filename)
+            self._index = {}
+    
+    def _queue_save(self):
+        "Write the index when the program is idle."
+        if self._save_source is None:
+            self._save_source = gobject.idle_add(self._save_index,
+                                                 priority=gobject.PRIORITY_LOW)
+    
+    def _save_index(self):
+        "Write the index to disk."
+        self._save_source = None
+        folder = os.path.dirname(self.filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        try:
+            with open(self.filename + '.new', 'w') as fl:
+                json.dump(self._index, fl)
+            shutil.move(self.filename + '.new', self.filename)
+        except IOError:
+            exposong.log.warning('Could not save the theme index "%s".',
+                                 self.filename)
+        return False
+
+index = ThemeIndex()
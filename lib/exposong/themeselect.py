@@ -20,20 +20,26 @@
 A widget to change the currently active theme.
 """
 
+import cairo
+import collections
 import gobject
 import gtk
 import os, os.path
 import pango
-import re
-from gtk.gdk import pixbuf_new_from_file as pb_new
 
+import exposong.imagepool
 import exposong.main
 import exposong.screen
+import exposong.slidelist
 import exposong.theme
+import exposong.themeindex
+import exposong.thumbcache
+import exposong.worker
 import exposong.exampleslide
 from exposong import themeeditor
 from exposong import DATA_PATH
 from exposong.config import config
+from exposong.glob import get_sort_key
 
 themeselect = None
 SCALED_HEIGHT = 600
@@ -46,8 +52,10 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
     A theme selection combo box for the main screen.
     """
     def __init__(self):
+        # Columns: filename, Theme, sort key
         self.liststore = gtk.ListStore(gobject.TYPE_STRING,
-                                       gobject.TYPE_PYOBJECT)
+                                       gobject.TYPE_PYOBJECT,
+                                       gobject.TYPE_STRING)
         cell = gtk.CellRendererPixbuf
         
         gtk.ComboBox.__init__(self, self.liststore)
@@ -60,7 +68,6 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
         self.pack_start(textrend, True)
         self.set_cell_data_func(textrend, self._get_theme_title)
         self.connect("changed", self._theme_changed)
-        self.liststore.set_sort_func(1, self._sort)
         
         task = self._load_themes()
         gobject.idle_add(task.next, priority=gobject.PRIORITY_HIGH-10)
@@ -84,11 +91,12 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
         bltheme = exposong.theme.Theme(builtin=True)
         bltheme.meta['title'] = _('Black')
         
-        itr = self.liststore.append([name, bltheme])
+        itr = self.liststore.append([name, bltheme, _get_sort_key(bltheme)])
         self.set_active_iter(itr)
         yield True
         
         dir = os.path.join(DATA_PATH, "theme")
+        paths = []
         for filenm in os.listdir(dir):
             if not filenm.endswith('.xml'):
                 continue
@@ -97,26 +105,36 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
             path = os.path.join(dir, filenm)
             exposong.log.info('Loading theme "%s".',
                               filenm)
-            theme = exposong.theme.Theme(path)
-            itr = self.liststore.append([path, theme])
+            # Themes that did not change are only parsed when they are used.
+            theme = exposong.themeindex.index.get_theme(path)
+            itr = self.liststore.append([path, theme, _get_sort_key(theme)])
+            paths.append(path)
             if path == active:
                 self.set_active_iter(itr)
+            if not theme.is_loaded():
+                continue
             yield True
-        task = self._load_theme_thumbs()
-        gobject.idle_add(task.next, priority=gobject.PRIORITY_LOW)
+        exposong.themeindex.index.prune(paths)
+        self._queue_theme_thumbs()
         yield True
-        self.liststore.set_sort_column_id(1, gtk.SORT_ASCENDING)
+        self.liststore.set_sort_column_id(2, gtk.SORT_ASCENDING)
         yield False
     
+    def _queue_theme_thumbs(self):
+        "Start loading the theme thumbnails when the program is idle."
+        task = self._load_theme_thumbs()
+        gobject.idle_add(task.next, priority=gobject.PRIORITY_LOW)
+    
     def _load_theme_thumbs(self):
-        "Force loading of theme thumbnails."
+        "Start loading the theme thumbnails in the background, one per call."
         cell = self.get_cells()[0]
         size = (int(CELL_HEIGHT * CELL_ASPECT),
                   CELL_HEIGHT)
         yield True
-        for row in self.liststore:
-            cell.theme = row[1]
-            cell._get_pixmap(self.window, size)
+        # The list can be sorted while the thumbnails are loaded.
+        for theme in [row[1] for row in self.liststore]:
+            cell.theme = theme
+            cell._get_pixmap(size, widget=self)
             yield True
         yield False
     
@@ -136,23 +154,30 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
             exposong.log.info('Changing theme to "%s".',t)
             self.set_tooltip_text(t)
             exposong.screen.screen.draw()
+            # The slide thumbnails of the new theme have other keys.
+            if exposong.slidelist.slidelist:
+                exposong.slidelist.slidelist.queue_draw()
         self._set_menu_items_disabled()
     
     def new_theme(self, *args):
-        editor = themeeditor.ThemeEditor(exposong.main.main, exposong.theme.Theme())
-        editor.connect('destroy', self._add_theme)
+        theme = exposong.theme.Theme()
+        editor = themeeditor.ThemeEditor(exposong.main.main, theme)
+        editor.connect('destroy', self._add_theme, theme)
     
     def append(self, filename):
         "Add a new theme to ExpoSong."
         exposong.log.info('Loading theme "%s".', filename)
-        itr = self.liststore.append([filename, exposong.theme.Theme(filename)])
-        self._load_theme_thumbs()
+        theme = exposong.themeindex.index.get_theme(filename)
+        itr = self.liststore.append([filename, theme, _get_sort_key(theme)])
+        self._queue_theme_thumbs()
     
-    def _add_theme(self, editor):
-        if editor.theme.filename: #Not cancelled
-            itr = self.liststore.append([editor.theme.filename, editor.theme])
+    def _add_theme(self, editor, theme):
+        if theme.filename: #Not cancelled
+            exposong.themeindex.index.update(theme)
+            itr = self.liststore.append([theme.filename, theme,
+                                         _get_sort_key(theme)])
             self.set_active_iter(itr)
-            self._load_theme_thumbs()
+            self._queue_theme_thumbs()
         
     def _edit_theme(self, *args):
         theme = self.get_active()
@@ -162,6 +187,11 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
         editor.connect('destroy', self._update_theme, theme)
     
     def _update_theme(self, editor, theme, *args):
+        exposong.themeindex.index.update(theme)
+        for row in self.liststore:
+            if row[1] is theme:
+                row[2] = _get_sort_key(theme)
+                break
         self._delete_theme_thumb(theme)
         exposong.screen.screen.draw()
     
@@ -177,11 +207,14 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
         dialog.destroy()
         if resp == gtk.RESPONSE_YES:
             os.remove(os.path.join(DATA_PATH, 'theme', theme.filename))
+            exposong.themeindex.index.remove(theme.filename)
             for bg in theme.backgrounds:
                 if isinstance(bg, exposong.theme.ImageBackground):
                     os.remove(os.path.join(DATA_PATH, 'theme', 'res', bg.src))
             size = (int(CELL_HEIGHT * CELL_ASPECT), CELL_HEIGHT)
-            self.get_cells()[0]._delete_pixmap(size)
+            cell = self.get_cells()[0]
+            cell.theme = theme
+            cell._delete_pixmap(size)
             self.liststore.remove(self.get_active_iter())
             del theme
             self.set_active(0)
@@ -190,18 +223,7 @@ class ThemeSelect(gtk.ComboBox, exposong._hook.Menu, object):
         cell = self.get_cells()[0]
         cell.theme = theme
         size = (int(CELL_HEIGHT * CELL_ASPECT), CELL_HEIGHT)
-        cell._get_pixmap(self.window, size, False)
-    
-    def _sort(self, model, itr1, itr2):
-        "Sort the themes in the list."
-        th1 = model.get_value(itr1, 1)
-        th2 = model.get_value(itr2, 1)
-        if th1 is None or th2 is None: return 0
-        # Sort builtin to the end
-        if th1.is_builtin() != th2.is_builtin():
-            return cmp(th1.is_builtin(), th2.is_builtin())
-        # Sort by title
-        return cmp(th1.get_title(), th2.get_title())
+        cell._get_pixmap(size, False, self)
     
     @classmethod
     def merge_menu(cls, uimanager):
@@ -286,72 +308,146 @@ class CellRendererTheme(gtk.GenericCellRenderer):
         self.xalign = 0.5
         self.yalign = 0.5
         self.active = 0
+        # Thumbnail surfaces by cache key, and the widgets waiting for
+        # thumbnails that are being rendered.
         self._pm = {}
+        self._pending = {}
+        # Thumbnails to render on the main loop, as (key, theme, slide, size).
+        self._render_queue = collections.deque()
+        self._render_source = None
+        # Thumbnails drawn with placeholder images, as key: (job, widgets),
+        # and widgets that drew an uncached preview with placeholders. They
+        # are rendered again when an image finished loading.
+        self._incomplete = {}
+        self._redraw = set()
     
     def _delete_pixmap(self, size):
         'Deletes the cached image when the theme was deleted.'
-        fname  = self._get_pixmap_name(size)
-        if fname in self._pm:
-            del self._pm[fname]
-        pm = os.path.join(DATA_PATH, '.cache', 'theme', fname)
-        if os.path.exists(pm):
-            os.remove(pm)
+        key = self._get_pixmap_key(size)
+        if key is None:
+            return
+        if key in self._pm:
+            del self._pm[key]
+        exposong.thumbcache.cache.remove(key)
     
-    def _get_pixmap_name(self, size):
-        'Return the filename of the pixmap (includes size)'
-        if self.theme.is_builtin():
-            fname = '_builtin_' + re.sub('[^a-z]+','_',self.theme.meta['title'].lower()).rstrip('_')
-        else:
-            fname = os.path.basename(os.path.splitext(self.theme.filename)[0])
+    def _get_pixmap_key(self, size):
+        'Return the cache key of the pixmap, see exposong.thumbcache.'
         if self.slide is None:
             return None
-        fname += '.%s' % self.slide.id
-        fname += '.%s.png' % 'x'.join(map(str, size))
-        return fname
+        return exposong.thumbcache.get_key(self.theme, self.slide, size)
     
-    def _get_pixmap(self, window, size, cache=True):
-        "Render to an offscreen pixmap."
-        cache = cache and self.can_cache
-        if not cache:
-            self._delete_pixmap(size)
-        fname = self._get_pixmap_name(size)
-        if not fname:
-            return None
-        if cache and fname in self._pm:
-            return self._pm[fname]
-        
-        width, height = size
-        
-        self._pm[fname] = gtk.gdk.Pixmap(window, width, height)
+    def _get_pixmap(self, size, cache=True, widget=None):
+        """
+        Return the thumbnail surface, or None if it is not ready yet.
         
-        cache_dir = os.path.join(DATA_PATH, ".cache", "theme")
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        cpath = os.path.join(cache_dir, fname)
-        
-        ccontext = self._pm[fname].cairo_create()
-        if cache and os.path.exists(cpath):
-            # Load the image from memory, or disk if available
-            exposong.log.debug('Loading theme thumbnail "%s".', fname)
-            pb = pb_new(cpath)
-            ccontext.set_source_pixbuf(pb, 0, 0)
-            ccontext.paint()
+        Cached thumbnails are loaded on a worker thread. Missing thumbnails
+        are rendered on the main loop when it is idle, one at a time, as the
+        render plans of the themes are shared with the presentation screen.
+        Images that are not loaded yet are drawn with placeholders, and the
+        thumbnail is rendered again when they are loaded. `widget` is redrawn
+        when the thumbnail is ready.
+        """
+        key = self._get_pixmap_key(size)
+        if not key:
+            return None
+        if cache and key in self._pm:
+            return self._pm[key]
+        if key in self._pending:
+            if widget:
+                self._pending[key].add(widget)
+            return None
+        self._pending[key] = set()
+        if widget:
+            self._pending[key].add(widget)
+        job = (key, self.theme, self.slide, tuple(size))
+        cpath = None
+        if cache:
+            cpath = exposong.thumbcache.cache.get(key)
         else:
-            exposong.log.debug('Generating theme thumbnail "%s".', fname)
-            bounds = (0, 0, SCALED_HEIGHT * CELL_ASPECT, SCALED_HEIGHT)
-            ccontext.scale(float(width) / bounds[2],
-                           float(height) / bounds[3])
-            self.theme.render(ccontext, bounds, self.slide)
-            if self.can_cache:
-                # Save the rendered image to cache
-                pb = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, width,
-                                    height)
-                pb.get_from_drawable(self._pm[fname],
-                                     self._pm[fname].get_colormap(), 0, 0, 0, 0,
-                                     width, height)
-                pb.save(cpath, "png")
-        return self._pm[fname]
-
+            self._pm.pop(key, None)
+        if cpath:
+            _worker.submit(_load_thumbnail, (cpath,),
+                           lambda result: self._on_thumbnail_loaded(job, result),
+                           exposong.worker.PRIORITY_LOW)
+        else:
+            self._queue_render(job)
+        return None
+    
+    def _on_thumbnail_loaded(self, job, surface):
+        'Show a thumbnail loaded from the cache, or render it if that failed.'
+        if surface is None:
+            self._queue_render(job)
+        else:
+            self._show_thumbnail(job[0], surface)
+    
+    def _queue_render(self, job):
+        'Render a thumbnail when the main loop is idle.'
+        self._render_queue.append(job)
+        if self._render_source is None:
+            self._render_source = gobject.idle_add(
+                    self._render_next, priority=gobject.PRIORITY_LOW)
+    
+    def _render_next(self):
+        'Render one queued thumbnail, and save it on the worker thread.'
+        job = self._render_queue.popleft()
+        key, theme, slide, size = job
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, *size)
+        complete = _render_scaled(gtk.gdk.CairoContext(cairo.Context(surface)),
+                                  theme, slide, size)
+        if complete:
+            self._incomplete.pop(key, None)
+            _worker.submit(_save_thumbnail,
+                           (surface, exposong.thumbcache.cache.get_path(key)),
+                           lambda saved: self._on_thumbnail_saved(key, saved),
+                           exposong.worker.PRIORITY_LOW)
+        else:
+            # Not saved, so the placeholders are not kept in the cache.
+            self._incomplete[key] = (job, set(self._pending.get(key, ())))
+            self._watch_images()
+        self._show_thumbnail(key, surface)
+        if self._render_queue:
+            return True
+        self._render_source = None
+        return False
+    
+    def _watch_images(self):
+        'Get called when an image finished loading.'
+        exposong.imagepool.pool.remove_listener(self._on_image_loaded)
+        exposong.imagepool.pool.add_listener(self._on_image_loaded)
+    
+    def _on_image_loaded(self, filename):
+        'Render the thumbnails and previews with placeholders again.'
+        exposong.imagepool.pool.remove_listener(self._on_image_loaded)
+        incomplete, self._incomplete = self._incomplete, {}
+        for key, (job, widgets) in incomplete.iteritems():
+            self._pending.setdefault(key, set()).update(widgets)
+            self._queue_render(job)
+        redraw, self._redraw = self._redraw, set()
+        for widget in redraw:
+            widget.queue_draw()
+    
+    def _on_thumbnail_saved(self, key, saved):
+        'Add a thumbnail to the cache index, after it was saved.'
+        if saved:
+            exposong.thumbcache.cache.add(key)
+    
+    def _show_thumbnail(self, key, surface):
+        'Store a thumbnail, and redraw the widgets waiting for it.'
+        self._pm[key] = surface
+        for widget in self._pending.pop(key, ()):
+            widget.queue_draw()
+    
+    def _draw_placeholder(self, ccontext, width, height):
+        'Draw the first color of the theme until the thumbnail is ready.'
+        color = '#333'
+        # Do not parse a lazy theme just for the placeholder.
+        if self.theme.is_loaded():
+            for bg in self.theme.backgrounds:
+                if isinstance(bg, exposong.theme.ColorBackground):
+                    color = bg.color
+                    break
+        exposong.theme.Theme.render_color(ccontext, (width, height), color)
+    
     def on_render(self, window, widget, background_area, cell_area, expose_area,
                flags):
         "Display the theme preview."
@@ -365,12 +461,26 @@ class CellRendererTheme(gtk.GenericCellRenderer):
         if width <= 0 or height <= 0:
             return
         
-        pm = self._get_pixmap(window, cell_position[2:4])
-        if pm is None:
-            return False
-        window.draw_drawable(widget.get_style().fg_gc[gtk.STATE_NORMAL],
-                             pm, 0, 0, cell_area.x + x_offset,
-                             cell_area.y + y_offset, width, height)
+        ccontext = window.cairo_create()
+        ccontext.rectangle(cell_area.x + x_offset, cell_area.y + y_offset,
+                           width, height)
+        ccontext.clip()
+        ccontext.translate(cell_area.x + x_offset, cell_area.y + y_offset)
+        if not self.can_cache:
+            # The slide can change without a new key, so always render it.
+            if self.slide is None:
+                return False
+            if not _render_scaled(ccontext, self.theme, self.slide,
+                                  (width, height)):
+                self._redraw.add(widget)
+                self._watch_images()
+            return
+        surface = self._get_pixmap(cell_position[2:4], widget=widget)
+        if surface is None:
+            self._draw_placeholder(ccontext, width, height)
+        else:
+            ccontext.set_source_surface(surface, 0, 0)
+            ccontext.paint()
     
     def on_get_size(self, widget, cell_area):
         "Return the widgets size and position."
@@ -396,3 +506,42 @@ class CellRendererTheme(gtk.GenericCellRenderer):
         return getattr(self, pspec.name)
 gobject.type_register(CellRendererTheme)
 
+
+_worker = exposong.worker.WorkerPool("thumbnails")
+
+def _get_sort_key(theme):
+    "Return the sort key of a theme. Builtin themes are sorted to the end."
+    return "%d%s" % (theme.is_builtin(), get_sort_key(theme.get_title()))
+
+def _render_scaled(ccontext, theme, slide, size):
+    """
+    Render a theme thumbnail of `size` to the context. Images that are not
+    loaded yet are drawn with placeholders, and loaded in the background.
+    Returns True if no placeholders were used.
+    """
+    bounds = (0, 0, SCALED_HEIGHT * CELL_ASPECT, SCALED_HEIGHT)
+    ccontext.scale(float(size[0]) / bounds[2], float(size[1]) / bounds[3])
+    exposong.imagepool.pool.set_placeholders(True)
+    try:
+        theme.render(ccontext, bounds, slide)
+        return exposong.imagepool.pool.get_missing() == 0
+    finally:
+        exposong.imagepool.pool.set_placeholders(False)
+
+def _load_thumbnail(cpath):
+    "Load a cached thumbnail. This runs on the worker thread."
+    try:
+        return cairo.ImageSurface.create_from_png(cpath)
+    except (IOError, MemoryError):
+        return None
+
+def _save_thumbnail(surface, save_path):
+    """
+    Save a rendered thumbnail to the cache. Returns True if it was saved.
+    This runs on the worker thread.
+    """
+    try:
+        surface.write_to_png(save_path)
+    except IOError:
+        return False
+    return True
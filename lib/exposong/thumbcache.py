@@ -0,0 +1,179 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A disk cache for theme thumbnails.
+
+Thumbnails are stored by a key made from a hash of the theme and its
+background files (see `Theme.get_digest()`), the slide and the size. A changed
+theme gets a new key, so only its thumbnails are rendered again, and the old
+ones are released when the cache grows over its size limit, least recently
+used first. The keys, sizes and use times are kept in an index file.
+"""
+
+import gobject
+import json
+import os
+import os.path
+import shutil
+import time
+
+import exposong
+from exposong import DATA_PATH
+
+# The largest number of bytes used by the thumbnail files.
+MAX_CACHE_SIZE = 8 * 1048576
+
+INDEX_FILE = 'index.json'
+
+
+def get_key(theme, slide, size):
+    "Return the cache key of a thumbnail."
+    return "%s.%s.%s" % (theme.get_digest(), slide.id,
+                         'x'.join(str(int(v)) for v in size))
+
+
+class ThumbnailCache(object):
+    """
+    A folder of PNG thumbnails with a size limit.
+    
+    folder:   The folder the thumbnails and the index are stored in.
+    max_size: The largest number of bytes used by the thumbnails.
+    """
+    def __init__(self, folder, max_size=MAX_CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        # key: [bytes, last use]
+        self._index = {}
+        self._size = 0
+        self._save_source = None
+        self._load_index()
+    
+    def get(self, key):
+        "Return the filename of a cached thumbnail, or None."
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            self._remove_entry(key)
+            return None
+        entry[1] = time.time()
+        self._queue_save()
+        return path
+    
+    def put(self, key, pixbuf):
+        "Store a thumbnail pixbuf."
+        path = self.get_path(key)
+        try:
+            pixbuf.save(path, "png")
+        except gobject.GError:
+            exposong.log.warning('Could not save the thumbnail "%s".', path)
+            return
+        self.add(key)
+    
+    def add(self, key):
+        "Add a thumbnail that was saved to `get_path(key)`."
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return
+        if key in self._index:
+            self._size -= self._index[key][0]
+        nbytes = os.path.getsize(path)
+        self._index[key] = [nbytes, time.time()]
+        self._size += nbytes
+        self._evict()
+        self._queue_save()
+    
+    def remove(self, key):
+        "Delete a thumbnail."
+        if key in self._index:
+            self._remove_entry(key)
+            self._queue_save()
+    
+    def get_path(self, key):
+        "Return the filename to save the thumbnail of `key` to."
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        return os.path.join(self.folder, key + '.png')
+    
+    def _remove_entry(self, key):
+        "Delete a thumbnail file and its index entry."
+        self._size -= self._index.pop(key)[0]
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+    
+    def _evict(self):
+        "Delete the least recently used thumbnails until we are under the limit."
+        if self._size <= self.max_size:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k][1]):
+            if self._size <= self.max_size:
+                break
+            exposong.log.debug('Releasing theme thumbnail "%s".', key)
+            self._remove_entry(key)
+    
+    def _load_index(self):
+        "Read the index, and delete files that are not in it."
+        path = os.path.join(self.folder, INDEX_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path) as fl:
+                    self._index = dict((k, list(v)) for k, v
+                                       in json.load(fl).iteritems())
+            except (IOError, ValueError, AttributeError):
+                exposong.log.warning('The thumbnail index "%s" could not be '
+                                     'read. Thumbnails will be rendered again.',
+                                     path)
+                self._index = {}
+        if not os.path.isdir(self.folder):
+            return
+        for filenm in os.listdir(self.folder):
+            if filenm.endswith('.png') and filenm[:-4] not in self._index:
+                # Thumbnails from older versions, or without an index.
+                os.remove(os.path.join(self.folder, filenm))
+        for key in self._index.keys():
+            if not os.path.exists(self.get_path(key)):
+                del self._index[key]
+        self._size = sum(v[0] for v in self._index.itervalues())
+        self._evict()
+    
+    def _queue_save(self):
+        "Write the index when the program is idle."
+        if self._save_source is None:
+            self._save_source = gobject.idle_add(self._save_index,
+                                                 priority=gobject.PRIORITY_LOW)
+    
+    def _save_index(self):
+        "Write the index to disk."
+        self._save_source = None
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        path = os.path.join(self.folder, INDEX_FILE)
+        try:
+            with open(path + '.new', 'w') as fl:
+                json.dump(self._index, fl)
+            shutil.move(path + '.new', path)
+        except IOError:
+            exposong.log.warning('Could not save the thumbnail index "%s".',
+                                 path)
+        return False
+
+cache = ThumbnailCache(os.path.join(DATA_PATH, '.cache', 'theme'))
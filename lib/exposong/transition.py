@@ -0,0 +1,179 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Transitions between two frames of the presentation screen.
+
+Both frames are already rendered, so a transition only blends two cached
+surfaces. The frames are driven by a fixed rate scheduler: each tick is
+scheduled for the next frame slot, and frame slots that are missed because the
+computer was too slow are counted as dropped.
+"""
+
+import gobject
+import time
+
+import exposong
+from exposong.config import config
+
+CUT = 'cut'
+CROSSFADE = 'crossfade'
+FADE_BLACK = 'fade-black'
+
+# The frames drawn per second during a transition.
+FRAME_RATE = 25
+
+
+def get_transition_names():
+    "Return the transition keys and their names for the user interface."
+    return ((CUT, _("Cut")),
+            (CROSSFADE, _("Cross-fade")),
+            (FADE_BLACK, _("Fade through black")))
+
+def get_configured():
+    "Return the transition and duration in seconds from the configuration."
+    kind = config.get("screen", "transition")
+    if kind not in (CUT, CROSSFADE, FADE_BLACK):
+        kind = CUT
+    try:
+        duration = config.getint("screen", "transition_duration") / 1000.0
+    except ValueError:
+        duration = 0.0
+    return kind, duration
+
+
+class Transition(object):
+    """
+    Blends from one cached frame to another.
+    
+    kind:     One of CUT, CROSSFADE or FADE_BLACK.
+    duration: The length of the transition in seconds.
+    old, new: The cairo surfaces of the frames.
+    redraw:   Called for every frame. It should cause `paint()` to be called.
+    done:     Called once the transition has finished.
+    """
+    def __init__(self, kind, duration, old, new, redraw, done):
+        self.kind = kind
+        self.duration = duration
+        self.old = old
+        self.new = new
+        self._redraw = redraw
+        self._done = done
+        self._interval = 1.0 / FRAME_RATE
+        self._start = None
+        self._slot = 0
+        self._source = None
+        self.progress = 0.0
+    
+    def start(self):
+        "Start the transition."
+        stats.transitions += 1
+        self._start = time.time()
+        self._slot = 0
+        self._schedule()
+    
+    def stop(self):
+        "Finish the transition immediately."
+        if self._source:
+            gobject.source_remove(self._source)
+            self._source = None
+        self.progress = 1.0
+        self._done(self)
+    
+    def is_running(self):
+        "Return True until the transition has finished."
+        return self.progress < 1.0
+    
+    def _schedule(self):
+        "Wait for the next frame slot."
+        delay = self._start + (self._slot + 1) * self._interval - time.time()
+        self._source = gobject.timeout_add(max(int(delay * 1000), 0),
+                                           self._tick,
+                                           priority=gobject.PRIORITY_HIGH)
+    
+    def _tick(self):
+        "Advance to the current frame slot."
+        elapsed = time.time() - self._start
+        slot = int(elapsed / self._interval)
+        if slot > self._slot + 1:
+            stats.dropped += slot - self._slot - 1
+        self._slot = max(slot, self._slot + 1)
+        self.progress = min(elapsed / self.duration, 1.0)
+        self._redraw()
+        if self.progress < 1.0:
+            self._schedule()
+        else:
+            self._source = None
+            self._done(self)
+        return False
+    
+    def paint(self, ccontext):
+        "Paint the current blend of both frames."
+        begin = time.time()
+        if self.kind == FADE_BLACK:
+            ccontext.set_source_rgb(0, 0, 0)
+            ccontext.paint()
+            if self.progress < 0.5:
+                ccontext.set_source_surface(self.old, 0, 0)
+                ccontext.paint_with_alpha(1.0 - self.progress * 2)
+            else:
+                ccontext.set_source_surface(self.new, 0, 0)
+                ccontext.paint_with_alpha(self.progress * 2 - 1.0)
+        else:
+            ccontext.set_source_surface(self.old, 0, 0)
+            ccontext.paint()
+            ccontext.set_source_surface(self.new, 0, 0)
+            ccontext.paint_with_alpha(self.progress)
+        stats.add_frame(time.time() - begin)
+
+
+class TransitionStats(object):
+    """
+    Statistics about the frames drawn for transitions.
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        "Clear the statistics."
+        self.transitions = 0
+        self.frames = 0
+        self.dropped = 0
+        self.total_cost = 0.0
+        self.max_cost = 0.0
+    
+    def add_frame(self, cost):
+        "Record a frame that took `cost` seconds to draw."
+        self.frames += 1
+        self.total_cost += cost
+        self.max_cost = max(self.max_cost, cost)
+    
+    def get_statistics(self):
+        "Return the statistics as a dictionary, with times in milliseconds."
+        if self.frames:
+            average = self.total_cost / self.frames * 1000
+        else:
+            average = 0.0
+        return {'transitions': self.transitions,
+                'frames': self.frames,
+                'dropped': self.dropped,
+                'average_ms': average,
+                'max_ms': self.max_cost * 1000,
+                }
+
+stats = TransitionStats()
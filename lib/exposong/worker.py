@@ -0,0 +1,97 @@
+#
+# vim: ts=4 sw=4 expandtab ai:
+#
+# Copyright (C) 2008-2011 Exposong.org
+#
+# ExpoSong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs slow jobs, such as decoding images, on background threads.
+
+Jobs with a lower priority number run first. The result of a job is passed to
+its callback from the GTK main loop, so only the callback may use widgets.
+"""
+
+import gobject
+import itertools
+import Queue
+import threading
+import traceback
+
+import exposong
+
+PRIORITY_HIGH = -10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = 10
+
+
+class WorkerPool(object):
+    """
+    A set of background threads that run jobs from a priority queue.
+    
+    The threads are started when the first job is submitted.
+    """
+    def __init__(self, name, threads=1):
+        self.name = name
+        self._threads = []
+        self._count = threads
+        self._queue = Queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+    
+    def submit(self, func, args=(), callback=None, priority=PRIORITY_NORMAL):
+        """
+        Run `func(*args)` on a worker thread.
+        
+        `callback(result)` is then called from the main loop. The result is
+        None if the job raised an exception.
+        """
+        self._start()
+        self._queue.put((priority, self._order.next(), func, args, callback))
+    
+    def get_pending(self):
+        "Return the number of jobs that have not started yet."
+        return self._queue.qsize()
+    
+    def _start(self):
+        "Start the threads if they are not running yet."
+        with self._lock:
+            while len(self._threads) < self._count:
+                thread = threading.Thread(target=self._run,
+                        name="%s-%d" % (self.name, len(self._threads)))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+    
+    def _run(self):
+        "Run jobs until the program exits."
+        while True:
+            priority, order, func, args, callback = self._queue.get()
+            error = None
+            try:
+                result = func(*args)
+            except Exception:
+                error = traceback.format_exc()
+                result = None
+            # The log is shown in a GTK window, so log from the main loop.
+            gobject.idle_add(_deliver, self.name, callback, result, error)
+
+
+def _deliver(name, callback, result, error):
+    "Pass the result of a job to its callback in the main loop."
+    if error:
+        exposong.log.error('Background job in "%s" failed:\n%s', name, error)
+    if callback:
+        callback(result)
+    return False